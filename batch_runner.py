@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import warnings
+import traceback
+import multiprocessing
+import multiprocessing.connection
+from collections import deque
+
+from run_catalog import resolve_inputs
+from checkpoint_journal import DEFAULT_JOURNAL, CheckpointJournal, hash_outputs, pending_inputs
+
+# Failures worth a second attempt: the input itself may be fine
+RETRIED_FAILURES = ("timeout", "crashed", "memory")
+
+DEFAULT_TIMEOUT = 600
+DEFAULT_REPORT = "batch_report.json"
+
+
+class InputFailure(Exception):
+    """
+    Structured failure of one input: `kind` is "corrupted_file", "missing_canvas", "missing_object", ...
+    """
+
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+
+def output_folder(root_file):
+    """
+    Folder the scripts write the outputs of an input to: named after the file, in the working directory.
+    """
+    return os.path.join(os.getcwd(), os.path.splitext(os.path.basename(root_file))[0])
+
+
+def open_checked(path):
+    """
+    Opens a ROOT file for reading, raising InputFailure if it cannot be opened, is a zombie or had to be recovered
+    (truncated or not closed properly).
+    """
+    import ROOT
+    file = ROOT.TFile.Open(path, "READ")
+    if not file or not file.IsOpen() or file.IsZombie():
+        raise InputFailure("corrupted_file", f"Could not open file {path}")
+    if file.TestBit(ROOT.TFile.kRecovered):
+        file.Close()
+        raise InputFailure("corrupted_file", f"{path} was not closed properly (keys recovered)")
+    return file
+
+
+def run_maps(root_file, plan=None):
+    import save_histograms
+    plan_file = plan or save_histograms.DEFAULT_PLAN
+    open_checked(root_file).Close()
+    histograms = save_histograms.read_histograms(root_file, plan_file)
+    if not histograms:
+        raise InputFailure("missing_canvas", f"No planned [[maps]] canvas in {root_file}")
+    # Images without a stats box are still a result; the runner reports them with the "ok" record
+    return {"missing_stats": save_histograms.save_histograms_png(root_file, histograms, plan_file)}
+
+
+def run_scurve(root_file, plan=None):
+    import histogram_SCurve_plots
+    plan_file = plan or histogram_SCurve_plots.DEFAULT_PLAN
+    open_checked(root_file).Close()
+    histograms = histogram_SCurve_plots.read_histograms(root_file, plan_file)
+    if not histograms:
+        raise InputFailure("missing_canvas", f"No planned [[scurve]] canvas in {root_file}")
+    histogram_SCurve_plots.render_histograms(root_file, histograms, plan_file)
+
+
+def run_hitsperpixel(root_file, masked=None):
+    import hitsperpixel
+    if not masked:
+        raise InputFailure("missing_object", "The hitsperpixel task needs --masked=<masked pixels file>")
+    open_checked(root_file).Close()
+    masked_file = open_checked(masked)
+    has_map = bool(masked_file.Get("Masked Pixels Map"))
+    masked_file.Close()
+    if not has_map:
+        raise InputFailure("missing_object", f"No \"Masked Pixels Map\" in {masked}")
+    if not hitsperpixel.save_histograms_png(root_file, masked):
+        raise InputFailure("missing_canvas", f"No PixelAlive histogram in {root_file}")
+
+
+# Analyses the runner can apply to each input, with the options they accept
+TASKS = {
+    "maps": (run_maps, ("plan",)),
+    "scurve": (run_scurve, ("plan",)),
+    "hitsperpixel": (run_hitsperpixel, ("masked",)),
+}
+
+
+def failure_kind(error):
+    if isinstance(error, InputFailure):
+        return error.kind
+    if isinstance(error, MemoryError):
+        return "memory"
+    if isinstance(error, OSError):
+        return "io_error"
+    return "error"
+
+
+def private_memory_mb(pid):
+    """
+    Memory of a process that is not shared with others (private pages of /proc/<pid>/smaps_rollup), in MB:
+    what a worker allocated itself, without the ROOT libraries and heap it inherits from the parent.
+    Returns None if it cannot be read (process gone, no /proc).
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            kilobytes = sum(int(line.split()[1]) for line in f if line.startswith(("Private_Clean", "Private_Dirty")))
+    except (OSError, ValueError, IndexError):
+        return None
+    return kilobytes / 1024
+
+
+def _worker(task, root_file, options, connection):
+    """
+    Body of the worker process: runs the task and sends back a result record.
+    Fields returned by the task (e.g. missing_stats) and warnings raised by the scripts are recorded with the
+    result, and the files written to the output folder are hashed here, in parallel, for the checkpoint journal.
+    """
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        # One second of slack for the coarse file system timestamps
+        started = time.time() - 1
+        try:
+            details = TASKS[task][0](root_file, **options) or {}
+            result = {"status": "ok", **details, "outputs": hash_outputs(output_folder(root_file), started)}
+        except Exception as error:
+            result = {"status": "failed", "kind": failure_kind(error), "message": str(error) or type(error).__name__,
+                      "traceback": traceback.format_exc(limit=-5)}
+    result["warnings"] = [str(warning.message) for warning in caught]
+    connection.send(result)
+    connection.close()
+
+
+def _stop(process):
+    process.terminate()
+    process.join(5)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+
+def run_batch(inputs, task, options=None, timeout=DEFAULT_TIMEOUT, memory_mb=None, retries=1, jobs=1, on_result=None):
+    """
+    Runs a task on every input, each in its own worker process (at most `jobs` at once) killed after `timeout`
+    seconds or once its private memory exceeds `memory_mb` (checked by the parent about every half second; an
+    address-space limit would count the large virtual mappings of ROOT that every worker inherits).
+    A failed input never stops the batch: timeouts, crashes and memory errors are retried up to `retries` times,
+    other failures are recorded and skipped.
+    Returns one record per input (input, task, status, kind, message, attempts, seconds, warnings, and missing_stats
+    for the maps task); `on_result(record)` is called as soon as each record is final.
+    """
+    if task not in TASKS:
+        raise ValueError(f"Unknown task '{task}', expected one of {sorted(TASKS)}")
+    options = options or {}
+    pending = deque((root_file, 1) for root_file in inputs)
+    running = {}
+    records = []
+    while pending or running:
+        while pending and len(running) < jobs:
+            root_file, attempt = pending.popleft()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_worker, args=(task, root_file, options, sender),
+                                              name=f"batch-{task}", daemon=True)
+            process.start()
+            sender.close()
+            running[process.sentinel] = (process, receiver, root_file, attempt, time.monotonic())
+
+        # Wait on the pipes too: a result larger than the pipe buffer is only sent once the parent reads it,
+        # so it must be received before the worker can exit
+        receivers = [receiver for _, receiver, *_ in running.values()]
+        ready = set(multiprocessing.connection.wait(list(running) + receivers, timeout=0.5))
+        now = time.monotonic()
+        for sentinel in list(running):
+            process, receiver, root_file, attempt, start = running[sentinel]
+            if sentinel in ready or receiver in ready:
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    result = None
+                process.join()
+                if result is None:
+                    result = {"status": "failed", "kind": "crashed", "warnings": [],
+                              "message": f"Worker exited with code {process.exitcode} without a result"}
+            elif now - start > timeout:
+                _stop(process)
+                result = {"status": "failed", "kind": "timeout", "warnings": [],
+                          "message": f"No result after {timeout} s"}
+            elif memory_mb and (private_memory_mb(process.pid) or 0) > memory_mb:
+                _stop(process)
+                result = {"status": "failed", "kind": "memory", "warnings": [],
+                          "message": f"Private memory above {memory_mb} MB"}
+            else:
+                continue
+            del running[sentinel]
+            receiver.close()
+
+            result.update(input=root_file, task=task, attempts=attempt, seconds=round(now - start, 2))
+            if result["status"] != "ok" and result["kind"] in RETRIED_FAILURES and attempt <= retries:
+                print(f"{root_file}: {result['kind']} ({result['message']}), retrying")
+                pending.append((root_file, attempt + 1))
+                continue
+            if result["status"] == "ok":
+                missing_stats = result.get("missing_stats")
+                print(f"{root_file}: ok in {result['seconds']} s"
+                      + (f", without stats box: {', '.join(missing_stats)}" if missing_stats else ""))
+            else:
+                print(f"{root_file}: {result['kind']} - {result['message']}")
+            records.append(result)
+            if on_result is not None:
+                on_result(result)
+    return records
+
+
+def write_report(records, report_file=DEFAULT_REPORT):
+    """
+    Writes the batch records to a JSON file and prints the failure counts per kind, and how many of the
+    processed inputs have images without a stats box.
+    """
+    with open(report_file, "w") as f:
+        json.dump(records, f, indent=2)
+    failures = {}
+    for record in records:
+        if record["status"] != "ok":
+            failures[record["kind"]] = failures.get(record["kind"], 0) + 1
+    ok = sum(record["status"] == "ok" for record in records)
+    missing_stats = sum(bool(record.get("missing_stats")) for record in records)
+    summary = ", ".join(f"{count} {kind}" for kind, count in sorted(failures.items()))
+    print(f"{ok}/{len(records)} inputs processed"
+          + (f" ({missing_stats} ok with a missing stats box)" if missing_stats else "")
+          + (f"; failures: {summary}" if summary else "") + f" -> {report_file}")
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if len(arguments) < 2 or arguments[0] not in TASKS:
+        print(f"Usage: python batch_runner.py {{{'|'.join(TASKS)}}} file1.root [file2.root ...] | \"catalog:scan=SCurve,run>15\" "
+              "[--timeout=600] [--memory=4000] [--retries=1] [--jobs=4] [--masked=masked.root] [--plan=plot_plan.toml] "
+              "[--report=batch_report.json] [--journal=batch_journal.jsonl] [--resume [--verify]]")
+        sys.exit(1)
+    task = arguments[0]
+    task_options = {name: options[name] for name in TASKS[task][1] if name in options}
+    journal_file = options.get("journal", DEFAULT_JOURNAL)
+    inputs = resolve_inputs(arguments[1:])
+    if "--resume" in sys.argv:
+        # Only the units missing from the journal, failed or out of date are run again
+        inputs = pending_inputs(inputs, task, task_options, journal_file, verify="--verify" in sys.argv)
+    with CheckpointJournal(journal_file) as journal:
+        records = run_batch(inputs, task, task_options,
+                            timeout=float(options.get("timeout", DEFAULT_TIMEOUT)),
+                            memory_mb=int(options["memory"]) if "memory" in options else None,
+                            retries=int(options.get("retries", 1)),
+                            jobs=int(options.get("jobs", os.cpu_count() or 1)),
+                            on_result=lambda record: journal.record(record, task_options))
+    write_report(records, options.get("report", DEFAULT_REPORT))
+    sys.exit(0 if all(record["status"] == "ok" for record in records) else 2)
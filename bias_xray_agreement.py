@@ -0,0 +1,221 @@
+import ROOT
+import sys
+import csv
+import numpy as np
+from array import array
+
+from pixel_arrays import array_to_pixel_map
+from pixel_geometry import to_index, index_to_mask
+from shift_correlation import read_shift_maps
+from mask_writer import load_positions
+
+# Window grids scanned by default (|shift| <= window flags a bump as disconnected)
+DEFAULT_THRESHOLD_WINDOWS = np.arange(5, 105, 5, dtype=np.float64)
+DEFAULT_NOISE_WINDOWS = np.arange(1, 31, 1, dtype=np.float64)
+
+
+def _cumulative_counts(threshold_index, noise_index, n_thr, n_noise):
+    # counts[k, l] = number of pixels with threshold_index <= k and noise_index <= l
+    counts = np.bincount(threshold_index * (n_noise + 1) + noise_index, minlength=(n_thr + 1) * (n_noise + 1))
+    counts = counts.reshape(n_thr + 1, n_noise + 1).cumsum(axis=0).cumsum(axis=1)
+    return counts[:n_thr, :n_noise]
+
+
+def agreement_grid(threshold_shift, noise_shift, xray_mask, threshold_windows=DEFAULT_THRESHOLD_WINDOWS,
+                   noise_windows=DEFAULT_NOISE_WINDOWS, valid=None):
+    """
+    Confusion matrix between the forward/reverse bias defect mask and the X-ray defect mask for every
+    (threshold window, noise window) pair at once. A pixel is flagged by the bias method when both
+    |threshold shift| and |noise shift| are within the windows, as in plotsreverse.py.
+    Each pixel is reduced to the first window of each grid that contains it; counting those index pairs and
+    cumulating along both axes gives all grid points in one pass over the map.
+    Returns a dict of (threshold windows x noise windows) arrays.
+    """
+    threshold_windows = np.sort(np.asarray(threshold_windows, dtype=np.float64))
+    noise_windows = np.sort(np.asarray(noise_windows, dtype=np.float64))
+    valid = np.ones(np.shape(threshold_shift), dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+    valid = valid & np.isfinite(threshold_shift) & np.isfinite(noise_shift)
+
+    threshold_index = np.searchsorted(threshold_windows, np.abs(threshold_shift[valid]), side="left")
+    noise_index = np.searchsorted(noise_windows, np.abs(noise_shift[valid]), side="left")
+    xray = np.asarray(xray_mask, dtype=bool)[valid]
+    n_thr, n_noise = len(threshold_windows), len(noise_windows)
+
+    flagged = _cumulative_counts(threshold_index, noise_index, n_thr, n_noise)
+    true_positive = _cumulative_counts(threshold_index[xray], noise_index[xray], n_thr, n_noise)
+    n_xray = int(xray.sum())
+    n_pixels = int(valid.sum())
+
+    false_positive = flagged - true_positive
+    false_negative = n_xray - true_positive
+    with np.errstate(invalid="ignore", divide="ignore"):
+        efficiency = true_positive / n_xray if n_xray else np.full(flagged.shape, np.nan)
+        purity = np.where(flagged > 0, true_positive / np.maximum(flagged, 1), np.nan)
+    return {
+        "threshold_windows": threshold_windows,
+        "noise_windows": noise_windows,
+        "flagged": flagged,
+        "true_positive": true_positive,
+        "false_positive": false_positive,
+        "false_negative": false_negative,
+        "true_negative": n_pixels - flagged - false_negative,
+        "efficiency": efficiency,
+        "purity": purity,
+    }
+
+
+def write_agreement_table(grid, table_path):
+    """
+    Writes the confusion matrix of every grid point as one CSV row.
+    """
+    columns = ["flagged", "true_positive", "false_positive", "false_negative", "true_negative", "efficiency", "purity"]
+    with open(table_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["threshold_window", "noise_window"] + columns)
+        for k, threshold_window in enumerate(grid["threshold_windows"]):
+            for l, noise_window in enumerate(grid["noise_windows"]):
+                writer.writerow([threshold_window, noise_window] + [grid[column][k, l] for column in columns])
+    print(f"Agreement table saved: {table_path}")
+
+
+def draw_efficiency_purity(grid, noise_window, output_file, name="Agreement"):
+    """
+    Draws efficiency and purity versus the threshold window, at the noise window closest to the given one.
+    """
+    l = int(np.argmin(np.abs(grid["noise_windows"] - noise_window)))
+    x = array("d", grid["threshold_windows"])
+    efficiency = ROOT.TGraph(len(x), x, array("d", np.nan_to_num(grid["efficiency"][:, l])))
+    purity = ROOT.TGraph(len(x), x, array("d", np.nan_to_num(grid["purity"][:, l])))
+
+    canvas = ROOT.TCanvas("canvas_agreement", "Efficiency and purity", 1150, 800)
+    canvas.SetLeftMargin(0.12)
+    canvas.SetRightMargin(0.1)
+    efficiency.SetTitle(";Threshold Shift Window (#DeltaVcal);Fraction")
+    efficiency.SetLineColor(ROOT.kRed)
+    efficiency.SetMarkerColor(ROOT.kRed)
+    purity.SetLineColor(ROOT.kBlue)
+    purity.SetMarkerColor(ROOT.kBlue)
+    for graph in (efficiency, purity):
+        graph.SetLineWidth(2)
+        graph.SetMarkerStyle(20)
+    efficiency.Draw("APL")
+    efficiency.GetYaxis().SetRangeUser(0, 1.05)
+    efficiency.GetXaxis().SetTitleSize(34)
+    efficiency.GetXaxis().SetTitleFont(43)
+    efficiency.GetYaxis().SetTitleSize(34)
+    efficiency.GetYaxis().SetTitleFont(43)
+    efficiency.GetXaxis().SetLabelSize(0.04)
+    efficiency.GetYaxis().SetLabelSize(0.04)
+    purity.Draw("PL SAME")
+
+    legend = ROOT.TLegend(0.6, 0.17, 0.88, 0.32)
+    legend.SetTextSize(0.034)
+    legend.AddEntry(efficiency, "Efficiency", "lp")
+    legend.AddEntry(purity, "Purity", "lp")
+    legend.AddEntry(ROOT.nullptr, f"Noise window {grid['noise_windows'][l]:g}", "")
+    legend.Draw()
+    canvas.Update()
+
+    image_name = f"{name}_Efficiency_Purity.png"
+    canvas.SaveAs(image_name)
+    print(f"Histogram image saved at: {image_name}")
+    output_file.cd()
+    canvas.Write(f"{name}_Efficiency_Purity")
+
+
+def draw_comparison_map(threshold_shift, noise_shift, xray_mask, threshold_window, noise_window, output_file,
+                        name="Agreement"):
+    """
+    Comparison map of one window choice (common / bias method only / X-ray only) with the live counts in the legend.
+    """
+    fwd_reverse = (np.abs(threshold_shift) <= threshold_window) & (np.abs(noise_shift) <= noise_window)
+    xray_mask = np.asarray(xray_mask, dtype=bool)
+    labels = np.zeros(fwd_reverse.shape)
+    labels[xray_mask & ~fwd_reverse] = 1  # Xrays only in green
+    labels[fwd_reverse & ~xray_mask] = 2  # Fwd_reverse only in blue
+    labels[fwd_reverse & xray_mask] = 3  # Common positions in red
+    counts = {label: int((labels == label).sum()) for label in (1, 2, 3)}
+
+    bump_bonds = array_to_pixel_map(labels, "Bump Bonds", entries=sum(counts.values()))
+    bump_bonds.SetStats(0)
+    bump_bonds.GetZaxis().SetRangeUser(1, 3)
+    colors = [ROOT.kGreen, ROOT.kBlue, ROOT.kRed]
+    ROOT.gStyle.SetPalette(len(colors), array('i', colors))
+
+    canvas = ROOT.TCanvas("canvas2d", "Comparison of Bump Bonds", 1150, 800)
+    canvas.SetLeftMargin(0.12)
+    canvas.SetRightMargin(0.1)
+    bump_bonds.SetXTitle("Column")
+    bump_bonds.SetYTitle("Row")
+    bump_bonds.GetXaxis().SetTitleSize(34)
+    bump_bonds.GetXaxis().SetTitleFont(43)
+    bump_bonds.GetYaxis().SetTitleSize(34)
+    bump_bonds.GetYaxis().SetTitleFont(43)
+    bump_bonds.GetXaxis().SetLabelSize(0.04)
+    bump_bonds.GetYaxis().SetLabelSize(0.04)
+    bump_bonds.Draw("col")
+
+    legend = ROOT.TLegend(0.17, 0.74, 0.48, 0.87)
+    legend.SetTextSize(0.034)
+    legend.SetMargin(0.08)
+    boxes = {}
+    for label, color, text in ((3, ROOT.kRed, "Common Bump Bonds"), (2, ROOT.kBlue, "Fwd_Reverse Only"),
+                               (1, ROOT.kGreen, "Xrays Only")):
+        boxes[label] = ROOT.TBox()
+        boxes[label].SetFillColor(color)
+        legend.AddEntry(boxes[label], f"{text}: {counts[label]}", "f")
+    legend.Draw()
+    canvas.Modified()
+    canvas.Update()
+
+    image_name = f"{name}_Bump_Bonds_{threshold_window:g}_{noise_window:g}.png"
+    canvas.SaveAs(image_name)
+    print(f"Histogram image saved at: {image_name}")
+    print(f"Common: {counts[3]}, Xrays: {counts[1]}, Fwd:{counts[2]}")
+    output_file.cd()
+    canvas.Write(f"{name}_Bump_Bonds")
+
+
+def xray_mask_from_file(positions_file):
+    """
+    Boolean (rows, columns) map of the X-ray defects listed in Bump_bonds_Xray.txt (1-based bin indices).
+    """
+    return index_to_mask(to_index(load_positions(positions_file, one_based=True), "config"))
+
+
+def parse_windows(text):
+    """
+    Window grid from "start:stop:step" or "w1,w2,...".
+    """
+    if ":" in text:
+        start, stop, step = (float(value) for value in text.split(":"))
+        return np.arange(start, stop + step / 2, step)
+    return np.array([float(value) for value in text.split(",")])
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if len(arguments) < 3:
+        print("Usage: python bias_xray_agreement.py Run_fwd_SCurve.root Run_rev_SCurve.root Bump_bonds_Xray.txt "
+              "[--chip=15] [--threshold-windows=5:100:5] [--noise-windows=1:30:1] [--window=40,15]")
+        sys.exit(1)
+
+    chip = options.get("chip", "15")
+    threshold_shift = read_shift_maps(arguments[0], arguments[1], "Threshold").get(chip)
+    noise_shift = read_shift_maps(arguments[0], arguments[1], "Noise").get(chip)
+    if threshold_shift is None or noise_shift is None:
+        print(f"Threshold2D/Noise2D maps of chip {chip} not found.")
+        sys.exit(1)
+    xray_mask = xray_mask_from_file(arguments[2])
+    threshold_windows = parse_windows(options["threshold-windows"]) if "threshold-windows" in options else DEFAULT_THRESHOLD_WINDOWS
+    noise_windows = parse_windows(options["noise-windows"]) if "noise-windows" in options else DEFAULT_NOISE_WINDOWS
+    threshold_window, noise_window = (float(v) for v in options.get("window", "40,15").split(","))
+
+    grid = agreement_grid(threshold_shift, noise_shift, xray_mask, threshold_windows, noise_windows)
+    write_agreement_table(grid, f"Agreement_Chip{chip}.csv")
+
+    output_file = ROOT.TFile("Agreement.root", "RECREATE")
+    draw_efficiency_purity(grid, noise_window, output_file)
+    draw_comparison_map(threshold_shift, noise_shift, xray_mask, threshold_window, noise_window, output_file)
+    output_file.Close()
@@ -0,0 +1,162 @@
+import ROOT
+import sys
+import os
+import re
+import csv
+import numpy as np
+
+from pixel_arrays import iter_canvas_histograms, hist_to_array
+
+# Per-pixel maps summarised for each chip, with the 1D distribution used for the Gaussian fit
+SUMMARY_MAPS = {
+    "Threshold2D": ("Threshold", "Threshold1D"),
+    "Noise2D": ("Noise", "Noise1D"),
+    "PixelAlive": ("Occupancy", None),
+}
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+COLUMNS = ["path", "run", "scan", "module", "chip", "quantity", "entries", "mean", "std",
+           "q05", "q25", "q50", "q75", "q95", "fit_mean", "fit_sigma", "defects"]
+
+CANVAS_PATTERN = re.compile(r"_(\w+?)_Chip\((\d+)\)$")
+
+
+def parse_run_file(path):
+    """
+    Returns (run number, scan type) from a DAQ result name such as Run000017_SCurve.root, or (None, None).
+    """
+    match = re.match(r"Run(\d+)_(\w+?)\.(root|txt)$", os.path.basename(path))
+    if not match:
+        return None, None
+    return int(match.group(1)), match.group(2)
+
+
+def module_from_path(path):
+    """
+    Returns the module/wafer label of a result file (e.g. w7-24 from ../tuning_sensor_w7-24/Results/...),
+    falling back to the name of the directory holding Results.
+    """
+    match = re.search(r"w\d+-\d+", path)
+    if match:
+        return match.group(0)
+    parts = os.path.normpath(os.path.abspath(path)).split(os.sep)
+    if "Results" in parts:
+        return parts[parts.index("Results") - 1]
+    return os.path.basename(os.path.dirname(os.path.abspath(path)))
+
+
+def array_statistics(values):
+    """
+    Entries, mean, standard deviation and quantiles of the valid (finite, non-zero) pixels of a map.
+    Pixels with a zero or non-finite value are reported as defects.
+    """
+    values = np.asarray(values, dtype=np.float64).ravel()
+    valid = np.isfinite(values) & (values != 0)
+    good = values[valid]
+    stats = {"entries": int(good.size), "defects": int(values.size - good.size)}
+    if good.size == 0:
+        stats.update({"mean": np.nan, "std": np.nan})
+        stats.update({f"q{int(q * 100):02d}": np.nan for q in QUANTILES})
+        return stats
+
+    # Mean and variance from the running sums of a single pass over the array
+    total = good.sum()
+    total_sq = np.dot(good, good)
+    mean = total / good.size
+    stats["mean"] = mean
+    stats["std"] = np.sqrt(max(total_sq / good.size - mean * mean, 0.0))
+    for q, value in zip(QUANTILES, np.quantile(good, QUANTILES)):
+        stats[f"q{int(q * 100):02d}"] = value
+    return stats
+
+
+def fit_gaussian(hist, center, width):
+    """
+    Fits a Gaussian to a 1D distribution in a +-2 sigma window around the given center and returns (mean, sigma).
+    """
+    if hist is None or hist.GetEntries() == 0 or not np.isfinite(center) or not width > 0:
+        return np.nan, np.nan
+    fit_result = hist.Fit("gaus", "QS0", "", center - 2 * width, center + 2 * width)
+    if not fit_result.Get() or fit_result.Status() != 0:
+        return np.nan, np.nan
+    return fit_result.Parameter(1), abs(fit_result.Parameter(2))
+
+
+def summarize_file(root_file):
+    """
+    Yields one summary row per chip and map type of a result file.
+    """
+    run, scan = parse_run_file(root_file)
+    module = module_from_path(root_file)
+    file = ROOT.TFile.Open(root_file, "READ")
+    if not file or not file.IsOpen():
+        print(f"Could not open file {root_file}")
+        return
+
+    # Single key walk: keep only the maps and 1D distributions listed in SUMMARY_MAPS
+    wanted = set(SUMMARY_MAPS) | {fit_name for _, fit_name in SUMMARY_MAPS.values() if fit_name}
+    maps, distributions = {}, {}
+    pattern = r"_(" + "|".join(sorted(wanted)) + r")_Chip\(\d+\)$"
+    for name, hist in iter_canvas_histograms(file, pattern):
+        kind, chip = CANVAS_PATTERN.search(name).groups()
+        if kind in SUMMARY_MAPS:
+            maps[(kind, int(chip))] = hist_to_array(hist)
+        else:
+            distributions[(kind, int(chip))] = hist
+    file.Close()
+
+    for (kind, chip), values in sorted(maps.items()):
+        quantity, fit_name = SUMMARY_MAPS[kind]
+        stats = array_statistics(values)
+        fit_mean, fit_sigma = fit_gaussian(distributions.get((fit_name, chip)), stats["q50"],
+                                           (stats["q75"] - stats["q25"]) / 1.349)
+        yield {"path": root_file, "run": run, "scan": scan, "module": module, "chip": chip,
+               "quantity": quantity, "fit_mean": fit_mean, "fit_sigma": fit_sigma, **stats}
+
+
+def find_result_files(results_tree):
+    """
+    Walks a campaign tree and returns the Run*.root result files, ordered by path.
+    """
+    found = []
+    for dirpath, _, filenames in os.walk(results_tree):
+        for filename in filenames:
+            if filename.endswith(".root") and parse_run_file(filename)[0] is not None:
+                found.append(os.path.join(dirpath, filename))
+    return sorted(found)
+
+
+def write_summary(results_tree, output_path):
+    """
+    Summarises every result file of a campaign into a single CSV (streamed row by row) or Parquet table.
+    """
+    files = find_result_files(results_tree)
+    rows = (row for root_file in files for row in summarize_file(root_file))
+
+    if output_path.endswith(".parquet"):
+        try:
+            import pandas as pd
+        except ImportError:
+            print("Writing Parquet requires pandas (and pyarrow); use a .csv output instead.")
+            return
+        table = pd.DataFrame(list(rows), columns=COLUMNS)
+        table.to_parquet(output_path, index=False)
+        n_rows = len(table)
+    else:
+        n_rows = 0
+        with open(output_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                n_rows += 1
+    print(f"Summary of {len(files)} files ({n_rows} rows) written to {output_path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python campaign_summary.py <results_tree> [summary.csv|summary.parquet]")
+        sys.exit(1)
+    ROOT.gROOT.SetBatch(True)
+    write_summary(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "campaign_summary.csv")
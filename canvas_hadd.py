@@ -0,0 +1,130 @@
+import ROOT
+import sys
+import re
+import fnmatch
+import multiprocessing
+import numpy as np
+
+from pixel_arrays import iter_canvas_histograms
+
+
+def hist_buffers(hist):
+    """
+    Returns (contents, sum of squared weights) of a histogram as flat float64 arrays including under/overflow bins.
+    Histograms filled without weights have no Sumw2 array and use their contents instead.
+    """
+    n_cells = hist.GetNcells()
+    view = hist.GetArray()
+    view.reshape((n_cells,))
+    contents = np.array(view, dtype=np.float64)
+    if hist.GetSumw2N() == n_cells:
+        sumw2_view = hist.GetSumw2().GetArray()
+        sumw2_view.reshape((n_cells,))
+        sumw2 = np.array(sumw2_view, dtype=np.float64)
+    else:
+        sumw2 = contents.copy()
+    return contents, sumw2
+
+
+def glob_to_regex(pattern):
+    """
+    Canvas name patterns are shell-style globs ("*PixelAlive_Chip(*)") matched against the whole name;
+    parentheses are literal.
+    """
+    return "^" + fnmatch.translate(pattern)
+
+
+def partial_sum(root_files, pattern):
+    """
+    Sums, file by file, the histograms of all canvases matching the pattern.
+    Only one file is open at a time and one accumulator is kept per canvas name.
+    Returns {canvas name: [contents, sumw2, entries, first file]}.
+    """
+    sums = {}
+    regex = glob_to_regex(pattern)
+    for root_file in root_files:
+        file = ROOT.TFile.Open(root_file, "READ")
+        if not file or not file.IsOpen():
+            print(f"Could not open file {root_file}, skipped")
+            continue
+        for name, hist in iter_canvas_histograms(file, regex):
+            contents, sumw2 = hist_buffers(hist)
+            if name not in sums:
+                sums[name] = [contents, sumw2, hist.GetEntries(), root_file]
+            elif sums[name][0].shape != contents.shape:
+                print(f"{name} in {root_file} has a different binning, skipped")
+            else:
+                sums[name][0] += contents
+                sums[name][1] += sumw2
+                sums[name][2] += hist.GetEntries()
+        file.Close()
+    return sums
+
+
+def _partial_sum_worker(arguments):
+    return partial_sum(*arguments)
+
+
+def merge_sums(total, other):
+    """
+    Adds the partial sums of another group of files into `total`.
+    """
+    for name, (contents, sumw2, entries, first_file) in other.items():
+        if name not in total:
+            total[name] = [contents, sumw2, entries, first_file]
+        elif total[name][0].shape == contents.shape:
+            total[name][0] += contents
+            total[name][1] += sumw2
+            total[name][2] += entries
+    return total
+
+
+def merge_canvas_histograms(root_files, pattern, jobs=1):
+    """
+    Sums the canvas histograms matching the pattern over all files, optionally as parallel partial sums over
+    `jobs` groups of files.
+    """
+    if jobs <= 1 or len(root_files) < 2:
+        return partial_sum(root_files, pattern)
+    groups = [root_files[i::jobs] for i in range(jobs) if root_files[i::jobs]]
+    total = {}
+    with multiprocessing.Pool(len(groups)) as pool:
+        for sums in pool.imap_unordered(_partial_sum_worker, [(group, pattern) for group in groups]):
+            merge_sums(total, sums)
+    return total
+
+
+def write_merged(sums, output_path):
+    """
+    Writes the merged histograms as top-level objects named after their canvas. The binning, titles and style
+    come from the histogram of the first file that contained it.
+    """
+    output_file = ROOT.TFile(output_path, "RECREATE")
+    for name, (contents, sumw2, entries, first_file) in sorted(sums.items()):
+        file = ROOT.TFile.Open(first_file, "READ")
+        template = next(hist for _, hist in iter_canvas_histograms(file, f"^{re.escape(name)}$"))
+        file.Close()
+
+        merged = template.Clone(name)
+        merged.Reset()
+        merged.SetContent(np.ascontiguousarray(contents))
+        merged.Sumw2(True)
+        merged.GetSumw2().Set(len(sumw2), np.ascontiguousarray(sumw2))
+        merged.SetEntries(entries)
+        output_file.cd()
+        merged.Write(name)
+        print(f"Merged {name}: {entries:.0f} entries")
+    output_file.Close()
+    print(f"Merged histograms written to {output_path}")
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if len(arguments) < 2:
+        print("Usage: python canvas_hadd.py merged.root input1.root input2.root ... "
+              "[--pattern=*PixelAlive_Chip(*)] [--jobs=4]")
+        sys.exit(1)
+    ROOT.gROOT.SetBatch(True)
+    sums = merge_canvas_histograms(arguments[1:], options.get("pattern", "*"), int(options.get("jobs", 1)))
+    write_merged(sums, arguments[0])
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import hashlib
+
+DEFAULT_JOURNAL = "batch_journal.jsonl"
+
+
+def file_hash(path):
+    """
+    SHA-256 of a file, read in chunks.
+    """
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def input_fingerprint(path):
+    """
+    (size, modification time in ns) of an input file, to rerun units whose input changed since they were journaled.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def hash_outputs(folder, since):
+    """
+    Returns {path: sha256} of the files of an output folder written at or after the time `since`.
+    """
+    outputs = {}
+    if not os.path.isdir(folder):
+        return outputs
+    for entry in sorted(os.scandir(folder), key=lambda entry: entry.name):
+        if entry.is_file() and entry.stat().st_mtime >= since:
+            outputs[entry.path] = file_hash(entry.path)
+    return outputs
+
+
+def unit_key(root_file, task, options=None):
+    """
+    Identifies one (file, analysis) unit; different options make a different unit.
+    """
+    return json.dumps([os.path.abspath(root_file), task, options or {}], sort_keys=True)
+
+
+class CheckpointJournal:
+    """
+    Append-only JSON-lines journal of finished (file, analysis) units. Every record is written with one write()
+    on a file opened with O_APPEND, so records of concurrent writers never interleave, and a line cut by a crash
+    is ignored when the journal is read back. Later records of a unit supersede earlier ones.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL, sync=False):
+        self.path = path
+        self.sync = sync
+        self._fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        # Terminate a line cut by an earlier crash so the next record starts on its own line
+        size = os.fstat(self._fd).st_size
+        if size and os.pread(self._fd, 1, size - 1) != b"\n":
+            os.write(self._fd, b"\n")
+
+    def append(self, record):
+        line = json.dumps(record, sort_keys=True, separators=(",", ":")) + "\n"
+        os.write(self._fd, line.encode())
+        if self.sync:
+            os.fsync(self._fd)
+
+    def record(self, result, options=None):
+        """
+        Journals a batch runner result with the unit key, the input fingerprint and the hashes of its outputs.
+        """
+        self.append({"key": unit_key(result["input"], result["task"], options), "input": os.path.abspath(result["input"]),
+                     "task": result["task"], "status": result["status"], "kind": result.get("kind"),
+                     "fingerprint": input_fingerprint(result["input"]), "outputs": result.get("outputs", {}),
+                     "time": time.time()})
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_journal(path=DEFAULT_JOURNAL):
+    """
+    Returns the latest record of every unit in a journal (unit key -> record); unreadable lines are skipped.
+    """
+    latest = {}
+    if not os.path.exists(path):
+        return latest
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            latest[record["key"]] = record
+    return latest
+
+
+def is_complete(record, verify=False):
+    """
+    A unit is complete if it succeeded, its input did not change and its outputs are still there
+    (with the journaled content if `verify`).
+    """
+    if record is None or record["status"] != "ok":
+        return False
+    if record["fingerprint"] != input_fingerprint(record["input"]):
+        return False
+    for path, digest in record["outputs"].items():
+        if not os.path.exists(path) or (verify and file_hash(path) != digest):
+            return False
+    return True
+
+
+def pending_inputs(inputs, task, options=None, path=DEFAULT_JOURNAL, verify=False):
+    """
+    Keeps the inputs whose unit is missing from the journal, failed, or is out of date.
+    """
+    latest = read_journal(path)
+    pending = [root_file for root_file in inputs
+               if not is_complete(latest.get(unit_key(root_file, task, options)), verify)]
+    skipped = len(inputs) - len(pending)
+    if skipped:
+        print(f"Resuming from {path}: {skipped} completed units skipped, {len(pending)} to run")
+    return pending
@@ -0,0 +1,104 @@
+import ROOT
+import numpy as np
+from array import array
+
+from pixel_arrays import array_to_pixel_map
+
+COMPRESSION_ALGORITHMS = ("ZSTD", "LZ4", "ZLIB", "LZMA")
+
+
+def compression_settings(algorithm="ZSTD", level=5):
+    """
+    Returns the ROOT compression setting (algorithm * 100 + level) for an algorithm name.
+    """
+    algorithm = algorithm.upper()
+    if algorithm not in COMPRESSION_ALGORITHMS:
+        raise ValueError(f"Unknown compression algorithm '{algorithm}', expected one of {COMPRESSION_ALGORITHMS}")
+    return ROOT.CompressionSettings(getattr(ROOT.RCompressionSetting.EAlgorithm, f"k{algorithm}"), int(level))
+
+
+class OutputWriter:
+    """
+    Output ROOT file holding the underlying results as top-level objects: histograms, label maps and tables.
+    Canvases are only stored when keep_canvases is set, since each one carries its own copy of the histograms
+    plus palettes, legends and boxes.
+    """
+
+    def __init__(self, path, algorithm="ZSTD", level=5, keep_canvases=False):
+        self.path = path
+        self.keep_canvases = keep_canvases
+        self.file = ROOT.TFile(path, "RECREATE", "", compression_settings(algorithm, level))
+
+    def IsOpen(self):
+        return self.file.IsOpen()
+
+    def write(self, obj, name=None):
+        """
+        Writes a histogram, graph or any other TObject under the given name.
+        """
+        self.file.cd()
+        obj.Write(name or obj.GetName(), ROOT.TObject.kOverwrite)
+
+    def write_canvas(self, canvas, name):
+        """
+        Writes a canvas, only if canvases are kept.
+        """
+        if self.keep_canvases:
+            self.write(canvas, name)
+            print(f"Canvas written to ROOT file as {name}")
+
+    def write_label_map(self, labels, name):
+        """
+        Writes a (rows, columns) map of small integer labels as a compact TH2S.
+        """
+        labels = np.asarray(labels)
+        hist = array_to_pixel_map(labels, name, entries=int(np.count_nonzero(labels)), hist_type=ROOT.TH2S)
+        self.write(hist, name)
+
+    def write_table(self, name, columns):
+        """
+        Writes a table given as {column name: 1D array} as a TTree with one numeric branch per column.
+        """
+        self.file.cd()
+        tree = ROOT.TTree(name, name)
+        buffers = {}
+        n_rows = len(next(iter(columns.values()))) if columns else 0
+        for column, values in columns.items():
+            if len(values) != n_rows:
+                raise ValueError(f"Column {column} of table {name} has {len(values)} rows, expected {n_rows}")
+            buffers[column] = array("d", [0.0])
+            tree.Branch(column, buffers[column], f"{column}/D")
+        data = {column: np.asarray(values, dtype=np.float64) for column, values in columns.items()}
+        for row in range(n_rows):
+            for column, buffer in buffers.items():
+                buffer[0] = data[column][row]
+            tree.Fill()
+        tree.Write(name, ROOT.TObject.kOverwrite)
+
+    def cd(self):
+        self.file.cd()
+
+    def Close(self):
+        self.file.Close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+        return False
+
+
+def parse_output_options(arguments):
+    """
+    Reads --compression=ALGORITHM[:level] and --keep-canvases from the command line arguments.
+    Returns the keyword arguments of OutputWriter.
+    """
+    options = {"algorithm": "ZSTD", "level": 5, "keep_canvases": "--keep-canvases" in arguments}
+    for argument in arguments:
+        if argument.startswith("--compression="):
+            algorithm, _, level = argument.split("=", 1)[1].partition(":")
+            options["algorithm"] = algorithm
+            if level:
+                options["level"] = int(level)
+    return options
@@ -1,6 +1,16 @@
 import ROOT
 import sys
 import os
+import functools
+
+from vcal_calibration import axis_to_electrons, chip_from_name
+from run_catalog import resolve_inputs
+from pixel_arrays import iter_canvas_histograms
+from prefetch import prefetch, slow_loader, parse_prefetch_options
+from plot_plan import DEFAULT_PLAN, load_plot_plan, apply_style, parse_plan_option
+
+# Gaussian fit windows used when no window is given (2000 electrons tuning)
+DEFAULT_FIT_RANGES = {"Noise": (19, 27), "Threshold": (360, 440)}
 
 def format_stats_box(prim, fit_function, perform_fit, title, newaxis_title):
     """
@@ -67,9 +77,11 @@ def format_stats_box(prim, fit_function, perform_fit, title, newaxis_title):
     return title_box, stats_box
     
     
-def draw_and_save_histogram(prim, canvas, output_folder, newaxis_title, x1_pos, x2_pos, xe_pos, ye_pos, is_log=False, name_suffix="", add_axis=False, x_cut=None, perform_fit=False, colz=False):
+def draw_and_save_histogram(prim, canvas, output_folder, newaxis_title, x1_pos, x2_pos, is_log=False, name_suffix="", add_axis=False, x_cut=None, perform_fit=False, colz=False, xe_pos=None, ye_pos=None, fit_range=None, style=None):
     """
     Draws and saves a histogram to a specified path, with options for logarithmic scale, axis customization, and fitting.
+    The electron range of the additional axis is taken from the chip calibration unless xe_pos/ye_pos are given.
+    The fit window defaults to DEFAULT_FIT_RANGES and the axis style to the default preset of the plot plan.
     """
     canvas.cd()  # Set the current canvas
     ROOT.gStyle.SetOptStat(0)  # Disable the default statistics box
@@ -112,12 +124,8 @@ def draw_and_save_histogram(prim, canvas, output_folder, newaxis_title, x1_pos,
   
     # Perform fitting if specified
     if perform_fit:
-        if newaxis_title == "Noise":
-            #fit_result = prim.Fit("gaus", "S+", "", 19.5, 27.5) #1000 electrons
-            fit_result = prim.Fit("gaus", "S+", "", 19, 27)  #2000 electrons
-        elif newaxis_title == "Threshold":
-            #fit_result = prim.Fit("gaus", "S", "", 140, 240) #1000 electrons
-            fit_result = prim.Fit("gaus", "S+", "", 360, 440) #2000 electrons
+        fit_min, fit_max = fit_range or DEFAULT_FIT_RANGES[newaxis_title]
+        fit_result = prim.Fit("gaus", "S+", "", fit_min, fit_max)
         fit_function = prim.GetFunction("gaus")
         fit_function.SetLineColor(ROOT.kRed)
         fit_function.Draw("same") 
@@ -125,15 +133,7 @@ def draw_and_save_histogram(prim, canvas, output_folder, newaxis_title, x1_pos,
     canvas.Update() # Update the canvas to reflect changes
 
     # Configure title and axis properties    
-    prim.GetXaxis().SetTitleSize(34)
-    prim.GetXaxis().SetTitleFont(43)
-    prim.GetYaxis().SetTitleSize(34)
-    prim.GetYaxis().SetTitleFont(43)
-    prim.GetZaxis().SetTitleSize(34) 
-    prim.GetZaxis().SetTitleFont(43) 
-    prim.GetZaxis().SetTitleOffset(1.8)
-    prim.GetXaxis().SetLabelSize(0.04) 
-    prim.GetYaxis().SetLabelSize(0.04)  
+    apply_style(prim, style)
 
     # Draw and display the title and statistics boxes
     title, stats_box = format_stats_box(prim, fit_function if perform_fit else None, perform_fit, f"{newaxis_title} w7-24", newaxis_title)
@@ -148,6 +148,8 @@ def draw_and_save_histogram(prim, canvas, output_folder, newaxis_title, x1_pos,
         # Adjust y-position based on log scale
         y_pos = ROOT.gPad.GetUymax() if not is_log else 10**ROOT.gPad.GetUymax()
         # Create the second axis, conversion to electrons
+        if xe_pos is None or ye_pos is None:
+            xe_pos, ye_pos = axis_to_electrons(x1_pos, x2_pos, chip_from_name(prim.GetName()), newaxis_title)
         new_axis = ROOT.TGaxis(x1_pos, y_pos, x2_pos, y_pos, xe_pos, ye_pos, 510, "-L")
         new_axis.SetTitle(f"Charge (electrons)")
         new_axis.SetLabelFont(43)
@@ -165,12 +167,25 @@ def draw_and_save_histogram(prim, canvas, output_folder, newaxis_title, x1_pos,
     print(f"Histogram saved: {file_path}") # Print confirmation message
 
 
-def save_histograms_png(root_file):
-    # Open ROOT File
+def read_histograms(root_file, plan_file=DEFAULT_PLAN):
+    """
+    Opens a ROOT file and returns detached copies of the histograms of the [[scurve]] plot plan as
+    (canvas name, histogram) pairs, so the file can be closed (or read in another process) before rendering.
+    """
     file = ROOT.TFile.Open(root_file, "READ")
-    if not file.IsOpen():
+    if not file or not file.IsOpen():
         print(f"Could not open file {root_file}")
-        return
+        return None
+    histograms = list(iter_canvas_histograms(file, load_plot_plan("scurve", plan_file).pattern))
+    file.Close()
+    return histograms
+
+
+def render_histograms(root_file, histograms, plan_file=DEFAULT_PLAN):
+    """
+    Draws and saves all the variants the plot plan lists for the histograms read from a ROOT file.
+    """
+    plan = load_plot_plan("scurve", plan_file)
 
     # Prepare output folder
     base_name = os.path.basename(root_file)
@@ -188,57 +203,47 @@ def save_histograms_png(root_file):
     canvas = ROOT.TCanvas("canvas", "canvas", 1150, 800)
     canvas.SetBottomMargin(0.12)
 
-    # Function to process directories and TCanvas objects
-    def process_directory(directory, rute=""):
-        for key in directory.GetListOfKeys():
-            obj = key.ReadObj()
-            if obj.IsA().InheritsFrom(ROOT.TDirectory.Class()):
-                new_path = f"{rute}/{obj.GetName()}" if rute else obj.GetName()
-                process_directory(obj, new_path)
-            elif obj.IsA().InheritsFrom(ROOT.TCanvas.Class()) and obj.GetName() in ["D_B(0)_O(0)_H(0)_Noise1D_Chip(15)", "D_B(0)_O(0)_H(0)_Threshold1D_Chip(15)", "D_B(0)_O(0)_H(0)_SCurves_Chip(15)"]:
-                for prim in obj.GetListOfPrimitives():
-                    if prim.InheritsFrom(ROOT.TH1.Class()):
-                        prim.SetLineWidth(2)
-                        prim.GetXaxis().SetTitleOffset(1)
-                        prim.GetYaxis().SetTitleOffset(1.9)
-                        
-                        x1 = prim.GetXaxis().GetXmin()
-                        x2 = prim.GetXaxis().GetXmax()
-                            
-                        if obj.GetName() == "D_B(0)_O(0)_H(0)_Noise1D_Chip(15)":
-                            draw_and_save_histogram(prim, canvas, output_folder, "Noise", x1, x2, 0, 959.534, is_log=False, name_suffix="", add_axis=False)
-                            draw_and_save_histogram(prim, canvas, output_folder, "Noise", 0, 50, 0, 239.884, is_log=False, name_suffix="_short_", add_axis=False, x_cut=(0, 50), perform_fit=True)
-                            # Draw and save log scale
-                            #canvas.SetLogy(1)
-                            #draw_and_save_histogram(prim, canvas, output_folder, "Noise", "Noise1D", x1, x2, 0, 959.534, is_log=True, name_suffix="_log_with_axis", add_axis=True, x_cut=None)
-                            #draw_and_save_histogram(prim, canvas, output_folder, "Noise", "Noise1D", 0, 50, 0, 239.884, is_log=True, name_suffix="_log_with_axis_short", add_axis=True, x_cut=(0, 50))
-                            #draw_and_save_histogram(prim, canvas, output_folder, "Noise", "Noise1D", 0, 50, 0, 239.884, is_log=True, name_suffix="_log_with_axis_short_fit", add_axis=True, x_cut=(0, 50), perform_fit=True)
-                            #canvas.SetLogy(0)  # Reset log scale
-                        
-                        elif obj.GetName() == "D_B(0)_O(0)_H(0)_SCurves_Chip(15)":                            
-                            draw_and_save_histogram(prim, canvas, output_folder, "SCurve", x1, x2, 64, 4853.34, is_log=False, name_suffix="", add_axis=True)
-                            draw_and_save_histogram(prim, canvas, output_folder, "SCurve", x1, x2, 64, 4853.34, is_log=False, name_suffix="colz", add_axis=True, colz=True)
-
-                            
-                        if obj.GetName() == "D_B(0)_O(0)_H(0)_Threshold1D_Chip(15)":
-                            draw_and_save_histogram(prim, canvas, output_folder, "Threshold", x1, x2, 64, 4944.96, is_log=False, name_suffix="", add_axis=False)
-                            draw_and_save_histogram(prim, canvas, output_folder, "Threshold", 300, 500, 1528.288, 2504.48, is_log=False, name_suffix="_short_", add_axis=False, x_cut=(300, 500), perform_fit=True) #2000 electrons
-                            #draw_and_save_histogram(prim, canvas, output_folder, "Threshold", 100, 300, 552.096, 1528.28, is_log=False, name_suffix="_short_", add_axis=False, x_cut=(100, 300), perform_fit=True) #1000 electrons
-                            # Draw and save log scale
-                            #canvas.SetLogy(1)
-                            #draw_and_save_histogram(prim, canvas, output_folder, "Threshold", "Threshold1D", x1, x2, 64, 4880.96, is_log=True, name_suffix="_log_with_axis", add_axis=True, x_cut=None)
-                            #draw_and_save_histogram(prim, canvas, output_folder, "Threshold", "Threshold1D", 100, 300, 552.096, 1528.28, is_log=True, name_suffix="_log_with_axis_short", add_axis=True, x_cut=(100, 300))
-                            #draw_and_save_histogram(prim, canvas, output_folder, "Threshold", "Threshold1D",  100, 300, 552.096, 1528.28, is_log=True, name_suffix="_log_with_axis_short_fit", add_axis=True, x_cut=(100, 300), perform_fit=True)
-                            #canvas.SetLogy(0)  # Reset log scale
-                            
-                            
-    process_directory(file)
-    file.Close()
+    for canvas_name, prim in histograms:
+        prim.SetLineWidth(2)
+        prim.GetXaxis().SetTitleOffset(1)
+        prim.GetYaxis().SetTitleOffset(1.9)
+        
+        x1 = prim.GetXaxis().GetXmin()
+        x2 = prim.GetXaxis().GetXmax()
+
+        # All the variants of one histogram are drawn one after the other
+        for quantity, variant in plan.variants_for(canvas_name):
+            x_cut = tuple(variant["range"]) if "range" in variant else None
+            low, high = x_cut or (x1, x2)
+            draw_and_save_histogram(prim, canvas, output_folder, quantity, low, high, is_log=variant.get("log", False),
+                                    name_suffix=variant["suffix"], add_axis=variant.get("electron_axis", False),
+                                    x_cut=x_cut, perform_fit="fit" in variant, colz=variant.get("colz", False),
+                                    fit_range=variant.get("fit"), style=variant["style"])
+        canvas.SetLogy(0)
+        canvas.SetLogz(0)
+
+
+def save_histograms_png(root_file, plan_file=DEFAULT_PLAN):
+    histograms = read_histograms(root_file, plan_file)
+    if histograms is not None:
+        render_histograms(root_file, histograms, plan_file)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python script.py file.root")
+    arguments, plan_file = parse_plan_option(sys.argv[1:])
+    root_files, prefetch_depth, read_delay = parse_prefetch_options(arguments)
+    if not root_files:
+        print("Usage: python script.py file.root [file2.root ...] | \"catalog:scan=SCurve,module=w7-31,run>15\" [--prefetch[=depth]] [--read-delay=seconds] [--plan=plot_plan.toml]")
         sys.exit(1)
-    for root_file in sys.argv[1:]:
-        print(f"Processing {root_file}")
-        save_histograms_png(root_file) 
+    root_files = resolve_inputs(root_files)
+    load_plot_plan("scurve", plan_file)  # Check the plan before reading any file
+    if prefetch_depth:
+        # Read file N+1 in the background while file N is rendered
+        loader = slow_loader(functools.partial(read_histograms, plan_file=plan_file), read_delay)
+        for root_file, histograms in prefetch(root_files, loader, prefetch_depth):
+            print(f"Processing {root_file}")
+            if histograms is not None:
+                render_histograms(root_file, histograms, plan_file)
+    else:
+        for root_file in root_files:
+            print(f"Processing {root_file}")
+            save_histograms_png(root_file, plan_file) 
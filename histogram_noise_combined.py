@@ -1,5 +1,7 @@
 import ROOT
 
+from vcal_calibration import axis_to_electrons, chip_from_name
+
 def process_directory(directory, histogram_name):
     """
     Recursively searches a ROOT directory and its subdirectories for a histogram with a specific name.
@@ -21,9 +23,11 @@ def process_directory(directory, histogram_name):
                         return cloned_hist
     return None
 
-def superimpose_histograms_from_files(root_file1, root_file2, root_file3, histogram_name, new_axis_title, save_name, range_x_min, range_x_max, xe_pos, ye_pos, add_axis=False):
+def superimpose_histograms_from_files(root_file1, root_file2, root_file3, histogram_name, new_axis_title, save_name, range_x_min, range_x_max, xe_pos=None, ye_pos=None, add_axis=False):
     """
     Opens multiple ROOT files and superimposes specified histograms on a single canvas.
+    With add_axis an electron axis is drawn at the top of the frame; its range (xe_pos, ye_pos) is taken from the
+    chip calibration when not given.
     """
     # Try to open the ROOT files
     files = [ROOT.TFile.Open(root_file, "READ") for root_file in [root_file1, root_file2, root_file3]]
@@ -159,10 +163,22 @@ def superimpose_histograms_from_files(root_file1, root_file2, root_file3, histog
     legend.Draw()
 
     if add_axis:
+        superimpose_canvas.SetTopMargin(0.12)  # Room for the electron axis title
         superimpose_canvas.Update()  # Canvas update
 
 
         y_pos = ROOT.gPad.GetUymax()
+        if xe_pos is None or ye_pos is None:
+            xe_pos, ye_pos = axis_to_electrons(range_x_min, range_x_max, chip_from_name(histogram_name), new_axis_title)
+        # Create the second axis, conversion to electrons
+        new_axis = ROOT.TGaxis(range_x_min, y_pos, range_x_max, y_pos, xe_pos, ye_pos, 510, "-L")
+        new_axis.SetTitle("Charge (electrons)")
+        new_axis.SetLabelFont(43)
+        new_axis.SetLabelSize(30)
+        new_axis.SetTitleFont(43)
+        new_axis.SetTitleSize(30)
+        new_axis.SetTitleOffset(1.5)
+        new_axis.Draw()
 							
     superimpose_canvas.Update()
     superimpose_canvas.SaveAs(save_name)
@@ -202,7 +218,7 @@ def main():
     histogram_name_1 = "D_B(0)_O(0)_H(0)_Noise1D_Chip(15)"
 
     x1n, x2n = get_histogram_range(root_file1, histogram_name_1)
-    superimpose_histograms_from_files(root_file1, root_file2, root_file3, histogram_name_1, "Noise", "Noise1D_All_Targets.png", 0, 60, 0, 287.86, add_axis=True)
+    superimpose_histograms_from_files(root_file1, root_file2, root_file3, histogram_name_1, "Noise", "Noise1D_All_Targets.png", 0, 60, add_axis=True)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,20 @@
 import ROOT
 import sys
 import os
+import csv
+import numpy as np
 from array import array
 
+from pixel_arrays import hist_to_array, set_hist_contents, array_to_pixel_map
+from pixel_geometry import mask_to_index, to_positions
+from neighbourhood import neighbour_deficit
+from flat_field import equalise
+from vcal_calibration import chip_from_name
+from compact_output import OutputWriter, parse_output_options
+
+# Default grid of hit-count cuts scanned by the sweep mode
+DEFAULT_SWEEP_CUTS = np.unique(np.round(np.geomspace(10, 10000, 61)))
+
 # Function to draw and save the histogram with an optional additional axis
 def draw_Hitsperpixel(prim, canvas, output_folder, name_suffix=""):
     """
@@ -75,29 +87,33 @@ def draw_Hitsperpixel(prim, canvas, output_folder, name_suffix=""):
     canvas.SaveAs(file_path)
     print(f"Histogram saved: {file_path}")
     
-def draw_missing_prob(prim, masked_hist, canvas, output_folder, name_suffix="", masked_pixels = False):
+def draw_missing_prob(prim, masked_hist, canvas, output_folder, name_suffix="", masked_pixels = False, neighbour_size=None, writer=None, flat_field=None):
     """
     Draws histograms based on masked and unmasked pixel data from the hits per pixel map. It also handles the creation of different histograms depending on the hits registered.
+    With neighbour_size (3, 5, ...) pixels are judged against the median of their unmasked neighbours instead of the absolute hit cuts.
+    With a compact_output.OutputWriter the label map and the position table are stored instead of the canvas.
+    With flat_field ("blocks" or "poly") the hits are first divided by the fitted illumination surface of the chip.
     """
     # Get dimensions of the primary histogram
-    nx, ny = prim.GetNbinsX(), prim.GetNbinsY()
-    
+    bx, by = prim.GetNbinsX(), prim.GetNbinsY()
 
-    # Create a histogram to hold filtered values
-    filtered_hist = ROOT.TH2F("filtered_hist", "", nx, 0, nx, ny, 0, ny)
-
-    # Fill the histogram with values, marking masked ones differently if specified 
-    for ix in range(1, nx + 1):
-        for iy in range(1, ny + 1):
-            content = prim.GetBinContent(ix, iy)
-            if masked_hist.GetBinContent(ix, iy) != 0:  # Check if pixel is masked
-                # Set a distinct value for masked pixel
-                filtered_hist.SetBinContent(ix, iy, 2000)
-            else:
-                # Copy value to the filtered histogram
-                filtered_hist.SetBinContent(ix, iy, content)
-           
-    bx, by = filtered_hist.GetNbinsX(), filtered_hist.GetNbinsY()
+    # Hits and masked pixels as (rows, columns) arrays
+    hits = hist_to_array(prim)
+    unmasked = hist_to_array(masked_hist) == 0
+
+    # Flat field: classify on hits / illumination x median illumination, so the non-uniform source does not
+    # flag the edges of the illuminated area; pixels without hits are left out of the fit
+    surface = None
+    if flat_field:
+        hits, surface = equalise(hits, unmasked & (hits > 0), flat_field)
+
+    if neighbour_size:
+        # Neighbour-aware classification: compare each pixel with its local neighbourhood
+        missing_map, problematic_map = neighbour_deficit(hits, unmasked, neighbour_size)
+    else:
+        # Pixels that detect less than 100 hits are missing, between 100 and 1000 problematic
+        missing_map = unmasked & (hits < 100)
+        problematic_map = unmasked & (hits >= 100) & (hits < 1000)
 
     # Create additional histograms for visualization
     missing = ROOT.TH2F("missing", "", bx, 0, bx, by, 0, by)
@@ -116,32 +132,24 @@ def draw_missing_prob(prim, masked_hist, canvas, output_folder, name_suffix="",
         masked.GetXaxis().SetTitle("Columns")
         masked.GetYaxis().SetTitle("Rows")
     
-    # Populate histograms based on z-values
-    missing_count = 0
-    problematic_count = 0
-    masked_count = 0
-    missing_positions = []
-    problematic_positions = []
-    
-    for binX in range(1, bx + 1):
-        for binY in range(1, by + 1):
-            z = filtered_hist.GetBinContent(binX, binY)
-            if z < 100:
-                # Pixels that detect less than 100 hits:
-                missing.SetBinContent(binX, binY, 1)
-                missing_count += 1
-                missing_positions.append((binX, binY))
-            elif 100 <= z < 1000:
-                # Pixels that detect hits between 100 and 1000:
-                problematic.SetBinContent(binX, binY, 1)
-                problematic_count += 1
-                problematic_positions.append((binX, binY))
-            elif z == 2000 and masked_pixels:
-                # Masked pixels
-                masked.SetBinContent(binX, binY, 1)
-                masked_count += 1
-            else:
-                continue
+    # Label map (1 missing, 2 problematic, 3 masked); a pixel gets the first label that applies
+    labels = np.zeros((by, bx), dtype=np.int16)
+    if masked_pixels:
+        labels[~unmasked] = 3
+    labels[problematic_map] = 2
+    labels[missing_map] = 1
+    set_hist_contents(missing, labels == 1)
+    set_hist_contents(problematic, labels == 2)
+    if masked_pixels:
+        set_hist_contents(masked, labels == 3)
+    missing_count = int((labels == 1).sum())
+    problematic_count = int((labels == 2).sum())
+    masked_count = int((labels == 3).sum())
+
+    # Positions as 1-based (X bin, Y bin), ordered column by column
+    missing_positions = sorted(to_positions(mask_to_index(labels == 1), "bins"))
+    problematic_positions = sorted(to_positions(mask_to_index(labels == 2), "bins"))
+
     # Disable the stats box to clean up the plot
     missing.SetStats(0)
     problematic.SetStats(0)
@@ -181,10 +189,22 @@ def draw_missing_prob(prim, masked_hist, canvas, output_folder, name_suffix="",
     print(f"Missing entries count: {missing_count}")
     print(f"Problematic entries count: {problematic_count}")
     
-    # Write canvas to the ROOT file
+    # Write the results to the ROOT file: 1 missing, 2 problematic, 3 masked
     canvas_name = f"Filtered{name_suffix}Canvas"
-    canvas.Write(canvas_name)
-    print(f"Canvas written to ROOT file as {canvas_name}")
+    if writer:
+        writer.write_label_map(labels, f"BumpBonds{name_suffix}")
+        if surface is not None:
+            writer.write(array_to_pixel_map(surface, f"Illumination{name_suffix}"))
+        positions = missing_positions + problematic_positions
+        writer.write_table(f"BumpBondPositions{name_suffix}", {
+            "column": [pos[0] for pos in positions],
+            "row": [pos[1] for pos in positions],
+            "status": [1] * len(missing_positions) + [2] * len(problematic_positions),
+        })
+        writer.write_canvas(canvas, canvas_name)
+    else:
+        canvas.Write(canvas_name)
+        print(f"Canvas written to ROOT file as {canvas_name}")
     print(f"Histogram name filtered{name_suffix}")
     
     # Save the bad bump-bonds position in a .txt
@@ -200,7 +220,7 @@ def draw_missing_prob(prim, masked_hist, canvas, output_folder, name_suffix="",
     
     return missing_positions, problematic_positions
     
-def draw_z_histograms(prim, masked_hist, canvas, output_folder, log_scale=False):
+def draw_z_histograms(prim, masked_hist, canvas, output_folder, log_scale=False, writer=None):
     """
     Hits per pixel distribution
     """
@@ -273,19 +293,132 @@ def draw_z_histograms(prim, masked_hist, canvas, output_folder, log_scale=False)
         
         # Write the current state of the canvas to the ROOT file
         canvas_name = f"ZHistogram{label.capitalize()}{'Log' if log_scale else 'Linear'}Canvas"
-        canvas.Write(canvas_name)
-        print(f"Canvas written to ROOT file as {canvas_name}")
+        if writer:
+            # The distribution is the same in linear and log scale, store it once
+            if not log_scale:
+                writer.write(hist_z_values, f"HitsPerPixel1D_{label}")
+            writer.write_canvas(canvas, canvas_name)
+        else:
+            canvas.Write(canvas_name)
+            print(f"Canvas written to ROOT file as {canvas_name}")
+
+def sweep_bump_cuts(prim, masked_hist, canvas, output_folder, cuts=DEFAULT_SWEEP_CUTS, name_suffix="", writer=None, flat_field=None, chip=None):
+    """
+    Missing/problematic bump counts for a whole grid of hit cuts from a single sort of the unmasked hit counts.
+    For every pair of cuts (missing < low, low <= problematic < high) the counts come from searchsorted, so any
+    grid costs about the same as one classification. Writes the table as CSV and the count-vs-cut curve.
+    With flat_field the cuts apply to the same equalised hits as in draw_missing_prob. The outputs are tagged with
+    `chip`, by default read from the histogram name.
+    """
+    cuts = np.unique(np.asarray(cuts, dtype=np.float64))
+    hits = hist_to_array(prim)
+    unmasked = hist_to_array(masked_hist) == 0
+    if flat_field:
+        hits, _ = equalise(hits, unmasked & (hits > 0), flat_field)
+    sorted_hits = np.sort(hits[unmasked], axis=None)
+
+    # Number of unmasked pixels below each cut; every count of the table is a difference of two of these
+    below = np.searchsorted(sorted_hits, cuts, side="left")
+
+    chip = chip_from_name(prim.GetName()) if chip is None else chip
+    tag = f"Chip{chip}{name_suffix}" if chip is not None else name_suffix
+    table_path = os.path.join(output_folder, f"bump_cut_sweep_{tag}.csv")
+    low_index, high_index = np.triu_indices(len(cuts), k=1)
+    with open(table_path, "w", newline="") as f:
+        table = csv.writer(f)
+        table.writerow(["missing_cut", "problematic_cut", "missing", "problematic"])
+        table.writerows(zip(cuts[low_index], cuts[high_index], below[low_index],
+                             below[high_index] - below[low_index]))
+    print(f"Cut sweep table saved: {table_path} ({len(low_index)} cut pairs, {sorted_hits.size} unmasked pixels)")
+
+    # Count-vs-cut curve: pixels below the cut, i.e. missing bumps if it is used as the missing cut
+    graph = ROOT.TGraph(len(cuts), array("d", cuts), array("d", below.astype(np.float64)))
+    graph.SetName(f"bump_cut_sweep_{tag}")
+    graph.SetTitle(";Hit cut (hits per pixel);Unmasked pixels below cut")
+    graph.SetLineWidth(2)
+    graph.SetMarkerStyle(20)
+    graph.SetMarkerSize(0.8)
+
+    canvas.cd()
+    canvas.SetLeftMargin(0.12)
+    canvas.SetRightMargin(0.1)
+    canvas.SetLogx(1)
+    canvas.SetLogy(0)
+    graph.Draw("APL")
+    graph.GetXaxis().SetTitleSize(34)
+    graph.GetXaxis().SetTitleFont(43)
+    graph.GetYaxis().SetTitleSize(34)
+    graph.GetYaxis().SetTitleFont(43)
+    graph.GetXaxis().SetLabelSize(0.04)
+    graph.GetYaxis().SetLabelSize(0.04)
+    canvas.Modified()
+    canvas.Update()
+
+    image_path = os.path.join(output_folder, f"bump_cut_sweep_{tag}.png")
+    canvas.SaveAs(image_path)
+    print(f"Cut sweep curve saved: {image_path}")
+    if writer:
+        writer.write(graph)
+    else:
+        graph.Write()
+    canvas.SetLogx(0)
+    return cuts, below
+
+
+def parse_neighbour_size(arguments):
+    """
+    Returns the neighbourhood size requested with --neighbour (3x3) or --neighbour=5, or None.
+    """
+    for argument in arguments:
+        if argument == "--neighbour":
+            return 3
+        if argument.startswith("--neighbour="):
+            return int(argument.split("=", 1)[1])
+    return None
+
 
-def save_histograms_png(root_file, masked_file):
+def parse_sweep_cuts(arguments):
+    """
+    Returns the cut grid requested with --sweep (default grid) or --sweep=10,50,100,..., or None.
+    """
+    for argument in arguments:
+        if argument == "--sweep":
+            return DEFAULT_SWEEP_CUTS
+        if argument.startswith("--sweep="):
+            return np.array([float(value) for value in argument.split("=", 1)[1].split(",")])
+    return None
+
+
+def parse_flat_field(arguments):
+    """
+    Returns the flat-field method requested with --flat-field (block medians) or --flat-field=blocks|poly, or None.
+    """
+    for argument in arguments:
+        if argument == "--flat-field":
+            return "blocks"
+        if argument.startswith("--flat-field="):
+            return argument.split("=", 1)[1]
+    return None
+
+
+def save_histograms_png(root_file, masked_file, sweep_cuts=None, neighbour_size=None, output_options=None, flat_field=None):
     # Open ROOT File
     file = ROOT.TFile.Open(root_file, "READ")
+    if not file or not file.IsOpen():
+        print(f"Could not open file {root_file}")
+        return False
     masked_file2 = ROOT.TFile.Open(masked_file, "READ")
+    if not masked_file2 or not masked_file2.IsOpen():
+        print(f"Could not open file {masked_file}")
+        file.Close()
+        return False
     # Extract the histogram representing masked pixels
     masked_hist = masked_file2.Get("Masked Pixels Map")
-    
-    if not file.IsOpen():
-        print(f"Could not open file {root_file}")
-        return
+    if not masked_hist:
+        print(f"No \"Masked Pixels Map\" in {masked_file}")
+        file.Close()
+        masked_file2.Close()
+        return False
 
     # Prepare output folder
     base_name = os.path.basename(root_file)
@@ -299,8 +432,8 @@ def save_histograms_png(root_file, masked_file):
     canvas = ROOT.TCanvas("canvas", "canvas", 1150, 800)
     canvas.SetBottomMargin(0.12)
 
-    # Open a ROOT file to save all canvas outputs
-    output_root_file = ROOT.TFile(os.path.join(output_folder, "Occ_and_hits.root"), "RECREATE")		
+    # Open a compressed ROOT file to save the histograms (and the canvases, if requested)
+    output_root_file = OutputWriter(os.path.join(output_folder, "Occ_and_hits.root"), **(output_options or {}))
 
     # Function to process directories and TCanvas objects
     def process_directory(directory, rute=""):
@@ -317,30 +450,42 @@ def save_histograms_png(root_file, masked_file):
                     if prim.InheritsFrom(ROOT.TH1.Class()):
                         print(f"Found Histogram: {prim.GetName()}")
                         return prim
+            elif obj.IsA().InheritsFrom(ROOT.TH1.Class()) and obj.GetName() == "D_B(0)_O(0)_H(0)_PixelAlive_Chip(15)":
+                # Top-level histogram, as written by canvas_hadd.py
+                print(f"Found Histogram: {obj.GetName()}")
+                obj.SetDirectory(0)
+                return obj
         return None 
         
     # Function to process directories and TCanvas objects
     prim = process_directory(file)    
     if prim:
+        chip = chip_from_name(prim.GetName())
         prim.SetLineWidth(2)
         prim.GetXaxis().SetTitleOffset(1)
         prim.GetYaxis().SetTitleOffset(1.8)
         prim.Scale(1e7)
         # Draw and save the hits per pixel histogram
         draw_Hitsperpixel(prim, canvas, output_folder, "_Hist")
-        canvas.Write("HitsPerPixelCanvas")
+        output_root_file.write(prim, "HitsPerPixel")
+        output_root_file.write_canvas(canvas, "HitsPerPixelCanvas")
         # Clone the primary histogram to use for the custom drawings
         prim_clone_for_masked = prim.Clone("prim_clone_for_masked")
         prim_clone_for_unmasked = prim.Clone("prim_clone_for_unmasked")
          # Draw and save the custom histograms for masked and unmasked pixels
-        draw_missing_prob(prim_clone_for_masked, masked_hist, canvas, output_folder, "_colors_mp", masked_pixels = True)
-        missing_positions, problematic_positions = draw_missing_prob(prim_clone_for_unmasked, masked_hist, canvas, output_folder, "_colors", masked_pixels = False)
+        draw_missing_prob(prim_clone_for_masked, masked_hist, canvas, output_folder, "_colors_mp", masked_pixels = True, neighbour_size=neighbour_size, writer=output_root_file, flat_field=flat_field)
+        missing_positions, problematic_positions = draw_missing_prob(prim_clone_for_unmasked, masked_hist, canvas, output_folder, "_colors", masked_pixels = False, neighbour_size=neighbour_size, writer=output_root_file, flat_field=flat_field)
         
         # Draw and save the z-value histograms in both linear and log scale
         #draw_z_histograms(prim_clone_for_unmasked, canvas, output_folder, log_scale=False)
-        draw_z_histograms(prim_clone_for_unmasked, masked_hist, canvas, output_folder, log_scale=False)
+        draw_z_histograms(prim_clone_for_unmasked, masked_hist, canvas, output_folder, log_scale=False, writer=output_root_file)
         #draw_z_histograms(prim_clone_for_unmasked, canvas, output_folder, log_scale=True)
-        draw_z_histograms(prim_clone_for_unmasked, masked_hist, canvas, output_folder, log_scale=True)
+        draw_z_histograms(prim_clone_for_unmasked, masked_hist, canvas, output_folder, log_scale=True, writer=output_root_file)
+
+        # Missing/problematic counts for a whole grid of cuts
+        if sweep_cuts is not None:
+            sweep_bump_cuts(prim_clone_for_unmasked, masked_hist, canvas, output_folder, sweep_cuts, writer=output_root_file, flat_field=flat_field,
+                            chip=chip)
         
 
     else:
@@ -348,13 +493,17 @@ def save_histograms_png(root_file, masked_file):
     file.Close()
     masked_file2.Close()
     output_root_file.Close()  # Ensure to close the ROOT file after all operations
+    return bool(prim)
     
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python script.py file1.root file2.root")
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if len(arguments) < 2:
+        print("Usage: python script.py file1.root file2.root [--sweep | --sweep=10,50,100,...] [--neighbour[=3|5]] "
+              "[--compression=ZSTD:5] [--keep-canvases] [--flat-field[=blocks|poly]]")
         sys.exit(1)
-    root_file = sys.argv[1]
-    masked_file = sys.argv[2]
-    save_histograms_png(root_file, masked_file)
+    root_file = arguments[0]
+    masked_file = arguments[1]
+    save_histograms_png(root_file, masked_file, parse_sweep_cuts(sys.argv[1:]), parse_neighbour_size(sys.argv[1:]),
+                        parse_output_options(sys.argv[1:]), parse_flat_field(sys.argv[1:]))
 
@@ -0,0 +1,135 @@
+import sys
+import os
+import re
+import tempfile
+import numpy as np
+
+from masked_noisy_stuck_pix import read_masked_positions
+
+MERGE_POLICIES = ("union", "replace")
+
+
+def rewrite_pixel_field(config_in, field, transform, config_out=None):
+    """
+    Rewrites the per-pixel rows of one field (ENABLE, TDAC, ...) of a CMSIT_RD53B.txt configuration in a single
+    streaming pass. transform(row_index, values) receives the comma separated values of each row as a list of
+    strings and returns the new list. Every other line, and the spacing around the values, is kept byte for byte.
+    The output is written to a temporary file and moved into place, so readers never see a partial config.
+    """
+    config_out = config_out or config_in
+    row_pattern = re.compile(rb"^(\s*" + re.escape(field.encode()) + rb"\s+)([^\s]+)(.*)$", re.DOTALL)
+    out_dir = os.path.dirname(os.path.abspath(config_out))
+    handle, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".txt", dir=out_dir)
+    row_index = 0
+    try:
+        with open(config_in, "rb") as src, os.fdopen(handle, "wb") as dst:
+            for line in src:
+                match = row_pattern.match(line)
+                if match:
+                    values = match.group(2).decode().split(",")
+                    new_values = transform(row_index, values)
+                    line = match.group(1) + ",".join(new_values).encode() + match.group(3)
+                    row_index += 1
+                dst.write(line)
+            dst.flush()
+            os.fsync(dst.fileno())
+        if os.path.exists(config_in):
+            os.chmod(tmp_path, os.stat(config_in).st_mode & 0o777)
+        os.replace(tmp_path, config_out)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return row_index
+
+
+def read_pixel_field(config_in, field):
+    """
+    Reads the per-pixel rows of one field (ENABLE, TDAC, ...) of a configuration into an integer
+    (rows, columns) array. Each configuration row holds one column of the matrix.
+    """
+    row_pattern = re.compile(r"^\s*" + re.escape(field) + r"\s+([^\s]+)")
+    columns = []
+    with open(config_in) as f:
+        for line in f:
+            match = row_pattern.match(line)
+            if match:
+                columns.append([int(value) for value in match.group(1).split(",")])
+    if not columns:
+        raise ValueError(f"No {field} rows found in {config_in}")
+    return np.array(columns, dtype=np.int64).T
+
+
+def write_enable_mask(config_in, masked_positions, config_out=None, policy="union"):
+    """
+    Disables the given pixels in the ENABLE rows of a configuration. Positions use the same (row index, value index)
+    convention as read_masked_positions. With "union" the pixels already masked stay masked; with "replace" only the
+    given pixels end up masked.
+    """
+    if policy not in MERGE_POLICIES:
+        raise ValueError(f"Unknown merge policy '{policy}', expected one of {MERGE_POLICIES}")
+
+    # Group the positions by ENABLE row so each row is patched in one go
+    masked_by_row = {}
+    for i, j in masked_positions:
+        masked_by_row.setdefault(int(i), []).append(int(j))
+    n_masked = 0
+
+    def transform(row_index, values):
+        nonlocal n_masked
+        if policy == "replace":
+            values = ["1"] * len(values)
+        for j in masked_by_row.get(row_index, ()):
+            if j < len(values):
+                values[j] = "0"
+        n_masked += values.count("0")
+        return values
+
+    n_rows = rewrite_pixel_field(config_in, "ENABLE", transform, config_out)
+    print(f"{config_out or config_in}: {n_rows} ENABLE rows written, {n_masked} pixels masked ({policy})")
+    return n_masked
+
+
+def write_chip_masks(chip_configs, chip_masks, policy="union", suffix=""):
+    """
+    Writes the masks of a multi-chip setup: chip_configs maps chip id -> config path, chip_masks chip id -> positions.
+    With a suffix the new configs are written next to the originals (CMSIT_RD53B<suffix>.txt) instead of in place.
+    """
+    for chip, config in chip_configs.items():
+        if chip not in chip_masks:
+            continue
+        root, ext = os.path.splitext(config)
+        write_enable_mask(config, chip_masks[chip], f"{root}{suffix}{ext}" if suffix else None, policy)
+
+
+def load_positions(filename, one_based=False):
+    """
+    Loads pixel positions to mask, either from another chip configuration (its masked ENABLE entries) or from a text
+    file with "x, y" lines such as Bump_bonds_Xray.txt. one_based converts 1-based histogram bin indices.
+    """
+    with open(filename) as f:
+        if any(line.startswith("ENABLE") for line in f):
+            return read_masked_positions(filename)
+
+    positions = set()
+    offset = 1 if one_based else 0
+    with open(filename) as f:
+        for line in f:
+            parts = line.strip().split(",")
+            if len(parts) == 2 and all(part.strip().isdigit() for part in parts):
+                positions.add((int(parts[0]) - offset, int(parts[1]) - offset))
+    return positions
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if len(arguments) < 2:
+        print("Usage: python mask_writer.py CMSIT_RD53B.txt mask.txt [mask2.txt ...] "
+              "[--policy=union|replace] [--output=new_config.txt] [--one-based]")
+        sys.exit(1)
+    config, mask_files = arguments[0], arguments[1:]
+    positions = set()
+    for mask_file in mask_files:
+        positions |= load_positions(mask_file, one_based="--one-based" in sys.argv)
+    write_enable_mask(config, positions, options.get("output"), options.get("policy", "union"))
@@ -1,4 +1,8 @@
 import ROOT
+import numpy as np
+
+from pixel_arrays import book_pixel_map, set_hist_contents
+from pixel_geometry import to_index, index_to_mask
 
 def read_masked_positions(filename):
     """
@@ -20,23 +24,26 @@ def read_masked_positions(filename):
             i += 1
     return masked_positions
 
+def read_masked_indices(filename):
+    """
+    Masked pixels of a configuration as sorted linear pixel indices (see pixel_geometry).
+    """
+    return to_index(read_masked_positions(filename), "config")
+
 def compare_masked_positions(filemasked1, filemasked2):
     """
-    Compares the masked positions between two different files and returns the positions
-    that are unique to the second file.
+    Compares the masked positions between two different files and returns the linear indices of the pixels
+    that are only masked in the second file.
     """
-    masked_positions1 = read_masked_positions(filemasked1)
-    masked_positions2 = read_masked_positions(filemasked2)
-    return masked_positions2 - masked_positions1  # Set difference
+    return np.setdiff1d(read_masked_indices(filemasked2), read_masked_indices(filemasked1), assume_unique=True)
 
-def create_histogram(masked_positions, title, filename):
+def create_histogram(masked_index, title, filename):
     """
-    Creates and saves a ROOT histogram of masked positions.
+    Creates and saves a ROOT histogram of masked pixels, given as linear pixel indices.
     """
-    # Initialize histogram with dimensions for a typical CMOS sensor
-    hist = ROOT.TH2F(f"w7-24: {title}", "", 432, 0, 432, 336, 0, 336)
-    for pos in masked_positions:
-        hist.Fill(*pos)  # Fill histogram at positions
+    # Pixel map with the RD53B matrix binning
+    hist = book_pixel_map(f"w7-24: {title}")
+    set_hist_contents(hist, index_to_mask(masked_index))
 
     hist.SetStats(1)  # Enable statistics box to display histogram info
     c = ROOT.TCanvas("c", title, 1150, 800)
@@ -72,8 +79,8 @@ def main():
     pixel_alive = "Results/Run000016_CMSIT_RD53B.txt"
 
     # Obtain masked, noisy, and stuck positions
-    masked_positions = read_masked_positions(f_masked)
-    noisy_positions = read_masked_positions(noise_scan)
+    masked_positions = read_masked_indices(f_masked)
+    noisy_positions = read_masked_indices(noise_scan)
     stuck_positions = compare_masked_positions(noise_scan, pixel_alive)  # Stuck as defined by appearance in two datasets
 
     # Generate and save histograms
@@ -0,0 +1,241 @@
+import ROOT
+import sys
+import os
+import csv
+import numpy as np
+
+from pixel_arrays import iter_canvas_histograms, hist_to_array, set_hist_contents, MAD_SIGMA
+from campaign_summary import module_from_path
+from compact_output import OutputWriter, parse_output_options
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def read_distributions(root_files, kind="Noise1D", chip=15, bins=200):
+    """
+    Loads the distribution of one quantity for every module (one file per module) as a (modules, bins) count array.
+    1D kinds (Noise1D, Threshold1D) are used as binned by the DAQ and must share their binning; per-pixel maps
+    (Noise2D, Threshold2D) are histogrammed with common edges over the non-zero pixels of all modules.
+    Returns (labels, counts, edges).
+    """
+    pattern = rf"_{kind}_Chip\({chip}\)$"
+    labels, paths, histograms = [], [], []
+    for root_file in root_files:
+        file = ROOT.TFile.Open(root_file, "READ")
+        if not file or not file.IsOpen():
+            print(f"Could not open file {root_file}, skipped")
+            continue
+        for _, hist in iter_canvas_histograms(file, pattern):
+            labels.append(module_from_path(root_file))
+            paths.append(root_file)
+            histograms.append(hist)
+            break
+        else:
+            print(f"{kind} of chip {chip} not found in {root_file}, skipped")
+        file.Close()
+    if not histograms:
+        raise ValueError(f"No {kind} distribution of chip {chip} found")
+
+    # Same module measured twice: tell the files apart
+    if len(set(labels)) < len(labels):
+        labels = [f"{label}_{os.path.splitext(os.path.basename(f))[0]}" for label, f in zip(labels, paths)]
+
+    if histograms[0].GetDimension() == 1:
+        axis = histograms[0].GetXaxis()
+        edges = np.array([axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins() + 2)])
+        counts = []
+        for label, hist in zip(labels, histograms):
+            if hist.GetNbinsX() != len(edges) - 1 or hist.GetXaxis().GetXmin() != edges[0] \
+                    or hist.GetXaxis().GetXmax() != edges[-1]:
+                raise ValueError(f"{kind} of {label} has a different binning")
+            counts.append(hist_to_array(hist))
+        return labels, np.array(counts, dtype=np.float64), edges
+
+    values = [hist_to_array(hist).ravel() for hist in histograms]
+    values = [v[np.isfinite(v) & (v != 0)] for v in values]
+    pooled = np.concatenate(values)
+    edges = np.linspace(pooled.min(), pooled.max(), bins + 1)
+    counts = np.array([np.histogram(v, edges)[0] for v in values], dtype=np.float64)
+    return labels, counts, edges
+
+
+def ks_distances(counts):
+    """
+    Kolmogorov-Smirnov distance between every pair of binned distributions: the largest difference of their
+    cumulative fractions, from one cumulative sum per module and one broadcast over the pairs.
+    Returns (distances, p-values) as (modules, modules) arrays.
+    """
+    totals = counts.sum(axis=1)
+    cdf = np.cumsum(counts, axis=1) / np.maximum(totals, 1)[:, None]
+    distance = np.abs(cdf[:, None, :] - cdf[None, :, :]).max(axis=-1)
+
+    # Asymptotic Kolmogorov distribution with the effective number of entries of each pair
+    n_effective = np.outer(totals, totals) / np.maximum(totals[:, None] + totals[None, :], 1)
+    # TMath::KolmogorovProb returns 1 below z = 0.2, where the series has not converged
+    lam = (np.sqrt(n_effective) + 0.12 + 0.11 / np.maximum(np.sqrt(n_effective), 1e-12)) * distance
+    prob = np.frompyfunc(ROOT.TMath.KolmogorovProb, 1, 1)
+    p_value = prob(lam).astype(np.float64)
+    return distance, p_value
+
+
+def chi2_compatibility(counts):
+    """
+    Chi-square homogeneity test of every pair of unweighted histograms, as in TH1::Chi2Test("UU"):
+    chi2 = sum_i (N2 n1i - N1 n2i)^2 / (N1 N2 (n1i + n2i)) over the bins filled in either histogram, ndf = bins - 1.
+    Returns (chi2, ndf, p-values) as (modules, modules) arrays.
+    """
+    totals = counts.sum(axis=1)
+    n1, n2 = counts[:, None, :], counts[None, :, :]
+    t1, t2 = totals[:, None, None], totals[None, :, None]
+    filled = (n1 + n2) > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        terms = np.where(filled, (t2 * n1 - t1 * n2) ** 2 / np.where(filled, n1 + n2, 1), 0.0)
+        chi2 = terms.sum(axis=-1) / np.maximum(np.outer(totals, totals), 1)
+    ndf = np.maximum(filled.sum(axis=-1) - 1, 1)
+    prob = np.frompyfunc(ROOT.TMath.Prob, 2, 1)
+    p_value = prob(chi2, ndf).astype(np.float64)
+    return chi2, ndf, p_value
+
+
+def distribution_quantiles(counts, edges, quantiles=QUANTILES):
+    """
+    Quantiles of every binned distribution, interpolating linearly inside the bin where the cumulative fraction
+    crosses each level. Returns a (quantiles, modules) array.
+    """
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+    totals = np.maximum(counts.sum(axis=1), 1)
+    cdf = np.cumsum(counts, axis=1) / totals[:, None]
+    # First bin whose cumulative fraction reaches the level, for every (level, module)
+    index = (cdf[None, :, :] < quantiles[:, None, None]).sum(axis=-1)
+    index = np.minimum(index, counts.shape[1] - 1)
+    modules = np.arange(counts.shape[0])[None, :]
+    below = np.where(index > 0, cdf[modules, np.maximum(index - 1, 0)], 0.0)
+    in_bin = counts[modules, index] / totals[None, :]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.where(in_bin > 0, (quantiles[:, None] - below) / in_bin, 0.0)
+    return edges[index] + np.clip(fraction, 0, 1) * (edges[index + 1] - edges[index])
+
+
+def flag_outliers(distance, p_value=None, z_cut=3.5, p_cut=1e-3):
+    """
+    Flags modules whose median distance to the others is far above the typical one (median/MAD z-score) and,
+    when p-values are given, also significantly incompatible with most of them (median p-value below p_cut),
+    so statistical fluctuations of a very uniform set are not flagged.
+    Returns (median distance per module, z-scores, outlier mask).
+    """
+    n = distance.shape[0]
+    off_diagonal = ~np.eye(n, dtype=bool)
+    if n < 3:
+        return np.zeros(n), np.zeros(n), np.zeros(n, dtype=bool)
+    median_distance = np.median(distance[off_diagonal].reshape(n, n - 1), axis=1)
+    center = np.median(median_distance)
+    spread = MAD_SIGMA * np.median(np.abs(median_distance - center))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = np.where(spread > 0, (median_distance - center) / spread, 0.0)
+    outliers = z > z_cut
+    if p_value is not None:
+        outliers &= np.median(p_value[off_diagonal].reshape(n, n - 1), axis=1) < p_cut
+    return median_distance, z, outliers
+
+
+def compare_modules(counts, edges, quantiles=QUANTILES, z_cut=3.5, p_cut=1e-3):
+    """
+    All-pairs comparison of the module distributions: KS distance and p-value, chi2 test, quantile differences
+    and the modules flagged as outliers by their KS distances.
+    """
+    ks, ks_p = ks_distances(counts)
+    chi2, ndf, chi2_p = chi2_compatibility(counts)
+    module_quantiles = distribution_quantiles(counts, edges, quantiles)
+    median_distance, z, outliers = flag_outliers(ks, ks_p, z_cut, p_cut)
+    return {
+        "ks": ks, "ks_p": ks_p, "chi2_ndf": chi2 / ndf, "chi2_p": chi2_p,
+        "quantiles": module_quantiles,
+        # quantile_diff[q, i, j] = quantile q of module i - quantile q of module j
+        "quantile_diff": module_quantiles[:, :, None] - module_quantiles[:, None, :],
+        "median_ks": median_distance, "z": z, "outliers": outliers,
+    }
+
+
+def write_matrix(matrix, labels, table_path):
+    """
+    Writes a (modules, modules) matrix as CSV with the module labels as header and first column.
+    """
+    with open(table_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow([""] + labels)
+        for label, row in zip(labels, matrix):
+            writer.writerow([label] + [f"{value:.6g}" for value in row])
+    print(f"Matrix saved: {table_path}")
+
+
+def write_module_table(result, labels, table_path, quantiles=QUANTILES):
+    """
+    Writes one row per module with its quantiles, median KS distance, z-score and outlier flag.
+    """
+    with open(table_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["module"] + [f"q{int(q * 100):02d}" for q in quantiles] + ["median_ks", "z", "outlier"])
+        for m, label in enumerate(labels):
+            writer.writerow([label] + [f"{value:.6g}" for value in result["quantiles"][:, m]] +
+                            [f"{result['median_ks'][m]:.6g}", f"{result['z'][m]:.3g}", int(result["outliers"][m])])
+    print(f"Module table saved: {table_path}")
+
+
+def draw_matrix(matrix, labels, name, z_title, output_file):
+    """
+    Draws a distance matrix with the module labels on both axes.
+    """
+    n = len(labels)
+    hist = ROOT.TH2F(name, "", n, 0, n, n, 0, n)
+    hist.SetDirectory(0)
+    set_hist_contents(hist, matrix, entries=n * n)
+    for i, label in enumerate(labels):
+        hist.GetXaxis().SetBinLabel(i + 1, label)
+        hist.GetYaxis().SetBinLabel(i + 1, label)
+    hist.SetStats(0)
+    hist.SetZTitle(z_title)
+
+    canvas = ROOT.TCanvas(f"canvas_{name}", name, 1150, 1000)
+    canvas.SetLeftMargin(0.15)
+    canvas.SetBottomMargin(0.15)
+    canvas.SetRightMargin(0.17)
+    hist.GetZaxis().SetTitleSize(34)
+    hist.GetZaxis().SetTitleFont(43)
+    hist.GetZaxis().SetTitleOffset(1.8)
+    hist.GetXaxis().SetLabelSize(0.03)
+    hist.GetYaxis().SetLabelSize(0.03)
+    hist.GetZaxis().SetLabelSize(0.04)
+    hist.GetXaxis().LabelsOption("v")
+    hist.Draw("COLZ")
+    canvas.Update()
+
+    image_name = f"{name}.png"
+    canvas.SaveAs(image_name)
+    print(f"Histogram image saved at: {image_name}")
+    output_file.write(hist)
+    output_file.write_canvas(canvas, f"{name}_Canvas")
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if len(arguments) < 2:
+        print("Usage: python module_comparison.py module1.root module2.root ... [--kind=Noise1D|Threshold1D|Noise2D|"
+              "Threshold2D] [--chip=15] [--bins=200] [--z-cut=3.5]")
+        sys.exit(1)
+    ROOT.gROOT.SetBatch(True)
+
+    kind = options.get("kind", "Noise1D")
+    labels, counts, edges = read_distributions(arguments, kind, options.get("chip", "15"), int(options.get("bins", 200)))
+    result = compare_modules(counts, edges, z_cut=float(options.get("z-cut", 3.5)))
+
+    write_matrix(result["ks"], labels, f"Module_KS_{kind}.csv")
+    write_matrix(result["chi2_ndf"], labels, f"Module_Chi2_{kind}.csv")
+    write_matrix(result["quantile_diff"][QUANTILES.index(0.5)], labels, f"Module_MedianDiff_{kind}.csv")
+    write_module_table(result, labels, f"Module_Summary_{kind}.csv")
+    for label, z in zip(np.array(labels)[result["outliers"]], result["z"][result["outliers"]]):
+        print(f"Outlier module: {label} (z = {z:.1f})")
+
+    with OutputWriter(f"Module_comparison_{kind}.root", **parse_output_options(sys.argv[1:])) as output_file:
+        draw_matrix(result["ks"], labels, f"KS_Distance_{kind}", "KS Distance", output_file)
+        draw_matrix(result["chi2_ndf"], labels, f"Chi2_ndf_{kind}", "#chi^{2}/ndf", output_file)
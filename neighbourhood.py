@@ -0,0 +1,73 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from pixel_arrays import nanmedian_last_axis, MAD_SIGMA
+
+# Fractions of the local level below which a pixel is called missing / problematic
+MISSING_FRACTION = 0.1
+PROBLEMATIC_FRACTION = 0.5
+
+
+def neighbour_windows(values, valid=None, size=3):
+    """
+    Returns a (rows, columns, size * size - 1) array with, for each pixel, the values of its size x size
+    neighbourhood without the pixel itself. Invalid pixels and positions outside the matrix are NaN.
+    """
+    if size % 2 == 0 or size < 3:
+        raise ValueError(f"Neighbourhood size must be an odd number >= 3, got {size}")
+    values = np.asarray(values, dtype=np.float64)
+    data = values if valid is None else np.where(valid, values, np.nan)
+    half = size // 2
+    padded = np.pad(data, half, mode="constant", constant_values=np.nan)
+    windows = sliding_window_view(padded, (size, size)).reshape(values.shape + (size * size,))
+    # Drop the central pixel so it does not pull its own reference towards itself
+    centre = size * size // 2
+    return np.concatenate((windows[..., :centre], windows[..., centre + 1:]), axis=-1)
+
+
+def local_level(values, valid=None, size=3, statistic="median"):
+    """
+    Median or mean of the valid neighbours of every pixel (NaN where there are none).
+    """
+    windows = neighbour_windows(values, valid, size)
+    if statistic == "median":
+        return nanmedian_last_axis(windows)
+    if statistic == "mean":
+        counts = (~np.isnan(windows)).sum(axis=-1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, np.nansum(windows, axis=-1) / counts, np.nan)
+    raise ValueError(f"Unknown statistic '{statistic}', expected 'median' or 'mean'")
+
+
+def neighbour_deficit(values, valid=None, size=3, missing_fraction=MISSING_FRACTION,
+                      problematic_fraction=PROBLEMATIC_FRACTION, statistic="median"):
+    """
+    Flags pixels that are much lower than their own neighbourhood: below missing_fraction of the local level
+    (missing) or below problematic_fraction of it (problematic). Used for hit maps, where a weakly illuminated
+    region should not be flagged as a whole. Returns (missing mask, problematic mask).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.ones(values.shape, dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+    level = local_level(values, valid, size, statistic)
+    usable = valid & np.isfinite(level) & (level > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = np.where(usable, values / level, np.nan)
+    missing = usable & (ratio < missing_fraction)
+    problematic = usable & ~missing & (ratio < problematic_fraction)
+    return missing, problematic
+
+
+def neighbour_outliers(values, valid=None, size=5, z_cut=5.0):
+    """
+    Flags pixels whose value deviates from the median of their neighbourhood by more than z_cut local robust
+    sigmas (MAD of the neighbourhood). Used for the threshold and noise maps of plotsreverse.py --neighbour.
+    Returns the outlier mask.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.ones(values.shape, dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+    windows = neighbour_windows(values, valid, size)
+    level = nanmedian_last_axis(windows)
+    spread = MAD_SIGMA * nanmedian_last_axis(np.abs(windows - level[..., None]))
+    usable = valid & np.isfinite(level) & (spread > 0)
+    with np.errstate(invalid="ignore"):
+        return usable & (np.abs(values - level) > z_cut * spread)
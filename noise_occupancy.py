@@ -0,0 +1,137 @@
+import sys
+import os
+import csv
+import numpy as np
+
+from pixel_arrays import array_to_pixel_map
+from pixel_geometry import mask_to_index, to_positions
+from pixel_classifier import read_chip_maps
+from campaign_summary import parse_run_file
+from mask_writer import read_pixel_field, write_enable_mask
+from compact_output import OutputWriter, parse_output_options
+
+SUMMARY_COLUMNS = ["path", "run", "chip", "enabled", "rate_before", "masked", "rate_after", "target"]
+
+
+def fake_hit_rates(occupancy, triggers=None):
+    """
+    Per-pixel fake-hit rate (hits per trigger) of NoiseScan maps. The DAQ occupancy is already normalised by the
+    number of triggers; raw hit counts are divided by `triggers`. Pixels without data (NaN) count as silent.
+    """
+    rates = np.nan_to_num(np.asarray(occupancy, dtype=np.float64), nan=0.0)
+    return rates / triggers if triggers else rates
+
+
+def minimal_masks(rates, target, enabled=None, per_pixel=False):
+    """
+    Smallest set of pixels to mask so the total fake-hit rate of the enabled pixels of each map drops to `target`
+    (with per_pixel, to `target` times the number of pixels left enabled). Works on one (rows, columns) map or a
+    (..., rows, columns) stack at once: pixels are ranked by rate and the rate left after masking the k noisiest
+    is a suffix sum, so the minimal k is the first one meeting the target.
+    Returns (masks, number masked, total rate before, total rate after), with one entry per map.
+    """
+    rates = np.asarray(rates, dtype=np.float64)
+    enabled = np.ones(rates.shape, dtype=bool) if enabled is None else np.broadcast_to(enabled, rates.shape)
+    *stack, rows, cols = rates.shape
+    flat = np.where(enabled, rates, 0.0).reshape(*stack, rows * cols)
+
+    order = np.argsort(-flat, axis=-1, kind="stable")
+    ordered = np.take_along_axis(flat, order, axis=-1)
+    # remaining[..., k]: rate left with the k noisiest pixels masked (suffix sums, exactly 0 at the end)
+    remaining = np.concatenate((np.cumsum(ordered[..., ::-1], axis=-1)[..., ::-1],
+                                np.zeros((*stack, 1))), axis=-1)
+    if per_pixel:
+        n_enabled = enabled.reshape(*stack, rows * cols).sum(axis=-1)
+        limit = target * np.maximum(n_enabled[..., None] - np.arange(rows * cols + 1), 0)
+    else:
+        limit = target
+    n_masked = np.argmax(remaining <= limit, axis=-1)
+
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(rows * cols), axis=-1)
+    masks = (rank < n_masked[..., None]).reshape(rates.shape)
+    rate_after = np.take_along_axis(remaining, n_masked[..., None], axis=-1)[..., 0]
+    return masks, n_masked, remaining[..., 0], rate_after
+
+
+def read_noise_scans(root_files):
+    """
+    Reads the occupancy maps of NoiseScan files. Returns a list of (path, run, chip, occupancy map).
+    """
+    scans = []
+    for root_file in root_files:
+        run, _ = parse_run_file(root_file)
+        for chip, maps in sorted(read_chip_maps([root_file]).items()):
+            if "PixelAlive" in maps:
+                scans.append((root_file, run, chip, maps["PixelAlive"]))
+            else:
+                print(f"{root_file}: no occupancy map for chip {chip}")
+    return scans
+
+
+def write_noisy_pixels(mask, path):
+    """
+    Writes the masked pixels as "column, row" lines (chip configuration convention), as read by mask_writer.py.
+    """
+    with open(path, "w") as f:
+        for col, row in to_positions(mask_to_index(mask), "config"):
+            f.write(f"{col}, {row}\n")
+    print(f"Noisy pixel list saved: {path}")
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if not arguments or "target" not in options:
+        print("Usage: python noise_occupancy.py Run_NoiseScan.root [more.root ...] --target=1e-6 [--per-pixel] "
+              "[--triggers=N (raw hit maps)] [--config=CMSIT_RD53B.txt (single chip)] [--policy=union|replace] "
+              "[--output=Noise_occupancy]")
+        sys.exit(1)
+
+    target = float(options["target"])
+    per_pixel = "--per-pixel" in sys.argv
+    triggers = float(options["triggers"]) if "triggers" in options else None
+    scans = read_noise_scans(arguments)
+    if not scans:
+        print("No NoiseScan occupancy maps found.")
+        sys.exit(1)
+    chips = sorted({chip for _, _, chip, _ in scans})
+    if "config" in options and len(chips) > 1:
+        # The ENABLE map of a configuration belongs to one chip: it cannot be applied to the scans of the others
+        print(f"--config applies to a single chip, but the scans have chips {chips}; run each chip with its own "
+              "configuration, or without --config and use the Noisy_pixels_Chip*.txt lists with mask_writer.py")
+        sys.exit(1)
+    enabled = read_pixel_field(options["config"], "ENABLE") != 0 if "config" in options else None
+
+    # All scans in one pass: the minimal mask of every scan from one sort of the stacked rate maps
+    rates = fake_hit_rates(np.stack([occupancy for *_, occupancy in scans]), triggers)
+    masks, n_masked, rate_before, rate_after = minimal_masks(rates, target, enabled, per_pixel)
+
+    output_folder = options.get("output", "Noise_occupancy")
+    os.makedirs(output_folder, exist_ok=True)
+    with open(os.path.join(output_folder, "Noise_occupancy.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_COLUMNS)
+        for i, (path, run, chip, _) in enumerate(scans):
+            n_enabled = int(rates[i].size if enabled is None else enabled.sum())
+            writer.writerow([path, run, chip, n_enabled, rate_before[i], n_masked[i], rate_after[i], target])
+            print(f"{path} chip {chip}: fake-hit rate {rate_before[i]:.3g} -> {rate_after[i]:.3g} per trigger "
+                  f"with {n_masked[i]} pixels masked")
+
+    # A pixel is masked if any scan of its chip needs it, so the target holds in every scan
+    chip_masks = {}
+    for (_, _, chip, _), mask in zip(scans, masks):
+        chip_masks[chip] = chip_masks.get(chip, False) | mask
+
+    with OutputWriter(os.path.join(output_folder, "Noise_occupancy.root"),
+                      **parse_output_options(sys.argv[1:])) as output_file:
+        for i, (path, run, chip, _) in enumerate(scans):
+            output_file.write(array_to_pixel_map(rates[i], f"FakeHitRate_Run{run}_Chip({chip})"))
+        for chip, mask in sorted(chip_masks.items()):
+            output_file.write_label_map(mask.astype(np.int16), f"NoisyMask_Chip({chip})")
+            write_noisy_pixels(mask, os.path.join(output_folder, f"Noisy_pixels_Chip{chip}.txt"))
+
+    if "config" in options:
+        mask = next(iter(chip_masks.values()))
+        write_enable_mask(options["config"], set(to_positions(mask_to_index(mask), "config")),
+                          policy=options.get("policy", "union"))
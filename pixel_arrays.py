@@ -0,0 +1,138 @@
+import re
+import ROOT
+import numpy as np
+
+# Matrix dimensions and index conventions live in pixel_geometry; re-exported for the existing imports
+from pixel_geometry import N_COLS, N_ROWS, CORE_SIZE
+
+# Scale factor turning the median absolute deviation into a Gaussian sigma
+MAD_SIGMA = 1.4826
+
+
+def iter_canvas_histograms(directory, pattern):
+    """
+    Recursively walks a ROOT directory and yields (canvas name, histogram) for every TCanvas whose name matches
+    the regular expression. The histogram is cloned and detached so it survives the canvas and the file.
+    """
+    regex = re.compile(pattern)
+    for key in directory.GetListOfKeys():
+        # Decide from the key alone, so canvases that are not requested are never read
+        key_class = ROOT.TClass.GetClass(key.GetClassName())
+        if key_class.InheritsFrom(ROOT.TDirectory.Class()):
+            # Recursive search in subdirectories
+            yield from iter_canvas_histograms(key.ReadObj(), pattern)
+        elif key_class.InheritsFrom(ROOT.TCanvas.Class()) and regex.search(key.GetName()):
+            obj = key.ReadObj()
+            for prim in obj.GetListOfPrimitives():
+                if prim.InheritsFrom(ROOT.TH1.Class()):
+                    hist = prim.Clone(prim.GetName())
+                    hist.SetDirectory(0)
+                    yield obj.GetName(), hist
+                    break
+
+
+def list_canvas_names(directory):
+    """
+    Returns the names of all TCanvas keys of a ROOT directory tree, without reading the canvases.
+    """
+    names = []
+    for key in directory.GetListOfKeys():
+        key_class = ROOT.TClass.GetClass(key.GetClassName())
+        if key_class.InheritsFrom(ROOT.TDirectory.Class()):
+            names.extend(list_canvas_names(key.ReadObj()))
+        elif key_class.InheritsFrom(ROOT.TCanvas.Class()):
+            names.append(key.GetName())
+    return names
+
+
+def find_histogram(directory, canvas_name):
+    """
+    Returns a detached copy of the first histogram drawn in the canvas with the given name, or None.
+    """
+    for name, hist in iter_canvas_histograms(directory, f"^{re.escape(canvas_name)}$"):
+        return hist
+    return None
+
+
+def hist_to_array(hist):
+    """
+    Returns the bin contents of a TH1/TH2 as a NumPy array, without the under/overflow bins.
+    2D maps come out indexed as [row, column], i.e. [y bin - 1, x bin - 1].
+    """
+    nx, ny = hist.GetNbinsX(), hist.GetNbinsY()
+    n_cells = (nx + 2) * (ny + 2) if hist.GetDimension() == 2 else nx + 2
+
+    # Read the whole internal buffer at once instead of calling GetBinContent per bin
+    view = hist.GetArray()
+    view.reshape((n_cells,))
+    data = np.array(view, copy=True)
+
+    if hist.GetDimension() == 2:
+        return data.reshape(ny + 2, nx + 2)[1:-1, 1:-1]
+    return data[1:-1]
+
+
+def set_hist_contents(hist, values, entries=None):
+    """
+    Sets all bin contents of a TH1/TH2 from an array laid out like hist_to_array returns it.
+    Under/overflow bins are cleared. The number of entries defaults to the sum of the contents.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if hist.GetDimension() == 2:
+        full = np.zeros((hist.GetNbinsY() + 2, hist.GetNbinsX() + 2))
+        full[1:-1, 1:-1] = values
+    else:
+        full = np.zeros(hist.GetNbinsX() + 2)
+        full[1:-1] = values
+    hist.SetContent(np.ascontiguousarray(full.ravel()))
+    hist.SetEntries(float(values.sum()) if entries is None else entries)
+    return hist
+
+
+def book_pixel_map(name, title="", hist_type=None):
+    """
+    Books an empty 2D histogram (TH2F unless another class is given) with the RD53B pixel matrix binning
+    (columns on X, rows on Y).
+    """
+    hist_type = hist_type or ROOT.TH2F
+    hist = hist_type(name, title, N_COLS, 0, N_COLS, N_ROWS, 0, N_ROWS)
+    hist.SetDirectory(0)
+    return hist
+
+
+def array_to_pixel_map(values, name, title="", entries=None, hist_type=None):
+    """
+    Converts a (rows, columns) array into a pixel map histogram.
+    """
+    return set_hist_contents(book_pixel_map(name, title, hist_type), values, entries)
+
+
+def block_view(values, block=CORE_SIZE):
+    """
+    Reshapes a (..., rows, columns) map or stack of maps into (..., block rows, block columns, block * block),
+    so per-core statistics are reductions over the last axis.
+    """
+    *stack, rows, cols = values.shape
+    if rows % block or cols % block:
+        raise ValueError(f"Map of shape {values.shape} cannot be split in {block}x{block} blocks")
+    view = values.reshape(*stack, rows // block, block, cols // block, block).swapaxes(-3, -2)
+    return view.reshape(*stack, rows // block, cols // block, block * block)
+
+
+def expand_blocks(block_values, block=CORE_SIZE):
+    """
+    Broadcasts one value per block back to the pixel map it was computed from.
+    """
+    return np.repeat(np.repeat(block_values, block, axis=-2), block, axis=-1)
+
+
+def nanmedian_last_axis(values):
+    """
+    Median over the last axis ignoring NaNs, from one sort (NaNs sort last); NaN where a row has no valid value.
+    Much faster than np.nanmedian on many short rows such as the 64 pixels of each core.
+    """
+    ordered = np.sort(values, axis=-1)
+    n_valid = (~np.isnan(ordered)).sum(axis=-1)
+    low = np.take_along_axis(ordered, np.maximum((n_valid - 1) // 2, 0)[..., None], axis=-1)[..., 0]
+    high = np.take_along_axis(ordered, (n_valid // 2)[..., None], axis=-1)[..., 0]
+    return np.where(n_valid > 0, (low + high) / 2, np.nan)
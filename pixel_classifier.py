@@ -0,0 +1,179 @@
+import ROOT
+import sys
+import re
+import numpy as np
+
+from pixel_arrays import (iter_canvas_histograms, hist_to_array, array_to_pixel_map, block_view, expand_blocks,
+                          nanmedian_last_axis, MAD_SIGMA)
+from mask_writer import write_enable_mask
+from shared_maps import map_shared
+from pixel_geometry import mask_to_index, to_positions
+
+# Label values of the combined classification map (a pixel gets the first class that applies)
+PIXEL_CLASSES = {"dead": 1, "hot": 2, "noisy": 3, "outlier": 4, "joint": 5}
+
+
+def robust_z(values, valid=None):
+    """
+    Median/MAD z-scores of a map, against the whole chip and against each 8x8 core.
+    Invalid pixels are excluded from the reference statistics and get a z-score of 0.
+    Returns (chip z, core z).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.isfinite(values) if valid is None else valid & np.isfinite(values)
+    data = np.where(valid, values, np.nan)
+    if not valid.any():
+        return np.zeros_like(values), np.zeros_like(values)
+
+    median = np.nanmedian(data)
+    mad = MAD_SIGMA * np.nanmedian(np.abs(data - median))
+    chip_z = _scaled(data - median, mad)
+
+    # Same statistics per core: the reshape turns each core into one row of 64 pixels
+    cores = block_view(data)
+    core_median = nanmedian_last_axis(cores)
+    core_mad = MAD_SIGMA * nanmedian_last_axis(np.abs(cores - core_median[..., None]))
+    core_z = _scaled(data - expand_blocks(core_median), expand_blocks(core_mad))
+
+    return np.where(valid, chip_z, 0.0), np.where(valid, core_z, 0.0)
+
+
+def _scaled(deviation, scale):
+    # Deviation in units of the robust sigma; a zero spread only flags values that differ at all
+    scale = np.asarray(scale, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = np.where(scale > 0, deviation / scale, np.sign(deviation) * np.inf)
+    return np.nan_to_num(z, nan=0.0, posinf=np.inf, neginf=-np.inf)
+
+
+def joint_density(threshold, noise, thr_noise):
+    """
+    Looks up, for every pixel, the population of its (threshold, noise) bin in the ThrNoise2D distribution.
+    thr_noise is (counts[y, x], (x min, x max), (y min, y max)) with threshold on X and noise on Y.
+    Pixels outside the histogram range get a density of 0.
+    """
+    counts, (x_min, x_max), (y_min, y_max) = thr_noise
+    ny, nx = counts.shape
+    ix = np.floor((threshold - x_min) / (x_max - x_min) * nx).astype(np.int64)
+    iy = np.floor((noise - y_min) / (y_max - y_min) * ny).astype(np.int64)
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    density = np.zeros(threshold.shape)
+    density[inside] = counts[iy[inside], ix[inside]]
+    return density
+
+
+def classify_pixels(threshold=None, noise=None, occupancy=None, thr_noise=None, masked=None,
+                    z_cut=5.0, min_joint_count=2):
+    """
+    Flags dead, hot, noisy, outlier and joint threshold-noise outlier pixels from the per-pixel maps of one chip.
+    All inputs are (rows, columns) arrays, except thr_noise (see joint_density). Masked pixels are never flagged.
+    Returns a dict of boolean maps, one per class.
+    """
+    maps = [m for m in (threshold, noise, occupancy) if m is not None]
+    if not maps:
+        raise ValueError("At least one of the threshold, noise or occupancy maps is needed")
+    shape = maps[0].shape
+    masked = np.zeros(shape, dtype=bool) if masked is None else np.asarray(masked, dtype=bool)
+    classes = {name: np.zeros(shape, dtype=bool) for name in PIXEL_CLASSES}
+
+    # Dead: no response in PixelAlive, or failed S-curve fits (stored as 0)
+    if occupancy is not None:
+        classes["dead"] |= occupancy <= 0
+    if threshold is not None and noise is not None:
+        classes["dead"] |= (threshold == 0) & (noise == 0)
+    alive = ~masked & ~classes["dead"]
+
+    if occupancy is not None:
+        # Hot: more hits than injected and far above the rest of the chip
+        chip_z, core_z = robust_z(occupancy, alive)
+        classes["hot"] = alive & (occupancy > 1) & ((chip_z > z_cut) | (core_z > z_cut))
+    if noise is not None:
+        chip_z, core_z = robust_z(noise, alive)
+        classes["noisy"] = alive & ((chip_z > z_cut) | (core_z > z_cut))
+    if threshold is not None:
+        chip_z, core_z = robust_z(threshold, alive)
+        classes["outlier"] = alive & ((np.abs(chip_z) > z_cut) | (np.abs(core_z) > z_cut))
+    if thr_noise is not None and threshold is not None and noise is not None:
+        classes["joint"] = alive & (joint_density(threshold, noise, thr_noise) <= min_joint_count)
+
+    classes["dead"] &= ~masked
+    return classes
+
+
+def classify_chip(maps, z_cut=5.0):
+    """
+    classify_pixels of one chip from its read_chip_maps entry.
+    """
+    return classify_pixels(maps.get("Threshold2D"), maps.get("Noise2D"), maps.get("PixelAlive"), maps.get("ThrNoise2D"),
+                           z_cut=z_cut)
+
+
+def label_map(classes):
+    """
+    Combines the class masks into one map of PIXEL_CLASSES labels (0 for good pixels).
+    """
+    labels = np.zeros(next(iter(classes.values())).shape, dtype=np.int16)
+    for name, label in sorted(PIXEL_CLASSES.items(), key=lambda item: -item[1]):
+        labels[classes[name]] = label
+    return labels
+
+
+def mask_positions(mask):
+    """
+    Converts a (rows, columns) boolean map into the (ENABLE row, value index) positions used by the chip
+    configuration, i.e. (column, row).
+    """
+    return set(to_positions(mask_to_index(mask), "config"))
+
+
+def read_chip_maps(root_files):
+    """
+    Reads the Threshold2D, Noise2D, PixelAlive and ThrNoise2D maps of all chips found in the given files.
+    Returns {chip: {kind: array}}, with ThrNoise2D stored as (counts, x range, y range).
+    """
+    pattern = r"_(Threshold2D|Noise2D|PixelAlive|ThrNoise2D)_Chip\((\d+)\)$"
+    chips = {}
+    for root_file in root_files:
+        file = ROOT.TFile.Open(root_file, "READ")
+        if not file or not file.IsOpen():
+            print(f"Could not open file {root_file}")
+            continue
+        for name, hist in iter_canvas_histograms(file, pattern):
+            kind, chip = re.search(pattern, name).groups()
+            values = hist_to_array(hist)
+            if kind == "ThrNoise2D":
+                x_axis, y_axis = hist.GetXaxis(), hist.GetYaxis()
+                values = (values, (x_axis.GetXmin(), x_axis.GetXmax()), (y_axis.GetXmin(), y_axis.GetXmax()))
+            chips.setdefault(int(chip), {})[kind] = values
+        file.Close()
+    return chips
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if not arguments:
+        print("Usage: python pixel_classifier.py Run_SCurve.root [Run_PixelAlive.root ...] [--z-cut=5] "
+              "[--config=CMSIT_RD53B.txt (single chip)] [--policy=union|replace] [--jobs=4]")
+        sys.exit(1)
+
+    z_cut = float(options.get("z-cut", 5.0))
+    # With --jobs the chips are classified in parallel, reading their maps from shared memory
+    chip_classes = map_shared(classify_chip, read_chip_maps(arguments), (z_cut,), jobs=int(options.get("jobs", 1)))
+    output_file = ROOT.TFile("Pixel_classes.root", "RECREATE")
+    for chip, classes in sorted(chip_classes.items()):
+        print(f"Chip {chip}: " + ", ".join(f"{name} {int(mask.sum())}" for name, mask in classes.items()))
+        output_file.cd()
+        array_to_pixel_map(label_map(classes), f"Pixel_Classes_Chip({chip})").Write()
+
+        # Positions of every flagged pixel, in the convention of the chip configuration
+        flagged = np.logical_or.reduce(list(classes.values()))
+        with open(f"Flagged_pixels_Chip{chip}.txt", "w") as f:
+            for name, mask in classes.items():
+                f.write(f"{name.capitalize()} Positions:\n")
+                for col, row in sorted(mask_positions(mask)):
+                    f.write(f"{col}, {row}\n")
+                f.write("\n")
+        if "config" in options:
+            write_enable_mask(options["config"], mask_positions(flagged), policy=options.get("policy", "union"))
+    output_file.Close()
@@ -0,0 +1,199 @@
+import numpy as np
+
+# RD53B pixel matrix: the DAQ books the maps as 432 columns (X axis) x 336 rows (Y axis)
+N_COLS = 432
+N_ROWS = 336
+N_PIXELS = N_ROWS * N_COLS
+
+# Pixels are grouped in square cores of CORE_SIZE x CORE_SIZE
+CORE_SIZE = 8
+
+# How the scripts write pixel positions as (first, second) pairs:
+#   rowcol  (row, column), 0-based: the index of the (rows, columns) arrays of hist_to_array
+#   bins    (X bin, Y bin), 1-based ROOT bins = (column + 1, row + 1): hitsperpixel.py, plotsreverse.py,
+#           Bump_bonds_Xray.txt
+#   config  (ENABLE/TDAC line, value index), 0-based = (column, row): chip configurations, mask_writer.py
+POSITION_CONVENTIONS = ("rowcol", "bins", "config")
+
+
+def rowcol_to_index(row, col):
+    """
+    Linear index of (row, column) pixels: the position in a (rows, columns) map flattened with ravel().
+    """
+    return np.asarray(row, dtype=np.int64) * N_COLS + np.asarray(col, dtype=np.int64)
+
+
+def index_to_rowcol(index):
+    """
+    (row, column) of linear pixel indices.
+    """
+    return np.divmod(np.asarray(index, dtype=np.int64), N_COLS)
+
+
+def bins_to_rowcol(binx, biny):
+    """
+    (row, column) of 1-based ROOT bins of a pixel map (columns on X, rows on Y).
+    """
+    return np.asarray(biny, dtype=np.int64) - 1, np.asarray(binx, dtype=np.int64) - 1
+
+
+def rowcol_to_bins(row, col):
+    """
+    1-based (X bin, Y bin) of (row, column) pixels.
+    """
+    return np.asarray(col, dtype=np.int64) + 1, np.asarray(row, dtype=np.int64) + 1
+
+
+def core_of(row, col, core=CORE_SIZE):
+    """
+    (core row, core column) of (row, column) pixels.
+    """
+    return np.asarray(row) // core, np.asarray(col) // core
+
+
+def core_index(index, core=CORE_SIZE):
+    """
+    Linear core number (row-major over the cores of the chip) of linear pixel indices.
+    """
+    core_row, core_col = core_of(*index_to_rowcol(index), core)
+    return core_row * (N_COLS // core) + core_col
+
+
+def to_index(positions, convention="rowcol"):
+    """
+    Converts (first, second) pixel positions written in one of the POSITION_CONVENTIONS into sorted, unique
+    linear indices. Positions outside the matrix raise a ValueError instead of being silently wrapped.
+    """
+    if convention not in POSITION_CONVENTIONS:
+        raise ValueError(f"Unknown position convention '{convention}', expected one of {POSITION_CONVENTIONS}")
+    pairs = np.asarray(list(positions) if isinstance(positions, (set, frozenset)) else positions, dtype=np.int64)
+    pairs = pairs.reshape(-1, 2)
+    first, second = pairs[:, 0], pairs[:, 1]
+    if convention == "rowcol":
+        row, col = first, second
+    elif convention == "bins":
+        row, col = bins_to_rowcol(first, second)
+    else:
+        row, col = second, first
+    outside = (row < 0) | (row >= N_ROWS) | (col < 0) | (col >= N_COLS)
+    if outside.any():
+        raise ValueError(f"{int(outside.sum())} {convention} positions outside the {N_ROWS}x{N_COLS} matrix, "
+                         f"e.g. {tuple(pairs[outside][0].tolist())}")
+    return np.unique(rowcol_to_index(row, col))
+
+
+def from_index(index, convention="rowcol"):
+    """
+    Converts linear indices into an (n, 2) array of positions in one of the POSITION_CONVENTIONS.
+    """
+    if convention not in POSITION_CONVENTIONS:
+        raise ValueError(f"Unknown position convention '{convention}', expected one of {POSITION_CONVENTIONS}")
+    row, col = index_to_rowcol(index)
+    if convention == "rowcol":
+        pairs = (row, col)
+    elif convention == "bins":
+        pairs = rowcol_to_bins(row, col)
+    else:
+        pairs = (col, row)
+    return np.stack(pairs, axis=-1)
+
+
+def to_positions(index, convention="rowcol"):
+    """
+    Linear indices as a list of position tuples, for the text files and the scripts that use sets of tuples.
+    """
+    return [tuple(pair) for pair in from_index(index, convention).tolist()]
+
+
+def mask_to_index(mask):
+    """
+    Linear indices of the True pixels of a (rows, columns) boolean map.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if mask.shape != (N_ROWS, N_COLS):
+        raise ValueError(f"Pixel mask of shape {mask.shape}, expected {(N_ROWS, N_COLS)}")
+    return np.flatnonzero(mask)
+
+
+def index_to_mask(index):
+    """
+    (rows, columns) boolean map with the given linear indices set.
+    """
+    mask = np.zeros(N_PIXELS, dtype=bool)
+    mask[np.asarray(index, dtype=np.int64)] = True
+    return mask.reshape(N_ROWS, N_COLS)
+
+
+class ModuleLayout:
+    """
+    Placement of the chips of a multi-chip module: `placement` maps chip id -> (slot row, slot column, rotated),
+    where rotated chips are turned by 180 degrees in the module. Module coordinates are (row, column) over the
+    whole module, with slot (0, 0) at the origin.
+    """
+
+    def __init__(self, placement):
+        self.placement = dict(placement)
+        slots = [(slot_row, slot_col) for slot_row, slot_col, _ in self.placement.values()]
+        if len(set(slots)) != len(slots):
+            raise ValueError("Two chips of the module layout share a slot")
+        self.slot_rows = max(slot_row for slot_row, _ in slots) + 1
+        self.slot_cols = max(slot_col for _, slot_col in slots) + 1
+        self._slot_chip = {(slot_row, slot_col): chip for chip, (slot_row, slot_col, _) in self.placement.items()}
+
+    @classmethod
+    def grid(cls, chips, columns):
+        """
+        Layout with the chips filling a grid of `columns` slots per row, in order and without rotation.
+        """
+        return cls({chip: (i // columns, i % columns, False) for i, chip in enumerate(chips)})
+
+    @property
+    def shape(self):
+        return self.slot_rows * N_ROWS, self.slot_cols * N_COLS
+
+    def to_module(self, chip, row, col):
+        """
+        Module (row, column) of (row, column) pixels of a chip.
+        """
+        slot_row, slot_col, rotated = self.placement[chip]
+        row, col = np.asarray(row, dtype=np.int64), np.asarray(col, dtype=np.int64)
+        if rotated:
+            row, col = N_ROWS - 1 - row, N_COLS - 1 - col
+        return slot_row * N_ROWS + row, slot_col * N_COLS + col
+
+    def from_module(self, module_row, module_col):
+        """
+        (chip, row, column) of module coordinates; chip is -1 for empty slots.
+        """
+        slot_row, row = np.divmod(np.asarray(module_row, dtype=np.int64), N_ROWS)
+        slot_col, col = np.divmod(np.asarray(module_col, dtype=np.int64), N_COLS)
+        chip = np.full(np.broadcast(slot_row, slot_col).shape, -1, dtype=np.int64)
+        rotated = np.zeros(chip.shape, dtype=bool)
+        for (s_row, s_col), chip_id in self._slot_chip.items():
+            in_slot = (slot_row == s_row) & (slot_col == s_col)
+            chip[in_slot] = chip_id
+            rotated[in_slot] = self.placement[chip_id][2]
+        row = np.where(rotated, N_ROWS - 1 - row, row)
+        col = np.where(rotated, N_COLS - 1 - col, col)
+        return chip, row, col
+
+    def assemble(self, chip_maps, fill=np.nan):
+        """
+        Places the (rows, columns) maps of {chip: map} into one module map; missing chips are left at `fill`.
+        """
+        module = np.full(self.shape, fill, dtype=np.result_type(*chip_maps.values(), np.asarray(fill)))
+        for chip, values in chip_maps.items():
+            slot_row, slot_col, rotated = self.placement[chip]
+            module[slot_row * N_ROWS:(slot_row + 1) * N_ROWS, slot_col * N_COLS:(slot_col + 1) * N_COLS] = \
+                np.asarray(values)[::-1, ::-1] if rotated else values
+        return module
+
+    def split(self, module):
+        """
+        Inverse of assemble: {chip: (rows, columns) map} from a module map.
+        """
+        chip_maps = {}
+        for chip, (slot_row, slot_col, rotated) in self.placement.items():
+            values = module[slot_row * N_ROWS:(slot_row + 1) * N_ROWS, slot_col * N_COLS:(slot_col + 1) * N_COLS]
+            chip_maps[chip] = values[::-1, ::-1] if rotated else values
+        return chip_maps
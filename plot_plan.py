@@ -0,0 +1,96 @@
+import os
+import re
+import fnmatch
+import tomllib
+from functools import lru_cache
+
+# Plan shipped next to the scripts
+DEFAULT_PLAN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plot_plan.toml")
+
+# Axis style used when a plan does not define a "default" preset
+DEFAULT_STYLE = {"title_size": 34, "title_font": 43, "label_size": 0.04, "z_title_offset": 1.8}
+
+VARIANT_KEYS = ("suffix", "range", "log", "colz", "fit", "electron_axis", "stats", "style")
+
+
+class PlotPlan:
+    """
+    Compiled plot plan of one script: the rules (canvas pattern, quantity, variants) plus one regular expression
+    matching every planned canvas, so each input file is scanned once.
+    """
+
+    def __init__(self, rules, styles):
+        self.styles = styles
+        self.rules = [(re.compile(fnmatch.translate(rule["pattern"])), rule) for rule in rules]
+        self.pattern = "^(?:" + "|".join(f"(?:{regex.pattern})" for regex, _ in self.rules) + ")" if rules else "(?!)"
+        self._cache = {}
+
+    def variants_for(self, canvas_name):
+        """
+        Returns the (quantity, variant) pairs planned for a canvas, with the style preset resolved.
+        Variants of several rules that would write the same image are only drawn once.
+        """
+        if canvas_name not in self._cache:
+            variants = {}
+            for regex, rule in self.rules:
+                if not regex.match(canvas_name):
+                    continue
+                for variant in rule.get("variants", [{}]):
+                    suffix = variant.get("suffix", "")
+                    if suffix in variants:
+                        print(f"{canvas_name}: variant '{suffix}' is planned more than once, the first one is used")
+                        continue
+                    resolved = dict(variant, suffix=suffix, style=self.styles[variant.get("style", "default")])
+                    variants[suffix] = (rule.get("quantity"), resolved)
+            self._cache[canvas_name] = list(variants.values())
+        return self._cache[canvas_name]
+
+
+@lru_cache(maxsize=None)
+def load_plot_plan(group, plan_file=DEFAULT_PLAN):
+    """
+    Reads and checks the [[group]] entries of a TOML plot plan, once per file and group.
+    """
+    with open(plan_file, "rb") as f:
+        plan = tomllib.load(f)
+    styles = {"default": dict(DEFAULT_STYLE)}
+    for name, style in plan.get("styles", {}).items():
+        styles[name] = {**DEFAULT_STYLE, **style}
+
+    rules = plan.get(group, [])
+    for rule in rules:
+        if "pattern" not in rule:
+            raise ValueError(f"{plan_file}: every [[{group}]] entry needs a pattern")
+        for variant in rule.get("variants", []):
+            unknown = set(variant) - set(VARIANT_KEYS)
+            if unknown:
+                raise ValueError(f"{plan_file}: unknown variant keys {sorted(unknown)} for {rule['pattern']}")
+            if variant.get("style", "default") not in styles:
+                raise ValueError(f"{plan_file}: unknown style '{variant['style']}' for {rule['pattern']}")
+    return PlotPlan(rules, styles)
+
+
+def apply_style(prim, style=None):
+    """
+    Sets the title and label sizes and fonts of the three axes from a style preset.
+    """
+    style = style or DEFAULT_STYLE
+    for axis in (prim.GetXaxis(), prim.GetYaxis(), prim.GetZaxis()):
+        axis.SetTitleSize(style["title_size"])
+        axis.SetTitleFont(style["title_font"])
+        axis.SetLabelSize(style["label_size"])
+    prim.GetZaxis().SetTitleOffset(style["z_title_offset"])
+
+
+def parse_plan_option(arguments):
+    """
+    Splits the --plan=plot_plan.toml option from the other arguments. Returns (arguments, plan file).
+    """
+    plan_file = DEFAULT_PLAN
+    remaining = []
+    for argument in arguments:
+        if argument.startswith("--plan="):
+            plan_file = argument.split("=", 1)[1]
+        else:
+            remaining.append(argument)
+    return remaining, plan_file
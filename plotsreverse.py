@@ -2,6 +2,7 @@ import ROOT
 import sys
 import os
 import math
+import numpy as np
 from ROOT import TLine
 from array import array
 
@@ -10,13 +11,19 @@ current_directory = os.path.dirname(os.path.abspath(__file__))
 
 # Construct the path to the directory where hitsperpixel.py is located
 # Move up two levels (to the directory 201-9B_practicas) and then down to Xray_20240405/Results
-hitsperpixel_directory = os.path.abspath(os.path.join(current_home_directory, '..', '..', 'Xray_20240405', 'Results'))
+hitsperpixel_directory = os.path.abspath(os.path.join(current_directory, '..', '..', 'Xray_20240405', 'Results'))
 
 # Add the directory to sys.path to allow importing from it
 sys.path.append(hitsperpixel_directory)
 
 # Import the draw_missing_prob function from the hitsperpixel module
-from hitsperpixel import draw_missing_prob
+from hitsperpixel import draw_missing_prob, parse_neighbour_size
+from shift_correlation import ShiftCorrelation
+from quantile_sketch import QuantileSketch, adaptive_binning
+from pixel_arrays import hist_to_array, book_pixel_map, set_hist_contents
+from pixel_geometry import mask_to_index, to_index, index_to_mask, to_positions
+from neighbourhood import neighbour_deficit, neighbour_outliers
+from compact_output import OutputWriter, parse_output_options
 
 
 # Set the statistics position box
@@ -71,9 +78,12 @@ def process_directory(directory, histogram_name):
 import ROOT
 from ROOT import TLine
 
-def plot_vcal_difference(root_file1, root_file2, hist_name, name, output_file):
+def plot_vcal_difference(root_file1, root_file2, hist_name, name, output_file, neighbour_size=None):
     """
     Compares two histograms from two ROOT files and plots the difference in Vcal values. Also, it collects the positions that meets the established conditions. 
+    With neighbour_size (3, 5, ...) a pixel is selected when its shift is less than half the median shift of its neighbours, instead of using the fixed windows.
+    In that mode the threshold or noise shift must also be a local outlier (neighbour_outliers, robust z of the neighbourhood), so pixels in regions where the shift is naturally spread are not selected.
+    The range and binning of the shift histogram come from a quantile sketch of the differences.
     """
     # Open ROOT files
     file1 = ROOT.TFile.Open(root_file1, "READ")
@@ -88,32 +98,31 @@ def plot_vcal_difference(root_file1, root_file2, hist_name, name, output_file):
         print("Histograms not found.")
         return
 
-    # Get the number of bins in X and Y directions
-    nx = hist1.GetNbinsX()
-    ny = hist1.GetNbinsY()
+    # Differences of all pixels, ordered column by column like the bins (x, y)
+    diff_map = hist_to_array(hist1) - hist_to_array(hist2)
+    # FillN needs doubles, while the maps of TH2F histograms come out as float32
+    ordered = diff_map.T.ravel().astype(np.float64)
+    differences = ordered.tolist()  # List to store the differences between histogram values
 
-    # Initialize histogram for the differences based on the type of data
-    if name == "Noise":
-        vcal_diff_hist = ROOT.TH1F(f"{name} Shift w7-24", "", 2000, -500, 500)  # Adjust range as needed
-    elif name == "Threshold":
-        vcal_diff_hist = ROOT.TH1F(f"{name} Shift w7-24", "", 2000, -1800, 1800)  # Adjust range as needed
-
-    differences = []  # List to store the differences between histogram values
-    positions = []  # List to store the positions (bin coordinates) meeting specific conditions
-
-    # Iterate over all bins
-    for x in range(1, nx + 1):
-        for y in range(1, ny + 1):
-            vcal1 = hist1.GetBinContent(x, y)
-            vcal2 = hist2.GetBinContent(x, y)
-            diff = vcal1 - vcal2
-            vcal_diff_hist.Fill(diff)  # Fill the histogram for differences
-            differences.append(diff)
-            # Collect positions where the differences meet specified conditions
-            if (-40 <= diff <= 40) and name == "Threshold":
-                positions.append((x, y))
-            if name == "Noise" and (-15 <= diff <= 15):
-                positions.append((x, y))
+    # Histogram range and bin width from the quantiles of the differences, always showing the selection window
+    window = 15 if name == "Noise" else 40
+    n_bins, low, high = adaptive_binning(QuantileSketch().update(ordered), include=(-window, window))
+    vcal_diff_hist = ROOT.TH1F(f"{name} Shift w7-24", "", n_bins, low, high)
+    vcal_diff_hist.FillN(len(ordered), ordered, np.ones(len(ordered)))  # Fill the histogram for differences
+
+    # Collect positions (bin coordinates) where the differences meet specified conditions
+    positions = []
+    if not neighbour_size:
+        positions = sorted(to_positions(mask_to_index(np.abs(diff_map) <= window), "bins"))
+
+    # Neighbour-aware selection: shift much smaller than the one of the surrounding pixels
+    if neighbour_size:
+        low_shift, reduced_shift = neighbour_deficit(np.abs(diff_map), None, neighbour_size)
+        significant = neighbour_outliers(diff_map, None, neighbour_size)
+        selected = (low_shift | reduced_shift) & significant
+        print(f"{name}: {int((low_shift | reduced_shift).sum())} pixels below the neighbour shift, "
+              f"{int(selected.sum())} of them local outliers")
+        positions = to_positions(mask_to_index(selected), "bins")
 
     # Set titles for the axes of the difference histogram
     vcal_diff_hist.SetXTitle(f"{name} Shift (#DeltaVcal)")
@@ -159,10 +168,8 @@ def plot_vcal_difference(root_file1, root_file2, hist_name, name, output_file):
     canvas.SaveAs(image_name)
     print(f"Histogram image saved at: {image_name}")
 
-    output_file.cd()
-    canvas_name = f"{name}_Shift"
-    canvas.Write(canvas_name)
-    print(f"Canvas written to ROOT file as {canvas_name}")
+    output_file.write(vcal_diff_hist, f"{name}_Shift_Distribution")
+    output_file.write_canvas(canvas, f"{name}_Shift")
 
     # Close the opened ROOT files
     file1.Close()
@@ -175,11 +182,10 @@ def plot_positions_2d(positions, name_position, output_file):
     Creates and plots a 2D histogram to visualize the bad bump-bonds positions  
     """
     # Create a 2D histogram to visualize positions
-    hist2d = ROOT.TH2F("Bad Bumps w7-24", "", 432, 0, 432, 336, 0, 336)
+    hist2d = book_pixel_map("Bad Bumps w7-24")
     
-    # Fill the histogram with positions that meet the criteria
-    for x, y in positions:
-        hist2d.Fill(x, y)
+    # Fill the histogram with positions (1-based bins) that meet the criteria
+    set_hist_contents(hist2d, index_to_mask(to_index(positions, "bins")))
     
     # Set titles for the axes
     hist2d.SetXTitle("Column")
@@ -207,26 +213,25 @@ def plot_positions_2d(positions, name_position, output_file):
     
     # Save the histogram image to a file
     image_name = f"BadBumps_Positions_withoutT.png"
-    canvas.Save___as(image_name)
+    canvas.SaveAs(image_name)
     print(f"Histogram image saved at: {image_name}")
         
-    # Write the current state of the canvas to the ROOT file
-    output_file.cd()
-    canvas_name = f"BadBumps_Positions"
-    canvas.Write(canvas_name)
-    print(f"Canvas written to ROOT file as {canvas_name}")
+    # Write the histogram (and the canvas, if kept) to the ROOT file
+    output_file.write(hist2d, "BadBumps_Positions_Map")
+    output_file.write_canvas(canvas, "BadBumps_Positions")
 
 
 def plot_threshold_noise_2d(threshold_differences, noise_differences, name, output_file):
     """
     Plots a 2D histogram to visualize the relationship between threshold and noise shifts.
     """
-    # Create a 2D histogram with specified bin ranges and numbers
-    vcal_diff_hist_2d = ROOT.TH2F("Threshold vs Noise Shift", "", 2000, -1800, 1800, 2000, -200, 200)
-
-    # Fill the histogram with difference data
-    for i in range(len(threshold_differences)):
-        vcal_diff_hist_2d.Fill(threshold_differences[i], noise_differences[i])
+    # Bin all the difference pairs at once and keep the running moments; the binning follows the quantiles of the shifts
+    threshold_sketch = QuantileSketch().update(threshold_differences)
+    noise_sketch = QuantileSketch().update(noise_differences)
+    correlation = ShiftCorrelation.adaptive(threshold_sketch, noise_sketch, (-40, 40), (-15, 15))
+    correlation.add(threshold_differences, noise_differences)
+    vcal_diff_hist_2d = correlation.to_th2("Threshold vs Noise Shift")
+    print(f"Threshold-noise shift correlation: {correlation.correlation():.3f}")
         
     # Set titles for the axes
     vcal_diff_hist_2d.SetXTitle(f"Threshold Shift (#DeltaVcal)")
@@ -264,11 +269,9 @@ def plot_threshold_noise_2d(threshold_differences, noise_differences, name, outp
     canvas.SaveAs(image_name)
     print(f"Histogram image saved at: {image_name}")
         
-    # Write the canvas to the output ROOT file
-    output_file.cd()
-    canvas_name = f"Threshold_vs_Noise_Shift"
-    canvas.Write(canvas_name)
-    print(f"Canvas written to ROOT file as {canvas_name}")
+    # Write the histogram (and the canvas, if kept) to the output ROOT file
+    output_file.write(vcal_diff_hist_2d, "Threshold_vs_Noise_Shift_Map")
+    output_file.write_canvas(canvas, "Threshold_vs_Noise_Shift")
 
 
 def load_positions_from_file():
@@ -300,35 +303,27 @@ def compare_positions(positions_xrays, positions_fwd_reverse, name_position, out
     canvas.SetLeftMargin(0.12)
     canvas.SetRightMargin(0.1)
     
-    # Histogram settings
-    nx, ny = 432, 336  # assuming max X and Y values from your data
-    bump_bonds = ROOT.TH2F("Bump Bonds", "", nx, 0, nx, ny, 0, ny)
+    # Histogram with the RD53B matrix binning
+    bump_bonds = book_pixel_map("Bump Bonds")
     bump_bonds.SetStats(0)  # Disable the stats box
     
-    # Define sets for easy comparison
-    set_xrays = set(positions_xrays)
-    set_fwd_reverse = set(positions_fwd_reverse)
+    # Both position lists are 1-based bins: compare them as linear pixel indices
+    index_xrays = to_index(positions_xrays, "bins")
+    index_fwd_reverse = to_index(positions_fwd_reverse, "bins")
 
     # Find common and unique positions
-    common_positions = set_xrays.intersection(set_fwd_reverse)
-    unique_fwd_reverse = set_fwd_reverse - set_xrays
-    unique_xrays = set_xrays - set_fwd_reverse
+    common_positions = np.intersect1d(index_xrays, index_fwd_reverse, assume_unique=True)
+    unique_fwd_reverse = np.setdiff1d(index_fwd_reverse, index_xrays, assume_unique=True)
+    unique_xrays = np.setdiff1d(index_xrays, index_fwd_reverse, assume_unique=True)
 
     # Fill the histogram with different colors for different categories
-    count_common = 0
-    count_fwd = 0
-    count_xrays = 0
-    for x, y in common_positions:
-        bump_bonds.Fill(x, y, 3)  # Common positions in red
-        count_common += 1
-
-    for x, y in unique_fwd_reverse:
-        bump_bonds.Fill(x, y, 2)  # Fwd_reverse only in blue
-        count_fwd += 1
-
-    for x, y in unique_xrays:
-        bump_bonds.Fill(x, y, 1)  # Xrays only in green
-        count_xrays += 1
+    labels = 3 * index_to_mask(common_positions)  # Common positions in red
+    labels += 2 * index_to_mask(unique_fwd_reverse)  # Fwd_reverse only in blue
+    labels += index_to_mask(unique_xrays)  # Xrays only in green
+    count_common = len(common_positions)
+    count_fwd = len(unique_fwd_reverse)
+    count_xrays = len(unique_xrays)
+    set_hist_contents(bump_bonds, labels, entries=count_common + count_fwd + count_xrays)
       
     # Display counts for debug and analysis purposes  
     print(f"Common: {count_common}, Xrays: {count_xrays}, Fwd:{count_fwd}")
@@ -363,9 +358,9 @@ def compare_positions(positions_xrays, positions_fwd_reverse, name_position, out
     box_blue.SetFillColor(ROOT.kBlue)
     box_red.SetFillColor(ROOT.kRed)
    
-    legend.AddEntry(box_red, "Common Bump Bonds: 123", "f")
-    legend.AddEntry(box_blue, "Fwd_Reverse Only: 8", "f")
-    legend.AddEntry(box_green, "Xrays Only: 2", "f")
+    legend.AddEntry(box_red, f"Common Bump Bonds: {count_common}", "f")
+    legend.AddEntry(box_blue, f"Fwd_Reverse Only: {count_fwd}", "f")
+    legend.AddEntry(box_green, f"Xrays Only: {count_xrays}", "f")
     legend.Draw()
     
     # Update the canvas and save the result
@@ -377,11 +372,11 @@ def compare_positions(positions_xrays, positions_fwd_reverse, name_position, out
     canvas.SaveAs(image_name)
     print(f"Histogram image saved at: {image_name}")
         
-    # Write the current state of the canvas to the ROOT file
-    output_file.cd()
-    canvas_name = f"{name_position}_Bump_Bonds"
-    canvas.Write(canvas_name)
-    print(f"Canvas written to ROOT file as {canvas_name}")    
+    # Write the comparison map (1 Xrays only, 2 Fwd_Reverse only, 3 common) and the counts to the ROOT file
+    output_file.write(bump_bonds, f"{name_position}_Bump_Bonds_Map")
+    output_file.write_table(f"{name_position}_Bump_Bonds_Counts",
+                            {"common": [count_common], "fwd_reverse": [count_fwd], "xrays": [count_xrays]})
+    output_file.write_canvas(canvas, f"{name_position}_Bump_Bonds")
     
     
 def main():
@@ -393,8 +388,8 @@ def main():
     ROOT.gStyle.SetPalette(ROOT.kRainBow)  # Set the color palette to Rainbow for visual clarity
     ROOT.gStyle.SetNumberContours(255)  # Increase the number of contours to enhance visual granularity
 
-    # Create or open a ROOT file to store the results of the analysis    
-    output_file = ROOT.TFile("Fwd-reverse.root", "RECREATE")
+    # Create a compressed ROOT file to store the results of the analysis (canvases only with --keep-canvases)
+    output_file = OutputWriter("Fwd-reverse.root", **parse_output_options(sys.argv[1:]))
     if output_file.IsOpen():
         print("ROOT file opened successfully.")
 
@@ -411,8 +406,9 @@ def main():
         name_thrnoise = "D_B(0)_O(0)_H(0)_ThrNoise2D_Chip(15)"
 
         # Calculate the differences between corresponding histograms in different ROOT files
-        threshold_differences, positions_threshold = plot_vcal_difference(root_file1_24, root_file2_24, name_thr_2D, "Threshold", output_file)
-        noise_differences, positions_noise = plot_vcal_difference(root_file1_24, root_file2_24, name_noise_2D, "Noise", output_file)
+        neighbour_size = parse_neighbour_size(sys.argv[1:])
+        threshold_differences, positions_threshold = plot_vcal_difference(root_file1_24, root_file2_24, name_thr_2D, "Threshold", output_file, neighbour_size)
+        noise_differences, positions_noise = plot_vcal_difference(root_file1_24, root_file2_24, name_noise_2D, "Noise", output_file, neighbour_size)
 
         # Plot 2D histograms if differences were successfully calculated
         if threshold_differences and noise_differences:
@@ -420,6 +416,7 @@ def main():
         
         # Compare positions from threshold and noise differences
         positions_fwd_reverse = []
+        positions_noise = set(positions_noise)
         for pos_thresh in positions_threshold:
             if pos_thresh in positions_noise:
                 positions_fwd_reverse.append(pos_thresh)
@@ -431,8 +428,7 @@ def main():
         positions_xrays = load_positions_from_file()
         compare_positions(positions_xrays, positions_fwd_reverse, "Plot_2D", output_file)
     
-        # Finalize by writing and closing the ROOT file
-        output_file.Write()
+        # Finalize by closing the ROOT file
         output_file.Close()
         print("ROOT file closed successfully.")
     else:
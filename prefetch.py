@@ -0,0 +1,121 @@
+import io
+import time
+import queue
+import pickle
+import functools
+import multiprocessing
+import ROOT
+
+
+class _RootPickler(pickle.Pickler):
+    """
+    Pickles ROOT objects together with their class name: unpickling a histogram of a class that PyROOT has not
+    bound yet in the receiving process crashes, so the class has to be looked up first.
+    """
+
+    def persistent_id(self, obj):
+        if isinstance(obj, ROOT.TObject):
+            return obj.ClassName(), pickle.dumps(obj)
+        return None
+
+
+class _RootUnpickler(pickle.Unpickler):
+
+    def persistent_load(self, pid):
+        class_name, data = pid
+        functools.reduce(getattr, class_name.split("::"), ROOT)
+        return pickle.loads(data)
+
+
+def _dumps(entry):
+    buffer = io.BytesIO()
+    _RootPickler(buffer).dump(entry)
+    return buffer.getvalue()
+
+
+def _loads(data):
+    return _RootUnpickler(io.BytesIO(data)).load()
+
+
+def _reader(items, load, loaded):
+    """
+    Body of the reader process: loads the items in order and queues them pickled, as (item, result, error).
+    Pickling here turns a result that cannot be sent back into an error of its own item.
+    """
+    for item in items:
+        try:
+            entry = _dumps((item, load(item), None))
+        except Exception as error:
+            entry = _dumps((item, None, error))
+        loaded.put(entry)
+    loaded.put(None)
+
+
+def prefetch(items, load, depth=2):
+    """
+    Yields (item, load(item)) in order while a reader process already loads the following items.
+    The reads run in a separate process because PyROOT holds the GIL during C++ calls: a reader thread would wait
+    for every Draw/SaveAs of the main thread. load() must return picklable results (detached histograms, arrays).
+    At most `depth` loaded items wait in the queue, which caps the memory held by the read-ahead.
+    An exception raised by load() is re-raised in the consumer when its item is reached.
+    """
+    loaded = multiprocessing.Queue(maxsize=depth)
+    process = multiprocessing.Process(target=_reader, args=(list(items), load, loaded), name="prefetch-reader",
+                                      daemon=True)
+    process.start()
+    try:
+        while True:
+            try:
+                entry = loaded.get(timeout=1)
+            except queue.Empty:
+                if process.is_alive():
+                    continue
+                # The reader may have exited right after flushing its last entries
+                try:
+                    entry = loaded.get(timeout=1)
+                except queue.Empty:
+                    raise RuntimeError(f"Prefetch reader exited with code {process.exitcode}") from None
+            if entry is None:
+                break
+            item, result, error = _loads(entry)
+            if error is not None:
+                raise error
+            yield item, result
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        loaded.close()
+
+
+def _delayed(load, delay, item):
+    time.sleep(delay)
+    return load(item)
+
+
+def slow_loader(load, delay):
+    """
+    Wraps a loader so every call first waits `delay` seconds: a local stand-in for the latency of a network disk.
+    It only models the waiting, the reads themselves still come from the local disk.
+    """
+    if not delay:
+        return load
+    return functools.partial(_delayed, load, delay)
+
+
+def parse_prefetch_options(arguments):
+    """
+    Splits the --prefetch[=depth] and --read-delay=seconds options from the input arguments.
+    Returns (inputs, prefetch depth or 0, read delay).
+    """
+    depth, delay, inputs = 0, 0.0, []
+    for argument in arguments:
+        if argument == "--prefetch":
+            depth = 2
+        elif argument.startswith("--prefetch="):
+            depth = int(argument.split("=", 1)[1])
+        elif argument.startswith("--read-delay="):
+            delay = float(argument.split("=", 1)[1])
+        else:
+            inputs.append(argument)
+    return inputs, depth, delay
@@ -0,0 +1,112 @@
+import numpy as np
+
+# Capacity ratio between consecutive compactor levels of the sketch
+LEVEL_RATIO = 2 / 3
+
+
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch (KLL-style compactors). Level h keeps items that stand for 2^h values each;
+    when a level overflows it is sorted and every other item (random offset) moves up one level. The rank error is
+    about 1/k of the number of values, with memory of a few k items whatever the number of values added, and
+    sketches of different runs, chips or modules merge into one.
+    """
+
+    def __init__(self, k=2000, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * LEVEL_RATIO ** depth)), 2)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # With an odd count one item stays at this level
+                kept, paired = items[:len(items) % 2], items[len(items) % 2:]
+                promoted = paired[self._rng.integers(2)::2]
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted))
+                self.levels[level] = kept
+            level += 1
+
+    def update(self, values):
+        """
+        Adds a batch of values (any shape); NaN and infinite values are ignored.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return self
+        self.n += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """
+        Folds another sketch into this one.
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate((self.levels[level], items))
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, quantiles):
+        """
+        Estimated values at the given quantile levels (scalar or array); levels 0 and 1 give the exact extremes.
+        """
+        quantiles = np.asarray(quantiles, dtype=np.float64)
+        if self.n == 0:
+            return np.full(quantiles.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items)
+        items, cumulative = items[order], np.cumsum(weights[order])
+        index = np.searchsorted(cumulative, quantiles * cumulative[-1], side="left")
+        result = items[np.clip(index, 0, len(items) - 1)]
+        result = np.where(quantiles <= 0, self.min, np.where(quantiles >= 1, self.max, result))
+        return result if result.ndim else float(result)
+
+    def size(self):
+        """
+        Number of items held by the sketch.
+        """
+        return sum(len(level) for level in self.levels)
+
+
+def adaptive_binning(sketch, coverage=(0.001, 0.999), include=(), margin=0.05, min_bins=20, max_bins=2000):
+    """
+    Histogram binning from a sketch: the range covers the central `coverage` quantiles (plus any value of `include`,
+    e.g. the selection windows drawn on the plot) with a small margin, and the bin width follows the
+    Freedman-Diaconis rule 2 IQR / n^(1/3). Values outside the range go to the under/overflow bins.
+    Returns (number of bins, low edge, high edge).
+    """
+    if sketch.n == 0:
+        return min_bins, -1.0, 1.0
+    low, q25, q75, high = sketch.quantile([coverage[0], 0.25, 0.75, coverage[1]])
+    for value in include:
+        low, high = min(low, value), max(high, value)
+    span = high - low
+    if span <= 0:
+        return min_bins, low - 1.0, high + 1.0
+    low, high = low - margin * span, high + margin * span
+    width = 2 * (q75 - q25) / np.cbrt(sketch.n)
+    bins = int(np.ceil((high - low) / width)) if width > 0 else max_bins
+    return int(np.clip(bins, min_bins, max_bins)), float(low), float(high)
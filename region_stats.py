@@ -0,0 +1,213 @@
+import ROOT
+import sys
+import os
+import re
+import csv
+import numpy as np
+
+from pixel_arrays import N_ROWS, N_COLS, CORE_SIZE, block_view, set_hist_contents
+from pixel_geometry import to_index, index_to_mask
+from pixel_classifier import read_chip_maps
+from mask_writer import read_pixel_field
+from compact_output import OutputWriter, parse_output_options
+from shared_maps import map_shared
+
+# Per-region quantities, with the Z axis title of their map
+REGION_QUANTITIES = {
+    "threshold_mean": "Mean Threshold (#DeltaVcal)",
+    "threshold_std": "Threshold #sigma (#DeltaVcal)",
+    "noise_mean": "Mean Noise (#DeltaVcal)",
+    "noise_std": "Noise #sigma (#DeltaVcal)",
+    "missing_bumps": "Missing Bumps",
+    "problematic_bumps": "Problematic Bumps",
+    "masked_fraction": "Masked Fraction",
+}
+
+
+def block_moments(values, valid, block=CORE_SIZE):
+    """
+    Number of valid pixels, mean and standard deviation of every block of a map or stack of maps.
+    Invalid pixels are left out; blocks without valid pixels get NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.asarray(valid, dtype=bool) & np.isfinite(values)
+    blocks = block_view(np.where(valid, values, 0.0), block)
+    weights = block_view(valid, block)
+    count = weights.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = blocks.sum(axis=-1) / count
+        # Second pass around the block mean, to avoid the cancellation of sum(x^2) - n mean^2
+        variance = (((blocks - mean[..., None]) * weights) ** 2).sum(axis=-1) / count
+    return count, mean, np.sqrt(variance)
+
+
+def region_statistics(threshold=None, noise=None, missing=None, problematic=None, masked=None, block=CORE_SIZE):
+    """
+    Per-block statistics of one chip, or of a whole module when the inputs are (chips, rows, columns) stacks.
+    Pixels that are masked or without a fit (value 0) are left out of the threshold and noise moments.
+    Returns {quantity: (..., block rows, block columns) array} with the REGION_QUANTITIES that could be computed.
+    """
+    maps = [m for m in (threshold, noise, missing, problematic, masked) if m is not None]
+    if not maps:
+        raise ValueError("At least one map is needed")
+    shape = np.shape(maps[0])
+    masked = np.zeros(shape, dtype=bool) if masked is None else np.asarray(masked, dtype=bool)
+
+    regions = {}
+    for quantity, values in (("threshold", threshold), ("noise", noise)):
+        if values is not None:
+            _, regions[f"{quantity}_mean"], regions[f"{quantity}_std"] = \
+                block_moments(values, ~masked & (np.asarray(values) != 0), block)
+    if missing is not None:
+        regions["missing_bumps"] = block_view(np.asarray(missing, dtype=bool), block).sum(axis=-1)
+    if problematic is not None:
+        regions["problematic_bumps"] = block_view(np.asarray(problematic, dtype=bool), block).sum(axis=-1)
+    regions["masked_fraction"] = block_view(masked, block).mean(axis=-1)
+    return regions
+
+
+def chip_region_statistics(maps, block=CORE_SIZE):
+    """
+    region_statistics of one chip from its read_chip_maps entry, with the chip's own "Missing", "Problematic" and
+    "Masked" maps when they were added to it.
+    """
+    return region_statistics(maps.get("Threshold2D"), maps.get("Noise2D"), maps.get("Missing"),
+                             maps.get("Problematic"), maps.get("Masked"), block)
+
+
+def chip_files(text, chips, option):
+    """
+    Per-chip files of an option given as "12:file12.txt,13:file13.txt". A plain path is only accepted when the
+    inputs hold a single chip, since the file describes one chip. Returns {chip: path}.
+    """
+    entries = text.split(",")
+    if all(re.match(r"\d+:", entry) for entry in entries):
+        files = {int(chip): path for chip, path in (entry.split(":", 1) for entry in entries)}
+        for chip in sorted(set(files) - set(chips)):
+            print(f"--{option}: no maps of chip {chip} in the inputs, {files.pop(chip)} ignored")
+        return files
+    if len(chips) > 1:
+        raise ValueError(f"--{option} describes a single chip, but the inputs have chips {sorted(chips)}; "
+                         f"give one file per chip as --{option}=chip:file,chip:file")
+    return {chip: text for chip in chips}
+
+
+def read_bump_positions(filename):
+    """
+    Reads a Bump_bonds_Xray.txt file (1-based "x, y" bins under "Missing Positions:" and "Problematic Positions:")
+    into (missing, problematic) boolean (rows, columns) maps.
+    """
+    positions = {"missing": [], "problematic": []}
+    section = None
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line.endswith("Positions:"):
+                section = line.split()[0].lower()
+                continue
+            parts = line.split(",")
+            if section in positions and len(parts) == 2:
+                positions[section].append((int(parts[0]), int(parts[1])))
+    return (index_to_mask(to_index(positions["missing"], "bins")),
+            index_to_mask(to_index(positions["problematic"], "bins")))
+
+
+def region_map(values, name, block=CORE_SIZE):
+    """
+    Books a TH2F with one bin per block, spanning the pixel matrix so the axes stay in pixel units.
+    """
+    n_block_rows, n_block_cols = values.shape
+    hist = ROOT.TH2F(name, "", n_block_cols, 0, N_COLS, n_block_rows, 0, N_ROWS)
+    hist.SetDirectory(0)
+    return set_hist_contents(hist, np.nan_to_num(values), entries=int(np.isfinite(values).sum()))
+
+
+def draw_region_map(hist, z_title, canvas, output_folder):
+    """
+    Draws a region map with the colour scale and saves it as an image.
+    """
+    canvas.cd()
+    canvas.SetLeftMargin(0.12)
+    canvas.SetRightMargin(0.17)
+    hist.SetStats(0)
+    hist.SetXTitle("Column")
+    hist.SetYTitle("Row")
+    hist.SetZTitle(z_title)
+    hist.GetXaxis().SetTitleSize(34)
+    hist.GetXaxis().SetTitleFont(43)
+    hist.GetYaxis().SetTitleSize(34)
+    hist.GetYaxis().SetTitleFont(43)
+    hist.GetZaxis().SetTitleSize(34)
+    hist.GetZaxis().SetTitleFont(43)
+    hist.GetZaxis().SetTitleOffset(1.8)
+    hist.GetXaxis().SetLabelSize(0.04)
+    hist.GetYaxis().SetLabelSize(0.04)
+    hist.GetZaxis().SetLabelSize(0.04)
+    hist.Draw("COLZ")
+    canvas.Update()
+
+    image_path = os.path.join(output_folder, f"{hist.GetName()}.png")
+    canvas.SaveAs(image_path)
+    print(f"Histogram image saved at: {image_path}")
+
+
+def write_region_table(chip_regions, table_path, block=CORE_SIZE):
+    """
+    Writes one CSV row per chip and block, with the first pixel row/column of the block.
+    """
+    quantities = [q for q in REGION_QUANTITIES if any(q in regions for regions in chip_regions.values())]
+    with open(table_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["chip", "block_row", "block_col", "row", "col"] + quantities)
+        for chip, regions in sorted(chip_regions.items()):
+            n_block_rows, n_block_cols = next(iter(regions.values())).shape
+            for i in range(n_block_rows):
+                for j in range(n_block_cols):
+                    writer.writerow([chip, i, j, i * block, j * block] +
+                                    [regions[q][i, j] if q in regions else "" for q in quantities])
+    print(f"Region table saved: {table_path}")
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if not arguments:
+        print("Usage: python region_stats.py Run_SCurve.root [more.root ...] [--block=8] "
+              "[--bumps=Bump_bonds_Xray.txt | --bumps=12:Bump_bonds_Xray_12.txt,13:...] "
+              "[--config=CMSIT_RD53B.txt | --config=12:CMSIT_RD53B_12.txt,13:...] [--output=Region_stats] [--jobs=4]")
+        sys.exit(1)
+    ROOT.gROOT.SetBatch(True)
+    ROOT.gStyle.SetPalette(ROOT.kRainBow)
+
+    block = int(options.get("block", CORE_SIZE))
+    chip_maps = read_chip_maps(arguments)
+    if not chip_maps:
+        print("No Threshold2D/Noise2D maps found.")
+        sys.exit(1)
+    # X-ray results and configurations belong to one chip each: they are added to the maps of their chip
+    try:
+        bump_files = chip_files(options["bumps"], chip_maps, "bumps") if "bumps" in options else {}
+        config_files = chip_files(options["config"], chip_maps, "config") if "config" in options else {}
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+    for chip, bump_file in bump_files.items():
+        chip_maps[chip]["Missing"], chip_maps[chip]["Problematic"] = read_bump_positions(bump_file)
+    for chip, config_file in config_files.items():
+        chip_maps[chip]["Masked"] = read_pixel_field(config_file, "ENABLE") == 0
+
+    # With --jobs the chips are processed in parallel, reading their maps from shared memory
+    chip_regions = map_shared(chip_region_statistics, chip_maps, (block,), jobs=int(options.get("jobs", 1)))
+
+    output_folder = options.get("output", "Region_stats")
+    os.makedirs(output_folder, exist_ok=True)
+    write_region_table(chip_regions, os.path.join(output_folder, f"Region_stats_{block}x{block}.csv"), block)
+
+    canvas = ROOT.TCanvas("canvas", "canvas", 1150, 800)
+    with OutputWriter(os.path.join(output_folder, f"Region_stats_{block}x{block}.root"),
+                      **parse_output_options(sys.argv[1:])) as output_file:
+        for chip, regions in sorted(chip_regions.items()):
+            for quantity, values in regions.items():
+                hist = region_map(values, f"{quantity}_{block}x{block}_Chip({chip})", block)
+                draw_region_map(hist, REGION_QUANTITIES[quantity], canvas, output_folder)
+                output_file.write(hist)
@@ -0,0 +1,182 @@
+import ROOT
+import sys
+import os
+import re
+import sqlite3
+
+from pixel_arrays import list_canvas_names
+from campaign_summary import parse_run_file, module_from_path, summarize_file
+from masked_noisy_stuck_pix import read_masked_positions
+
+# Catalog used when no database is given; can be overridden with the RUN_CATALOG environment variable
+DEFAULT_CATALOG = os.environ.get("RUN_CATALOG", "run_catalog.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, run INTEGER, scan TEXT, module TEXT, kind TEXT, size INTEGER, mtime REAL
+);
+CREATE TABLE IF NOT EXISTS canvases (path TEXT, name TEXT, chip INTEGER);
+CREATE TABLE IF NOT EXISTS stats (
+    path TEXT, chip INTEGER, quantity TEXT, entries INTEGER, mean REAL, std REAL, defects INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_scan ON files (scan, module, run);
+CREATE INDEX IF NOT EXISTS canvases_path ON canvases (path);
+CREATE INDEX IF NOT EXISTS canvases_chip ON canvases (chip, path);
+CREATE INDEX IF NOT EXISTS stats_path ON stats (path);
+"""
+
+# Fields that can be used in catalog queries, and the column each one maps to
+QUERY_FIELDS = {"run": "f.run", "scan": "f.scan", "module": "f.module", "kind": "f.kind",
+                "chip": "c.chip", "canvas": "c.name"}
+
+
+def open_catalog(db_path=DEFAULT_CATALOG):
+    """
+    Opens (and creates if needed) the SQLite run catalog.
+    """
+    connection = sqlite3.connect(db_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def index_file(connection, path, with_stats=True):
+    """
+    Records one result file: run, scan type, module, canvases, chips and (for .root files) basic per-chip statistics.
+    """
+    run, scan = parse_run_file(path)
+    file_stat = os.stat(path)
+    kind = os.path.splitext(path)[1].lstrip(".")
+    canvases, stats = [], []
+
+    if kind == "root":
+        try:
+            file = ROOT.TFile.Open(path, "READ")
+        except OSError:
+            # Recent PyROOT raises instead of returning a null file
+            file = None
+        if not file or not file.IsOpen():
+            print(f"Could not open file {path}")
+            return False
+        for name in list_canvas_names(file):
+            match = re.search(r"Chip\((\d+)\)", name)
+            canvases.append((path, name, int(match.group(1)) if match else None))
+        file.Close()
+        if with_stats:
+            stats = [(path, row["chip"], row["quantity"], row["entries"], row["mean"], row["std"], row["defects"])
+                     for row in summarize_file(path)]
+    elif kind == "txt":
+        # Chip configurations: the number of disabled pixels is the useful number to keep
+        stats = [(path, None, "Masked", len(read_masked_positions(path)), None, None, None)]
+
+    connection.execute("DELETE FROM canvases WHERE path = ?", (path,))
+    connection.execute("DELETE FROM stats WHERE path = ?", (path,))
+    connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (path, run, scan, module_from_path(path), kind, file_stat.st_size, file_stat.st_mtime))
+    connection.executemany("INSERT INTO canvases VALUES (?, ?, ?)", canvases)
+    connection.executemany("INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?, ?)", stats)
+    return True
+
+
+def build_catalog(campaign_tree, db_path=DEFAULT_CATALOG, with_stats=True):
+    """
+    Scans a campaign tree and updates the catalog incrementally: only new or modified files (size or mtime changed)
+    are read, and files that disappeared are dropped.
+    """
+    connection = open_catalog(db_path)
+    known = {path: (size, mtime) for path, size, mtime in connection.execute("SELECT path, size, mtime FROM files")}
+    seen = set()
+    added, failed, unchanged = 0, 0, 0
+
+    for dirpath, _, filenames in os.walk(campaign_tree):
+        for filename in sorted(filenames):
+            if parse_run_file(filename)[0] is None:
+                continue
+            path = os.path.abspath(os.path.join(dirpath, filename))
+            seen.add(path)
+            file_stat = os.stat(path)
+            if known.get(path) == (file_stat.st_size, file_stat.st_mtime):
+                unchanged += 1
+                continue
+            if index_file(connection, path, with_stats):
+                added += 1
+                connection.commit()
+            else:
+                failed += 1
+
+    # Forget files below this tree that no longer exist
+    root = os.path.abspath(campaign_tree) + os.sep
+    removed = [path for path in known if path.startswith(root) and path not in seen]
+    for path in removed:
+        for table in ("files", "canvases", "stats"):
+            connection.execute(f"DELETE FROM {table} WHERE path = ?", (path,))
+    connection.commit()
+    connection.close()
+    print(f"Catalog {db_path}: {added} files indexed, {failed} could not be read, {len(removed)} removed, "
+          f"{unchanged} unchanged")
+
+
+def parse_query(query):
+    """
+    Turns a query such as "scan=SCurve,module=w7-31,run>15" into an SQL condition and its parameters.
+    Terms are separated by commas; spaces around them and around the operators are ignored.
+    """
+    conditions, parameters = [], []
+    for term in (term.strip() for term in query.split(",")):
+        if not term:
+            continue
+        match = re.match(r"(\w+)\s*(>=|<=|!=|=|>|<)\s*(.+)$", term)
+        if not match or match.group(1) not in QUERY_FIELDS:
+            raise ValueError(f"Invalid catalog query term '{term}' (fields: {', '.join(QUERY_FIELDS)})")
+        field, operator, value = match.groups()
+        if field in ("run", "chip"):
+            try:
+                value = int(value)
+            except ValueError:
+                raise ValueError(f"Invalid catalog query term '{term}': {field} must be an integer") from None
+        conditions.append(f"{QUERY_FIELDS[field]} {operator} ?")
+        parameters.append(value)
+    return " AND ".join(conditions) or "1", parameters
+
+
+def query_catalog(query, db_path=DEFAULT_CATALOG):
+    """
+    Returns the paths of the catalogued files matching a query, ordered by module and run.
+    """
+    if not os.path.exists(db_path):
+        print(f"Run catalog {db_path} not found, build it with: python run_catalog.py build <campaign_tree>")
+        return []
+    condition, parameters = parse_query(query)
+    connection = open_catalog(db_path)
+    rows = connection.execute(
+        f"SELECT DISTINCT f.path FROM files f LEFT JOIN canvases c ON c.path = f.path "
+        f"WHERE {condition} ORDER BY f.module, f.run", parameters).fetchall()
+    connection.close()
+    return [row[0] for row in rows]
+
+
+def resolve_inputs(arguments, db_path=DEFAULT_CATALOG):
+    """
+    Expands command line inputs: plain paths are kept, "catalog:<query>" arguments are replaced by the matching files.
+    """
+    paths = []
+    for argument in arguments:
+        if argument.startswith("catalog:"):
+            paths.extend(query_catalog(argument[len("catalog:"):], db_path))
+        else:
+            paths.append(argument)
+    return paths
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("build", "query"):
+        print("Usage: python run_catalog.py build <campaign_tree> [catalog.sqlite] [--no-stats]")
+        print("       python run_catalog.py query \"scan=SCurve,module=w7-31,run>15\" [catalog.sqlite]")
+        sys.exit(1)
+    ROOT.gROOT.SetBatch(True)
+    arguments = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    db_path = arguments[1] if len(arguments) > 1 else DEFAULT_CATALOG
+    if sys.argv[1] == "build":
+        build_catalog(arguments[0], db_path, with_stats="--no-stats" not in sys.argv)
+    else:
+        for path in query_catalog(arguments[0], db_path):
+            print(path)
@@ -0,0 +1,185 @@
+import ROOT
+import sys
+import os
+import re
+import csv
+import time
+import numpy as np
+
+from pixel_arrays import N_ROWS, N_COLS, iter_canvas_histograms, hist_to_array, array_to_pixel_map
+from campaign_summary import parse_run_file
+
+QUANTITIES = ("Threshold", "Noise")
+METADATA_COLUMNS = ["index", "run", "source", "added"]
+DTYPE = np.dtype("<f4")
+
+
+def chip_directory(store, chip):
+    return os.path.join(store, f"chip_{chip}")
+
+
+def read_metadata(store, chip):
+    """
+    Returns the list of runs stored for a chip, in cube order.
+    """
+    path = os.path.join(chip_directory(store, chip), "runs.csv")
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="") as f:
+        return [{**row, "index": int(row["index"]), "run": int(row["run"])} for row in csv.DictReader(f)]
+
+
+def append_run(store, chip, run, maps, source=""):
+    """
+    Appends one run's Threshold and Noise maps (rows x columns) of a chip to its on-disk cubes.
+    The metadata row is written last, so an interrupted append is ignored when the cube is opened.
+    """
+    directory = chip_directory(store, chip)
+    os.makedirs(directory, exist_ok=True)
+    metadata = read_metadata(store, chip)
+    if any(entry["run"] == run for entry in metadata):
+        print(f"Run {run} of chip {chip} already in the history, skipped")
+        return False
+
+    n_runs = len(metadata)
+    for quantity in QUANTITIES:
+        cube_path = os.path.join(directory, f"{quantity}.f32")
+        values = np.asarray(maps[quantity], dtype=DTYPE)
+        if values.shape != (N_ROWS, N_COLS):
+            raise ValueError(f"{quantity} map of run {run} has shape {values.shape}, expected {(N_ROWS, N_COLS)}")
+        with open(cube_path, "ab") as f:
+            # Drop the tail of a previously interrupted append before adding the new slice
+            f.truncate(n_runs * N_ROWS * N_COLS * DTYPE.itemsize)
+            f.write(values.tobytes())
+
+    metadata_path = os.path.join(directory, "runs.csv")
+    new_file = not os.path.exists(metadata_path)
+    with open(metadata_path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=METADATA_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerow({"index": n_runs, "run": run, "source": source, "added": time.strftime("%Y-%m-%d %H:%M:%S")})
+    return True
+
+
+def append_run_file(store, root_file):
+    """
+    Adds the Threshold2D and Noise2D maps of every chip of an SCurve result file to the history store.
+    """
+    run, _ = parse_run_file(root_file)
+    file = ROOT.TFile.Open(root_file, "READ")
+    if run is None or not file or not file.IsOpen():
+        print(f"Could not open file {root_file}")
+        return
+    chips = {}
+    for name, hist in iter_canvas_histograms(file, r"_(Threshold|Noise)2D_Chip\(\d+\)$"):
+        quantity, chip = re.search(r"_(Threshold|Noise)2D_Chip\((\d+)\)$", name).groups()
+        chips.setdefault(int(chip), {})[quantity] = hist_to_array(hist)
+    file.Close()
+    for chip, maps in sorted(chips.items()):
+        if len(maps) == len(QUANTITIES) and append_run(store, chip, run, maps, os.path.abspath(root_file)):
+            print(f"Added run {run}, chip {chip} from {root_file}")
+
+
+def open_history(store, chip, quantity="Threshold"):
+    """
+    Memory-maps the (runs x 336 x 432) cube of one chip read-only, together with its run metadata.
+    Only the slices touched by a query are read from disk.
+    """
+    metadata = read_metadata(store, chip)
+    if not metadata:
+        return None, []
+    cube = np.memmap(os.path.join(chip_directory(store, chip), f"{quantity}.f32"), dtype=DTYPE, mode="r",
+                     shape=(len(metadata), N_ROWS, N_COLS))
+    return cube, metadata
+
+
+def _row_chunks(cube, chunk_rows):
+    # Yields (row slice, float64 block of all runs for those rows); one block is the only data held in memory
+    for start in range(0, cube.shape[1], chunk_rows):
+        rows = slice(start, min(start + chunk_rows, cube.shape[1]))
+        block = np.asarray(cube[:, rows, :], dtype=np.float64)
+        # Failed fits are stored as 0 and do not take part in the statistics
+        block[block == 0] = np.nan
+        yield rows, block
+
+
+def drift_slope(cube, x=None, chunk_rows=16):
+    """
+    Least-squares slope of each pixel versus x (run number or time; default the run index), ignoring missing values.
+    """
+    x = np.arange(cube.shape[0], dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+    slope = np.full(cube.shape[1:], np.nan)
+    xs = x[:, None, None]
+    for rows, block in _row_chunks(cube, chunk_rows):
+        valid = np.isfinite(block)
+        y = np.where(valid, block, 0.0)
+        n = valid.sum(axis=0)
+        sx = (xs * valid).sum(axis=0)
+        sy = y.sum(axis=0)
+        sxx = (xs * xs * valid).sum(axis=0)
+        sxy = (xs * y).sum(axis=0)
+        denominator = n * sxx - sx * sx
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slope[rows] = np.where((n >= 2) & (denominator > 0), (n * sxy - sx * sy) / denominator, np.nan)
+    return slope
+
+
+def max_deviation(cube, baseline=0, chunk_rows=16):
+    """
+    Largest absolute deviation of each pixel from its value in the baseline run (index into the cube).
+    """
+    deviation = np.full(cube.shape[1:], np.nan)
+    for rows, block in _row_chunks(cube, chunk_rows):
+        # fmax skips missing values without warning on pixels that have none
+        deviation[rows] = np.fmax.reduce(np.abs(block - block[baseline]), axis=0)
+    return deviation
+
+
+def walked_out(cube, low, high, chunk_rows=16):
+    """
+    Returns (mask of pixels whose value left [low, high] in any run, index of the first run where it did, -1 if never).
+    """
+    first_run = np.full(cube.shape[1:], -1, dtype=np.int64)
+    for rows, block in _row_chunks(cube, chunk_rows):
+        outside = (block < low) | (block > high)
+        any_outside = outside.any(axis=0)
+        first_run[rows] = np.where(any_outside, outside.argmax(axis=0), -1)
+    return first_run >= 0, first_run
+
+
+def analyze_history(store, chip, quantity, window):
+    """
+    Computes the drift maps of one chip and writes them to History_<quantity>_Chip<chip>.root.
+    """
+    cube, metadata = open_history(store, chip, quantity)
+    if cube is None:
+        print(f"No history stored for chip {chip}")
+        return
+    runs = [entry["run"] for entry in metadata]
+    slope = drift_slope(cube, runs)
+    deviation = max_deviation(cube)
+    outside, first_run = walked_out(cube, *window)
+    print(f"Chip {chip}, {quantity}: {len(runs)} runs ({runs[0]}..{runs[-1]})")
+    print(f"Median drift {np.nanmedian(slope):.3f} #DeltaVCal/run, max deviation {np.nanmax(deviation):.1f}")
+    print(f"Pixels outside [{window[0]}, {window[1]}]: {int(outside.sum())}")
+
+    output_file = ROOT.TFile(f"History_{quantity}_Chip{chip}.root", "RECREATE")
+    array_to_pixel_map(np.nan_to_num(slope), f"{quantity}_Drift_Slope").Write()
+    array_to_pixel_map(np.nan_to_num(deviation), f"{quantity}_Max_Deviation").Write()
+    array_to_pixel_map(np.where(outside, np.asarray(runs)[first_run], 0), f"{quantity}_First_Run_Outside").Write()
+    output_file.Close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[1] not in ("add", "analyze"):
+        print("Usage: python run_history.py add <store> Run000001_SCurve.root [Run000002_SCurve.root ...]")
+        print("       python run_history.py analyze <store> <chip> [Threshold|Noise] [low,high]")
+        sys.exit(1)
+    if sys.argv[1] == "add":
+        for root_file in sys.argv[3:]:
+            append_run_file(sys.argv[2], root_file)
+    else:
+        quantity = sys.argv[4] if len(sys.argv) > 4 else "Threshold"
+        window = tuple(float(v) for v in sys.argv[5].split(",")) if len(sys.argv) > 5 else (300, 500)
+        analyze_history(sys.argv[2], int(sys.argv[3]), quantity, window)
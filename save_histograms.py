@@ -1,45 +1,40 @@
 import ROOT 
 import sys  
 import os   
+import functools
+
+from run_catalog import resolve_inputs
+from pixel_arrays import iter_canvas_histograms
+from prefetch import prefetch, slow_loader, parse_prefetch_options
+from plot_plan import DEFAULT_PLAN, load_plot_plan, apply_style, parse_plan_option
 
-def process_directory(directory, rute=""):
-    """
-    Recursively searches a ROOT directory and its subdirectories for a histogram with a specific name.
-    """
-    for key in directory.GetListOfKeys():
-        obj = key.ReadObj()
-        if obj.IsA().InheritsFrom(ROOT.TDirectory.Class()):
-            # If the object is a directory, recursively process it
-            new_path = f"{rute}/{obj.GetName()}" if rute else obj.GetName()
-            process_directory(obj, new_path)
-        elif obj.IsA().InheritsFrom(ROOT.TCanvas.Class()):
-            # If the object is a canvas, process it
-            process_canvas(obj)
 
-def process_canvas(canvas):
+def read_histograms(root_file, plan_file=DEFAULT_PLAN):
     """
-    Process a TCanvas object and its primitives, such as histograms.
+    Opens a ROOT file and returns detached copies of the histograms of the [[maps]] plot plan as
+    (canvas name, histogram) pairs, so the file can be closed (or read in another process) before rendering.
     """
-    canvasName = canvas.GetName()
+    file = ROOT.TFile.Open(root_file, "READ")
+    if not file or not file.IsOpen():
+        print(f"Could not open file {root_file}")
+        return None
+    histograms = list(iter_canvas_histograms(file, load_plot_plan("maps", plan_file).pattern))
+    file.Close()
+    return histograms
 
-    # Iterate over the primitives of the canvas
-    for prim in canvas.GetListOfPrimitives():
-        if prim.InheritsFrom(ROOT.TH1.Class()):
-            # If the primitive is a histogram, process it
-            process_histogram(canvas, prim)
 
-def process_histogram(canvas, prim):
+def process_histogram(canvasName, prim, output_folder, variant=None):
     """
-    Process a histogram within a TCanvas object. It draws the histogram, adjusts settings, and saves it as an image.
+    Process a histogram read from a TCanvas object. It draws the histogram as a colour map, adjusts settings, and saves it as an image.
+    The variant of the plot plan gives the image suffix, the stats box position and the axis style.
+    Returns False if the histogram has no stats box (the image is still saved, without it).
     """
-    canvasName = canvas.GetName()
+    variant = variant or {}
     name_histogram = prim.GetName()
     
     # Remove the title of the histogram
     prim.SetTitle("")
     
-    if name_histogram != "D_B(0)_O(0)_H(0)_Noise2D_Chip(15)" and name_histogram != "D_B(0)_O(0)_H(0)_Threshold2D_Chip(15)" and name_histogram != "D_B(0)_O(0)_H(0)_ThrNoise2D_Chip(15)":
-        return
     # Prepare the canvas for Threshold vs Noise in this case
     canvas = ROOT.TCanvas("Threshold vs Noise w7-24", "canvas", 1150, 800)
     canvas.SetLeftMargin(0.11)
@@ -48,83 +43,81 @@ def process_histogram(canvas, prim):
     # Draw the histogram
     prim.Draw()
 
-    if canvasName == "D_B(0)_O(0)_H(0)_PixelAlive_Chip(15)" or canvasName == "D_B(0)_O(0)_H(0)_Noise2D_Chip(15)" or canvasName == "D_B(0)_O(0)_H(0)_Threshold2D_Chip(15)" or "D_B(0)_O(0)_H(0)_ThrNoise2D_Chip(15)":
-        # For a specific canvas, adjust the color axis and draw statistics
-        y_min = prim.GetMinimum()
-        y_max = prim.GetMaximum()
-        canvas.SetLogz(0)
-        prim.SetZTitle("Number of Pixels") 
-
-        prim.GetXaxis().SetTitleSize(34)
-        prim.GetXaxis().SetTitleFont(43)
-        prim.GetYaxis().SetTitleSize(34)
-        prim.GetYaxis().SetTitleFont(43)
-        prim.GetZaxis().SetTitleSize(34)
-        prim.GetZaxis().SetTitleFont(43)
-        prim.GetXaxis().SetLabelSize(0.04) 
-        prim.GetYaxis().SetLabelSize(0.04) 
-        prim.GetZaxis().SetLabelSize(0.04)  
-        prim.GetZaxis().SetTitleOffset(1.8)
-        
-        
-        
-        prim.Draw("COLZ")
-        prim.GetZaxis().SetRangeUser(y_min, y_max)
-        
-        # Ajust the palette position
-        palette = prim.GetListOfFunctions().FindObject("palette")
-        if palette:
-            palette.SetX1NDC(0.85)
-            palette.SetX2NDC(0.89)
-        canvas.Update()
+    # Adjust the color axis and draw statistics
+    y_min = prim.GetMinimum()
+    y_max = prim.GetMaximum()
+    canvas.SetLogz(variant.get("log", False))
+    prim.SetZTitle("Number of Pixels") 
+    apply_style(prim, variant.get("style"))
+    
+    prim.Draw("COLZ")
+    prim.GetZaxis().SetRangeUser(y_min, y_max)
+    
+    # Ajust the palette position
+    palette = prim.GetListOfFunctions().FindObject("palette")
+    if palette:
+        palette.SetX1NDC(0.85)
+        palette.SetX2NDC(0.89)
+    canvas.Update()
     
     stats = prim.GetListOfFunctions().FindObject("stats")
-    if  canvasName == "D_B(0)_O(0)_H(0)_Occ1D_Chip(15)" or canvasName == "D_B(0)_O(0)_H(0)_Threhsold_Chip(15)" or canvasName == "D_B(0)_O(0)_H(0)_ToT1D_Chip(15)" or canvasName == "D_B(0)_O(0)_H(0)_TDAC1D_Chip(15)":
-        stats.SetX1NDC(0.68)
-        stats.SetY1NDC(0.71)
-        stats.SetX2NDC(0.88)
-        stats.SetY2NDC(0.86)
-
+    if stats:
+        x1_ndc, y1_ndc, x2_ndc, y2_ndc = variant.get("stats", (0.15, 0.71, 0.35, 0.88))
+        stats.SetX1NDC(x1_ndc)
+        stats.SetY1NDC(y1_ndc)
+        stats.SetX2NDC(x2_ndc)
+        stats.SetY2NDC(y2_ndc)
+        stats.Draw()
+        canvas.Update()
     else:
-        stats.SetX1NDC(0.15)
-        stats.SetY1NDC(0.71)
-        stats.SetX2NDC(0.35)
-        stats.SetY2NDC(0.88)
-    stats.Draw()
-    canvas.Update()
+        print(f"No stats box for {name_histogram}, image saved without it")
 
     # Save the histogram as an image
-    exit_path = os.path.join(output_folder, f"{name_histogram}_withoutT.png")
+    exit_path = os.path.join(output_folder, f"{name_histogram}{variant.get('suffix', '_withoutT')}.png")
     canvas.SaveAs(exit_path)
     print(f"Histogram saved: {exit_path}")
 
     canvas.SetLogz(0)
     canvas.SetLogy(0)
+    return bool(stats)
+
+def save_histograms_png(root_file, histograms, plan_file=DEFAULT_PLAN):
+    """
+    Saves the images of all planned variants of the histograms read from a ROOT file into a folder named after it.
+    Returns the names of the histograms drawn without a stats box.
+    """
+    plan = load_plot_plan("maps", plan_file)
+    base_name = os.path.basename(root_file)
+    root_name = os.path.splitext(base_name)[0]
+    output_folder = os.path.join(os.getcwd(), root_name)
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    missing_stats = []
+    for canvas_name, prim in histograms:
+        for _, variant in plan.variants_for(canvas_name):
+            if not process_histogram(canvas_name, prim, output_folder, variant) and prim.GetName() not in missing_stats:
+                missing_stats.append(prim.GetName())
+    return missing_stats
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python script.py file.root")
+    arguments, plan_file = parse_plan_option(sys.argv[1:])
+    root_files, prefetch_depth, read_delay = parse_prefetch_options(arguments)
+    if not root_files:
+        print("Usage: python script.py file.root [file2.root ...] | \"catalog:scan=SCurve,module=w7-31,run>15\" [--prefetch[=depth]] [--read-delay=seconds] [--plan=plot_plan.toml]")
         sys.exit(1)
+    root_files = resolve_inputs(root_files)
+    load_plot_plan("maps", plan_file)  # Check the plan before reading any file
     
-    for root_file in sys.argv[1:]:
+    if prefetch_depth:
+        # Read file N+1 in the background while file N is rendered
+        loader = slow_loader(functools.partial(read_histograms, plan_file=plan_file), read_delay)
+        loaded = prefetch(root_files, loader, prefetch_depth)
+    else:
+        loaded = ((root_file, read_histograms(root_file, plan_file)) for root_file in root_files)
+
+    for root_file, histograms in loaded:
         print(f"Processing {root_file}")
-        file = ROOT.TFile.Open(root_file, "READ")
-        if not file.IsOpen():
-            print(f"Could not open file {root_file}")
+        if histograms is None:
             continue
-        
-        base_name = os.path.basename(root_file)
-        root_name = os.path.splitext(base_name)[0]
-        output_folder = os.path.join(os.getcwd(), root_name)
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-        
-        process_directory(file)
-        file.Close()
-
-
-
-
-
-
-
+        save_histograms_png(root_file, histograms, plan_file)
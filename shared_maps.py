@@ -0,0 +1,134 @@
+import weakref
+import multiprocessing
+from typing import NamedTuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class MapHandle(NamedTuple):
+    """
+    Picklable reference to an array held in a shared memory segment: a few bytes instead of the array itself.
+    """
+    segment: str
+    shape: tuple
+    dtype: str
+
+
+def _release(segments):
+    for segment in segments:
+        segment.close()
+        segment.unlink()
+    segments.clear()
+
+
+class SharedMapStore:
+    """
+    Owner of the shared memory segments of a set of maps. The parent process puts each map in once and passes the
+    handles to the workers, which attach to the same memory without copying or unpickling the arrays.
+    The segments live until close() (or the end of the `with` block); a store that is garbage collected without
+    being closed still releases them.
+    """
+
+    def __init__(self):
+        self._segments = []
+        self._finalizer = weakref.finalize(self, _release, self._segments)
+
+    def put(self, values):
+        """
+        Copies an array into a new segment and returns its handle.
+        """
+        values = np.ascontiguousarray(values)
+        segment = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        self._segments.append(segment)
+        np.ndarray(values.shape, values.dtype, buffer=segment.buf)[...] = values
+        return MapHandle(segment.name, values.shape, values.dtype.str)
+
+    def share(self, maps):
+        """
+        Replaces every array of a nested dict/list/tuple structure (e.g. the {chip: {kind: array}} of
+        read_chip_maps) by its handle; other values are kept as they are.
+        """
+        if isinstance(maps, np.ndarray):
+            return self.put(maps)
+        if isinstance(maps, dict):
+            return {key: self.share(value) for key, value in maps.items()}
+        if isinstance(maps, (list, tuple)):
+            return type(maps)(self.share(value) for value in maps)
+        return maps
+
+    @property
+    def nbytes(self):
+        return sum(segment.size for segment in self._segments)
+
+    def close(self):
+        """
+        Releases all segments. Arrays attached in other processes must not be used afterwards.
+        """
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AttachedMaps:
+    """
+    Worker side of the store: `with AttachedMaps(handles) as maps` gives the structure with read-only arrays that
+    view the shared segments, and detaches from them at the end of the block.
+    """
+
+    def __init__(self, handles):
+        self.handles = handles
+        self._segments = []
+
+    def _attach(self, handles):
+        if isinstance(handles, MapHandle):
+            segment = shared_memory.SharedMemory(name=handles.segment)
+            self._segments.append(segment)
+            values = np.ndarray(handles.shape, np.dtype(handles.dtype), buffer=segment.buf)
+            values.flags.writeable = False
+            return values
+        if isinstance(handles, dict):
+            return {key: self._attach(value) for key, value in handles.items()}
+        if isinstance(handles, (list, tuple)):
+            return type(handles)(self._attach(value) for value in handles)
+        return handles
+
+    def __enter__(self):
+        return self._attach(self.handles)
+
+    def __exit__(self, *exc):
+        for segment in self._segments:
+            try:
+                segment.close()
+            except BufferError:
+                # Arrays still refer to the segment: it is unmapped together with the last of them
+                pass
+        self._segments.clear()
+
+
+def _call_attached(arguments):
+    function, key, handles, extra = arguments
+    with AttachedMaps((handles, extra)) as (maps, extra):
+        result = function(maps, *extra)
+        del maps, extra
+    return key, result
+
+
+def map_shared(function, maps, extra=(), jobs=1):
+    """
+    Calls function(maps[key], *extra) for every key of a {key: maps} dict (e.g. one chip each) and returns
+    {key: result}. With jobs > 1 the maps, and the arrays of `extra` common to all calls, are put once in shared
+    memory and the calls run in a pool of processes; `function` must then be a module-level function and its
+    results should be small (they are pickled back).
+    """
+    if jobs <= 1 or len(maps) < 2:
+        return {key: function(value, *extra) for key, value in maps.items()}
+    with SharedMapStore() as store:
+        extra = store.share(tuple(extra))
+        tasks = [(function, key, store.share(value), extra) for key, value in maps.items()]
+        with multiprocessing.Pool(min(jobs, len(tasks))) as pool:
+            return dict(pool.imap_unordered(_call_attached, tasks))
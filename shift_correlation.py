@@ -0,0 +1,257 @@
+import ROOT
+import sys
+import re
+import numpy as np
+
+from pixel_arrays import iter_canvas_histograms, hist_to_array, set_hist_contents
+from quantile_sketch import QuantileSketch, adaptive_binning
+
+
+class ShiftCorrelation:
+    """
+    Streaming accumulator for threshold vs noise shifts. Each added run pair is binned in bulk into a fixed 2D grid
+    and folded into running moments, so a whole campaign is summarised without keeping the difference arrays.
+    With sparse=True only the filled bins are kept (bin index, count), which suits fine grids that are mostly empty.
+    """
+
+    def __init__(self, x_bins=2000, x_range=(-1800, 1800), y_bins=2000, y_range=(-200, 200), sparse=False):
+        self.x_edges = np.linspace(x_range[0], x_range[1], x_bins + 1)
+        self.y_edges = np.linspace(y_range[0], y_range[1], y_bins + 1)
+        self.sparse = sparse
+        if sparse:
+            self.bins = np.empty(0, dtype=np.int64)  # Linear index y * x_bins + x of the filled bins
+            self.bin_counts = np.empty(0)
+        else:
+            self.counts = np.zeros((y_bins, x_bins))  # [y, x], same layout as the ROOT bins
+        self.n = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0  # Sum of squared deviations from the mean
+        self.m2_y = 0.0
+        self.c_xy = 0.0  # Sum of co-deviations
+
+    @classmethod
+    def adaptive(cls, x_sketch, y_sketch, x_include=(), y_include=(), sparse=False):
+        """
+        Accumulator whose ranges and bin widths come from quantile sketches of the threshold and noise shifts.
+        """
+        x_bins, x_low, x_high = adaptive_binning(x_sketch, include=x_include)
+        y_bins, y_low, y_high = adaptive_binning(y_sketch, include=y_include)
+        return cls(x_bins, (x_low, x_high), y_bins, (y_low, y_high), sparse)
+
+    def add(self, threshold_shifts, noise_shifts):
+        """
+        Adds one batch of per-pixel (threshold shift, noise shift) pairs.
+        """
+        x = np.asarray(threshold_shifts, dtype=np.float64).ravel()
+        y = np.asarray(noise_shifts, dtype=np.float64).ravel()
+        valid = np.isfinite(x) & np.isfinite(y)
+        x, y = x[valid], y[valid]
+        if x.size == 0:
+            return
+
+        if self.sparse:
+            self._add_sparse(self._bin_index(x, y), None)
+        else:
+            counts, _, _ = np.histogram2d(y, x, bins=(self.y_edges, self.x_edges))
+            self.counts += counts
+
+        # Moments of the batch, then combined with the running ones (Chan et al. pairwise update)
+        mean_x, mean_y = x.mean(), y.mean()
+        dx, dy = x - mean_x, y - mean_y
+        self._combine(x.size, mean_x, mean_y, np.dot(dx, dx), np.dot(dy, dy), np.dot(dx, dy))
+
+    def merge(self, other):
+        """
+        Merges another accumulator with the same binning into this one (e.g. partial sums from other modules).
+        """
+        if not (np.array_equal(self.x_edges, other.x_edges) and np.array_equal(self.y_edges, other.y_edges)):
+            raise ValueError("Cannot merge accumulators with different binning")
+        if self.sparse and other.sparse:
+            self._add_sparse(other.bins, other.bin_counts)
+        elif self.sparse:
+            filled = np.flatnonzero(other.counts)
+            self._add_sparse(filled, other.counts.ravel()[filled])
+        else:
+            self.counts += other.dense_counts()
+        self._combine(other.n, other.mean_x, other.mean_y, other.m2_x, other.m2_y, other.c_xy)
+
+    def _combine(self, n, mean_x, mean_y, m2_x, m2_y, c_xy):
+        if n == 0:
+            return
+        total = self.n + n
+        delta_x = mean_x - self.mean_x
+        delta_y = mean_y - self.mean_y
+        weight = self.n * n / total
+        self.m2_x += m2_x + delta_x * delta_x * weight
+        self.m2_y += m2_y + delta_y * delta_y * weight
+        self.c_xy += c_xy + delta_x * delta_y * weight
+        self.mean_x += delta_x * n / total
+        self.mean_y += delta_y * n / total
+        self.n = total
+
+    def _bin_index(self, x, y):
+        # Linear bin index of the pairs inside the grid; like histogram2d, the upper edge belongs to the last bin
+        nx, ny = len(self.x_edges) - 1, len(self.y_edges) - 1
+        ix = np.minimum(np.searchsorted(self.x_edges, x, side="right") - 1, nx - 1)
+        iy = np.minimum(np.searchsorted(self.y_edges, y, side="right") - 1, ny - 1)
+        inside = (x >= self.x_edges[0]) & (x <= self.x_edges[-1]) & (y >= self.y_edges[0]) & (y <= self.y_edges[-1])
+        return iy[inside] * nx + ix[inside]
+
+    def _add_sparse(self, bins, counts):
+        # Adds (bin, count) pairs, one count per entry when counts is None, keeping one entry per filled bin
+        counts = np.ones(len(bins)) if counts is None else counts
+        bins, inverse = np.unique(np.concatenate((self.bins, bins)), return_inverse=True)
+        self.bin_counts = np.bincount(inverse, weights=np.concatenate((self.bin_counts, counts)))
+        self.bins = bins
+
+    def dense_counts(self):
+        """
+        Returns the [y, x] count array, also for a sparse accumulator.
+        """
+        if not self.sparse:
+            return self.counts
+        nx, ny = len(self.x_edges) - 1, len(self.y_edges) - 1
+        counts = np.zeros(nx * ny)
+        counts[self.bins] = self.bin_counts
+        return counts.reshape(ny, nx)
+
+    def covariance(self):
+        """
+        Returns the sample covariance matrix [[var_x, cov_xy], [cov_xy, var_y]].
+        """
+        if self.n < 2:
+            return np.full((2, 2), np.nan)
+        return np.array([[self.m2_x, self.c_xy], [self.c_xy, self.m2_y]]) / (self.n - 1)
+
+    def correlation(self):
+        """
+        Returns the Pearson correlation coefficient between threshold and noise shifts.
+        """
+        if self.m2_x == 0 or self.m2_y == 0:
+            return np.nan
+        return self.c_xy / np.sqrt(self.m2_x * self.m2_y)
+
+    def to_th2(self, name="Threshold vs Noise Shift"):
+        """
+        Returns the accumulated distribution as a TH2F.
+        """
+        hist = ROOT.TH2F(name, "", len(self.x_edges) - 1, self.x_edges[0], self.x_edges[-1],
+                         len(self.y_edges) - 1, self.y_edges[0], self.y_edges[-1])
+        hist.SetDirectory(0)
+        return set_hist_contents(hist, self.dense_counts(), entries=self.n)
+
+
+def read_shift_maps(root_file1, root_file2, kind):
+    """
+    Returns {chip: difference array} of the <kind>2D maps (Threshold or Noise) of two SCurve files.
+    """
+    pattern = rf"_{kind}2D_Chip\((\d+)\)$"
+    maps = []
+    for root_file in (root_file1, root_file2):
+        file = ROOT.TFile.Open(root_file, "READ")
+        if not file or not file.IsOpen():
+            print(f"Could not open file {root_file}")
+            return {}
+        maps.append({re.search(pattern, name).group(1): hist_to_array(hist)
+                     for name, hist in iter_canvas_histograms(file, pattern)})
+        file.Close()
+    return {chip: maps[0][chip] - maps[1][chip] for chip in maps[0] if chip in maps[1]}
+
+
+def accumulate_run_pairs(run_pairs, correlation=None):
+    """
+    Streams (forward, reverse) SCurve file pairs into a ShiftCorrelation, chip by chip.
+    """
+    if correlation is None:
+        correlation = ShiftCorrelation()
+    for root_file1, root_file2 in run_pairs:
+        threshold_shifts = read_shift_maps(root_file1, root_file2, "Threshold")
+        noise_shifts = read_shift_maps(root_file1, root_file2, "Noise")
+        for chip in sorted(threshold_shifts.keys() & noise_shifts.keys()):
+            correlation.add(threshold_shifts[chip], noise_shifts[chip])
+            print(f"Added {root_file1} - {root_file2}, chip {chip}: {correlation.n} pixels so far")
+    return correlation
+
+
+def sketch_run_pairs(run_pairs):
+    """
+    First pass over (forward, reverse) SCurve file pairs: quantile sketches of the threshold and noise shifts,
+    from which ShiftCorrelation.adaptive chooses the binning.
+    """
+    threshold_sketch, noise_sketch = QuantileSketch(), QuantileSketch()
+    for root_file1, root_file2 in run_pairs:
+        for chip, shifts in read_shift_maps(root_file1, root_file2, "Threshold").items():
+            threshold_sketch.update(shifts)
+        for chip, shifts in read_shift_maps(root_file1, root_file2, "Noise").items():
+            noise_sketch.update(shifts)
+    return threshold_sketch, noise_sketch
+
+
+def draw_correlation(correlation, output_file, image_name="Threshold_vs_Noise_Shift_campaign.png"):
+    """
+    Draws the accumulated threshold vs noise shift distribution and writes it to the output ROOT file.
+    """
+    hist = correlation.to_th2()
+    hist.SetXTitle("Threshold Shift (#DeltaVcal)")
+    hist.SetYTitle("Noise Shift (#DeltaVcal)")
+    hist.SetZTitle("Number of Pixels")
+
+    canvas = ROOT.TCanvas("canvas2d", "2D Vcal Differences", 1150, 800)
+    canvas.SetLeftMargin(0.12)
+    canvas.SetRightMargin(0.15)
+
+    hist.GetXaxis().SetTitleSize(34)
+    hist.GetXaxis().SetTitleFont(43)
+    hist.GetYaxis().SetTitleSize(34)
+    hist.GetYaxis().SetTitleFont(43)
+    hist.GetZaxis().SetTitleSize(34)
+    hist.GetZaxis().SetTitleFont(43)
+    hist.GetZaxis().SetTitleOffset(1)
+    hist.GetXaxis().SetLabelSize(0.04)
+    hist.GetYaxis().SetLabelSize(0.04)
+    hist.GetZaxis().SetLabelSize(0.04)
+    hist.Draw("COLZ")
+
+    # Campaign-level numbers from the running moments
+    cov = correlation.covariance()
+    info = ROOT.TPaveText(0.15, 0.75, 0.45, 0.88, "NDC")
+    info.SetFillColor(0)
+    info.SetBorderSize(1)
+    info.SetTextAlign(12)
+    info.SetTextFont(42)
+    info.AddText(f"Pixels {correlation.n}")
+    info.AddText(f"Mean ({correlation.mean_x:.2f}, {correlation.mean_y:.2f})")
+    info.AddText(f"#rho = {correlation.correlation():.3f}")
+    info.Draw()
+    canvas.Update()
+
+    canvas.SaveAs(image_name)
+    print(f"Histogram image saved at: {image_name}")
+    print(f"Covariance: {cov.tolist()}")
+
+    output_file.cd()
+    hist.Write("Threshold_vs_Noise_Shift")
+    canvas.Write("Threshold_vs_Noise_Shift_Canvas")
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if len(arguments) < 2 or len(arguments) % 2 == 1:
+        print("Usage: python shift_correlation.py fwd1.root rev1.root [fwd2.root rev2.root ...] [--adaptive] [--sparse]")
+        sys.exit(1)
+    pairs = list(zip(arguments[0::2], arguments[1::2]))
+
+    ROOT.gStyle.SetPalette(ROOT.kRainBow)
+    ROOT.gStyle.SetNumberContours(255)
+    ROOT.gStyle.SetOptStat(0)
+
+    if "--adaptive" in sys.argv:
+        # Two passes: sketches of the shifts for the binning, then the filling
+        correlation = ShiftCorrelation.adaptive(*sketch_run_pairs(pairs), sparse="--sparse" in sys.argv)
+    else:
+        correlation = ShiftCorrelation(sparse="--sparse" in sys.argv)
+    correlation = accumulate_run_pairs(pairs, correlation)
+    output_file = ROOT.TFile("Shift_correlation.root", "RECREATE")
+    draw_correlation(correlation, output_file)
+    output_file.Close()
@@ -0,0 +1,127 @@
+import ROOT
+import sys
+import numpy as np
+
+from pixel_arrays import array_to_pixel_map
+from pixel_classifier import read_chip_maps
+from mask_writer import read_pixel_field, rewrite_pixel_field
+from compact_output import OutputWriter, parse_output_options
+
+# Range of the per-pixel TDAC register in the chip configuration
+TDAC_MIN = 0
+TDAC_MAX = 31
+
+
+def measure_slope(threshold_a, tdac_a, threshold_b, tdac_b, valid=None):
+    """
+    Threshold change per TDAC step (DeltaVCal per step, with its sign) measured from two threshold scans taken
+    with different TDAC maps: the median of the per-pixel ratios over the valid pixels whose TDAC changed.
+    """
+    d_tdac = np.asarray(tdac_b, dtype=np.float64) - np.asarray(tdac_a, dtype=np.float64)
+    d_threshold = np.asarray(threshold_b, dtype=np.float64) - np.asarray(threshold_a, dtype=np.float64)
+    usable = (d_tdac != 0) & np.isfinite(d_threshold) & (np.asarray(threshold_a) > 0) & (np.asarray(threshold_b) > 0)
+    if valid is not None:
+        usable &= valid
+    if not usable.any():
+        raise ValueError("No pixel changed its TDAC between the two scans, the slope cannot be measured")
+    return float(np.median(d_threshold[usable] / d_tdac[usable]))
+
+
+def retune_tdac(threshold, tdac, slope, masked=None, target=None, gain=1.0, tdac_range=(TDAC_MIN, TDAC_MAX)):
+    """
+    Computes new per-pixel TDAC values that move every threshold towards the target (the median threshold of the
+    tunable pixels by default). slope is the threshold change per TDAC step; gain < 1 damps the correction when the
+    tuning is iterated. Masked pixels and pixels without a threshold keep their TDAC.
+    Returns (new TDAC map, predicted threshold map, summary dict).
+    """
+    threshold = np.asarray(threshold, dtype=np.float64)
+    tdac = np.asarray(tdac, dtype=np.int64)
+    if threshold.shape != tdac.shape:
+        raise ValueError(f"Threshold map {threshold.shape} and TDAC map {tdac.shape} have different shapes")
+    if slope == 0:
+        raise ValueError("The threshold-per-TDAC-step slope cannot be 0")
+    tunable = np.isfinite(threshold) & (threshold > 0)
+    if masked is not None:
+        tunable &= ~np.asarray(masked, dtype=bool)
+    if not tunable.any():
+        raise ValueError("No tunable pixel (all masked or without threshold)")
+    if target is None:
+        target = float(np.median(threshold[tunable]))
+
+    steps = np.rint(gain * (target - threshold) / slope)
+    new_tdac = np.clip(tdac + np.where(tunable, steps, 0), *tdac_range).astype(np.int64)
+    new_tdac = np.where(tunable, new_tdac, tdac)
+    predicted = np.where(tunable, threshold + (new_tdac - tdac) * slope, threshold)
+
+    # Pixels that wanted to move past the DAC range stay off target
+    wanted = tdac + steps
+    summary = {
+        "target": target,
+        "tunable": int(tunable.sum()),
+        "changed": int((new_tdac != tdac).sum()),
+        "saturated": int((tunable & ((wanted < tdac_range[0]) | (wanted > tdac_range[1]))).sum()),
+        "sigma_before": float(np.std(threshold[tunable])),
+        "sigma_after": float(np.std(predicted[tunable])),
+    }
+    return new_tdac, predicted, summary
+
+
+def write_tdac_config(config_in, new_tdac, config_out=None):
+    """
+    Writes the TDAC rows of a configuration from a (rows, columns) TDAC map; everything else is kept as is.
+    """
+    def transform(column, values):
+        return [str(value) for value in new_tdac[:len(values), column]]
+
+    n_rows = rewrite_pixel_field(config_in, "TDAC", transform, config_out)
+    print(f"{config_out or config_in}: {n_rows} TDAC rows written")
+    return n_rows
+
+
+def chip_threshold(root_file, chip):
+    """
+    Threshold2D map of one chip from an SCurve/Threshold scan file.
+    """
+    maps = read_chip_maps([root_file]).get(int(chip), {})
+    if "Threshold2D" not in maps:
+        raise ValueError(f"Threshold2D map of chip {chip} not found in {root_file}")
+    return maps["Threshold2D"]
+
+
+if __name__ == "__main__":
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+    if len(arguments) < 2 or not ("slope" in options or "reference" in options):
+        print("Usage: python tdac_tuning.py Run_SCurve.root CMSIT_RD53B.txt [--chip=15] "
+              "(--slope=DeltaVCal_per_step | --reference=Run_prev_SCurve.root --reference-config=CMSIT_prev.txt) "
+              "[--target=VCal] [--gain=1] [--tdac-range=0,31] [--output=CMSIT_RD53B_tuned.txt]")
+        sys.exit(1)
+    ROOT.gROOT.SetBatch(True)
+
+    root_file, config = arguments[0], arguments[1]
+    chip = options.get("chip", "15")
+    threshold = chip_threshold(root_file, chip)
+    tdac = read_pixel_field(config, "TDAC")
+    masked = read_pixel_field(config, "ENABLE") == 0
+
+    if "slope" in options:
+        slope = float(options["slope"])
+    else:
+        slope = measure_slope(chip_threshold(options["reference"], chip),
+                              read_pixel_field(options["reference-config"], "TDAC"), threshold, tdac, ~masked)
+        print(f"Measured slope: {slope:.3f} DeltaVCal per TDAC step")
+    tdac_range = tuple(int(v) for v in options.get("tdac-range", f"{TDAC_MIN},{TDAC_MAX}").split(","))
+    target = float(options["target"]) if "target" in options else None
+
+    new_tdac, predicted, summary = retune_tdac(threshold, tdac, slope, masked, target,
+                                               float(options.get("gain", 1.0)), tdac_range)
+    print(f"Chip {chip}: target {summary['target']:.1f}, {summary['changed']}/{summary['tunable']} pixels changed, "
+          f"{summary['saturated']} at the TDAC limits, predicted sigma {summary['sigma_before']:.2f} -> "
+          f"{summary['sigma_after']:.2f} DeltaVCal")
+    write_tdac_config(config, new_tdac, options.get("output"))
+
+    with OutputWriter(f"TDAC_tuning_Chip{chip}.root", **parse_output_options(sys.argv[1:])) as output_file:
+        output_file.write(array_to_pixel_map(tdac, f"TDAC_Current_Chip({chip})"))
+        output_file.write(array_to_pixel_map(new_tdac, f"TDAC_New_Chip({chip})"))
+        output_file.write(array_to_pixel_map(new_tdac - tdac, f"TDAC_Change_Chip({chip})"))
+        output_file.write(array_to_pixel_map(predicted, f"Threshold_Predicted_Chip({chip})"))
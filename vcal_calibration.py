@@ -0,0 +1,79 @@
+import os
+import re
+import json
+from functools import lru_cache
+import numpy as np
+
+# Calibration file shipped next to the scripts; chips without an entry use "default"
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vcal_calibration.json")
+
+# electrons = slope * DeltaVCal + offset for charges (Threshold, SCurve);
+# widths (Noise) only use the slope since the offset cancels
+DEFAULT_CALIBRATION = {"slope": 4.88096, "offset": 64.0, "noise_slope": 4.79768}
+
+
+@lru_cache(maxsize=None)
+def load_calibration(config_file=DEFAULT_CONFIG):
+    """
+    Loads the per-chip VCal calibration constants from a JSON file, once per file.
+    Returns a dict keyed by chip id (as a string) plus a "default" entry.
+    """
+    calibration = {"default": dict(DEFAULT_CALIBRATION)}
+    if config_file and os.path.exists(config_file):
+        with open(config_file) as f:
+            for chip, constants in json.load(f).items():
+                calibration[str(chip)] = {**calibration["default"], **constants}
+    return calibration
+
+
+def chip_from_name(name):
+    """
+    Extracts the chip id from a DAQ object name such as D_B(0)_O(0)_H(0)_Noise1D_Chip(15).
+    """
+    match = re.search(r"Chip\((\d+)\)", name)
+    return int(match.group(1)) if match else None
+
+
+def chip_calibration(chip, config_file=DEFAULT_CONFIG):
+    """
+    Returns the calibration constants of one chip, falling back to the default ones.
+    """
+    calibration = load_calibration(config_file)
+    return calibration.get(str(chip), calibration["default"])
+
+
+def _constants(chips, quantity, config_file):
+    # Slope and offset for a single chip or for a sequence of chips (one per stacked map)
+    chips_array = np.atleast_1d(np.asarray(chips, dtype=object))
+    constants = [chip_calibration(chip, config_file) for chip in chips_array]
+    if quantity == "Noise":
+        slopes = np.array([c["noise_slope"] for c in constants])
+        offsets = np.zeros(len(constants))
+    else:
+        slopes = np.array([c["slope"] for c in constants])
+        offsets = np.array([c["offset"] for c in constants])
+    if np.ndim(chips) == 0:
+        return slopes[0], offsets[0]
+    return slopes, offsets
+
+
+def to_electrons(values, chips=None, quantity="Threshold", config_file=DEFAULT_CONFIG):
+    """
+    Converts DeltaVCal values to electrons in one vectorized step. `values` can be a scalar, a single map or a stack
+    of maps; for a stack, `chips` gives the chip of each map along the first axis.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    slopes, offsets = _constants(chips, quantity, config_file)
+    if np.ndim(slopes) == 1:
+        # Broadcast one pair of constants over each map of the stack
+        shape = (-1,) + (1,) * (values.ndim - 1)
+        slopes, offsets = slopes.reshape(shape), offsets.reshape(shape)
+    return values * slopes + offsets
+
+
+def axis_to_electrons(x_min, x_max, chip=None, quantity="Threshold", config_file=DEFAULT_CONFIG):
+    """
+    Returns the electron values at the ends of a DeltaVCal axis, as used for the secondary TGaxis.
+    """
+    e_min, e_max = to_electrons([x_min, x_max], chip, quantity, config_file)
+    return float(e_min), float(e_max)